@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+from parsing import parse_valor
+
+# Dimensões dos totais mantidos por dia
+VENDA_PRODUTO = 'venda_produto'
+VENDA_PAGAMENTO = 'venda_pagamento'
+COMPRA_LOCAL = 'compra_local'
+PESSOAL_CATEGORIA = 'pessoal_categoria'
+
+SEM_INFORMACAO = 'Não informado'
+
+def day_key(data):
+    """Converte '18/10/2026' em '2026-10-18' (None se a data for inválida)."""
+    try:
+        return datetime.strptime(str(data).strip(), "%d/%m/%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def period_range(periodo, today=None):
+    """Primeiro e último dia (inclusive) do período: hoje, semana atual ou mês atual."""
+    today = today or date.today()
+    if periodo == 'hoje':
+        start = today
+    elif periodo == 'semana':
+        start = today - timedelta(days=today.weekday())
+    else:
+        start = today.replace(day=1)
+    return start, today
+
+
+def _number(valor):
+    """Valor de uma célula lida sem formatação (número) ou como texto ('20,00')."""
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    return parse_valor(str(valor))
+
+
+class Aggregates:
+    """
+    Totais por dia de vendas (por produto e por forma de pagamento), compras
+    (por local) e gastos pessoais (por categoria), guardados em SQLite.
+
+    Os totais acompanham o ledger: `catch_up` aplica só os registros com
+    sequência maior que a última já aplicada de cada tipo, com custo O(1) por
+    registro. Um relatório soma apenas os dias do período pedido, então o
+    tempo não depende do tamanho do histórico. A reconstrução a partir da
+    planilha (`rebuild`) só é feita na primeira execução ou quando pedida.
+    """
+
+    def __init__(self, path='aggregates.db'):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS totals (
+                day TEXT NOT NULL,
+                dimension TEXT NOT NULL,
+                key TEXT NOT NULL,
+                amount REAL NOT NULL DEFAULT 0,
+                quantity REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, dimension, key)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS applied (
+                tipo TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _add(conn, day, dimension, key, amount, quantity=0):
+        conn.execute(
+            'INSERT INTO totals (day, dimension, key, amount, quantity) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(day, dimension, key) DO UPDATE SET '
+            'amount = amount + excluded.amount, quantity = quantity + excluded.quantity',
+            (day, dimension, key or SEM_INFORMACAO, amount, quantity))
+
+    def _apply(self, conn, record):
+        day = day_key(record.data)
+        if day is None:
+            return
+        if record.tipo == 'venda':
+            for item in record.itens:
+                self._add(conn, day, VENDA_PRODUTO, item.produto, item.valor_total, item.quantidade)
+            self._add(conn, day, VENDA_PAGAMENTO, record.pagamento, record.valor_total, 1)
+        elif record.tipo == 'compra':
+            self._add(conn, day, COMPRA_LOCAL, record.local, record.valor_total, 1)
+        elif record.tipo == 'pessoal':
+            self._add(conn, day, PESSOAL_CATEGORIA, record.categoria, record.valor, 1)
+
+    def applied_seq(self, tipo):
+        row = self._connect().execute('SELECT seq FROM applied WHERE tipo = ?', (tipo,)).fetchone()
+        return row[0] if row else 0
+
+    def catch_up(self, ledger, decode, tipos=('venda', 'compra', 'pessoal'), batch_size=500,
+                 tenant=None):
+        """
+        Aplica os registros do ledger (só os do inquilino `tenant`, se dado)
+        ainda não contabilizados. Retorna quantos foram aplicados.
+        """
+        conn = self._connect()
+        total = 0
+        for tipo in tipos:
+            while True:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    row = conn.execute('SELECT seq FROM applied WHERE tipo = ?', (tipo,)).fetchone()
+                    batch = ledger.read(tipo, row[0] if row else 0, batch_size, tenant=tenant)
+                    for _, payload in batch:
+                        self._apply(conn, decode(payload))
+                    if batch:
+                        conn.execute(
+                            'INSERT INTO applied (tipo, seq) VALUES (?, ?) '
+                            'ON CONFLICT(tipo) DO UPDATE SET seq = excluded.seq',
+                            (tipo, batch[-1][0]))
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+                total += len(batch)
+                if len(batch) < batch_size:
+                    break
+        return total
+
+    def is_built(self):
+        row = self._connect().execute("SELECT value FROM meta WHERE name = 'built_at'").fetchone()
+        return row is not None
+
+    def rebuild(self, vendas_rows, compras_rows, pessoal_rows, applied):
+        """
+        Recalcula todos os totais a partir das linhas das abas (sem cabeçalho).
+        `applied` informa, por tipo, até qual sequência do ledger as linhas já
+        incluem os registros.
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM totals')
+            for row in vendas_rows:
+                if len(row) < 5 or not day_key(row[0]):
+                    continue
+                day = day_key(row[0])
+                valor = _number(row[4])
+                self._add(conn, day, VENDA_PRODUTO, str(row[1]), valor, _number(row[2]))
+                # Cada linha é um item; a contagem por pagamento vira número de itens
+                pagamento = str(row[5]) if len(row) > 5 else ''
+                self._add(conn, day, VENDA_PAGAMENTO, pagamento, valor, 1)
+            for row in compras_rows:
+                if len(row) < 4 or not day_key(row[0]):
+                    continue
+                # A aba Via 1 não guarda o local da compra
+                self._add(conn, day_key(row[0]), COMPRA_LOCAL, SEM_INFORMACAO, _number(row[3]), 1)
+            for row in pessoal_rows:
+                if len(row) < 4 or not day_key(row[0]):
+                    continue
+                self._add(conn, day_key(row[0]), PESSOAL_CATEGORIA, str(row[2]), _number(row[3]), 1)
+            for tipo, seq in applied.items():
+                conn.execute(
+                    'INSERT INTO applied (tipo, seq) VALUES (?, ?) '
+                    'ON CONFLICT(tipo) DO UPDATE SET seq = excluded.seq', (tipo, seq))
+            conn.execute(
+                "INSERT INTO meta (name, value) VALUES ('built_at', ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                (datetime.now().isoformat(),))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def report(self, start, end):
+        """Totais do período [start, end] agrupados por dimensão: {dimensão: [(chave, valor, qtd)]}."""
+        rows = self._connect().execute(
+            'SELECT dimension, key, SUM(amount), SUM(quantity) FROM totals '
+            'WHERE day BETWEEN ? AND ? GROUP BY dimension, key ORDER BY SUM(amount) DESC',
+            (start.isoformat(), end.isoformat())).fetchall()
+        result = {VENDA_PRODUTO: [], VENDA_PAGAMENTO: [], COMPRA_LOCAL: [], PESSOAL_CATEGORIA: []}
+        for dimension, key, amount, quantity in rows:
+            result.setdefault(dimension, []).append((key, amount, quantity))
+        return result
+
+
+def main():
+    """
+    Linha de comando dos totais.
+      python aggregates.py rebuild   recalcula os totais a partir da planilha configurada
+    """
+    import sys
+    import app
+
+    if sys.argv[1:] == ['rebuild']:
+        app.rebuild_aggregates()
+        print("Totais recalculados")
+    else:
+        print(main.__doc__)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,32 @@
 import os
 import json
-import requests
-from flask import Flask, request, jsonify
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from datetime import datetime
-import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from datetime import date
+from functools import partial
+from xml.sax.saxutils import escape
+from flask import Flask, Response, request, jsonify
+
+from googleapiclient.errors import HttpError
+
+from aggregates import Aggregates, period_range, VENDA_PRODUTO, VENDA_PAGAMENTO, COMPRA_LOCAL, PESSOAL_CATEGORIA
+from catalog import CatalogService, PRODUCTS_RANGE, INGREDIENTS_RANGE
+from categories import CATEGORIES_RANGE
+from dedup import MessageDedup
+from export import EXPORT_FORMATS, authorized, export_chunks, iter_pages, parse_date
+from job_queue import JobQueue
+from ledger import Ledger, LedgerSyncer
+from parsing import Compra, Pessoal, Resumo, Sugestao, Venda, build_router, format_nome, record_from_dict
+from recipes import RECIPES_RANGE
+from resilience import DEGRADED_MARGIN, deadline, remaining
+from rollover import TabRollover
+from sheets_client import SheetsClientRegistry
+from sheets_gateway import PRIORITY_BACKGROUND, SheetsGateway
+from stock import StockIndex
+from tenants import TENANTS_PATH, Tenant, TenantContext, TenantRegistry, load_tenants
+from tracing import Gauge, current_trace, failures, messages, registry, span, trace
+from twilio_sender import TwilioSender
 
 app = Flask(__name__)
 
@@ -18,7 +39,61 @@ TWILIO_ACCOUNT_SID = 'SUA_ACCOUNT_SID'  # Será substituído pelo SID real
 TWILIO_AUTH_TOKEN = 'SEU_AUTH_TOKEN'  # Será substituído pelo token real
 TWILIO_PHONE_NUMBER = 'whatsapp:+14155238886'  # Número do Twilio para WhatsApp
 
-# Dicionário de produtos e preços (será preenchido a partir da planilha)
+# Como responder às mensagens: 'rest' envia pela API do Twilio depois da gravação;
+# 'twiml' devolve a resposta no próprio webhook (uma chamada HTTPS a menos por mensagem)
+REPLY_MODE = os.environ.get('REPLY_MODE', 'rest')
+
+# Ledger local: todo registro é gravado aqui antes de ir para a planilha
+LEDGER_PATH = os.environ.get('LEDGER_PATH', 'ledger.db')
+ledger = Ledger(LEDGER_PATH)
+
+# Totais por dia (vendas, compras e gastos pessoais) para o comando "Resumo:"
+AGGREGATES_PATH = os.environ.get('AGGREGATES_PATH', 'aggregates.db')
+aggregates = Aggregates(AGGREGATES_PATH)
+
+# Linhas de cabeçalho no topo de cada aba da planilha
+HEADER_ROWS = 4
+
+# Clientes do Google Sheets reutilizados por todo o processo
+sheets_clients = SheetsClientRegistry('credentials.json', SCOPES)
+# Clientes dos inquilinos que têm credenciais próprias, por arquivo de credenciais
+tenant_sheets_clients = {}
+
+# Gateway por onde passam todas as chamadas ao Sheets, respeitando as cotas por minuto
+# (com vários workers do gunicorn, divida a cota do projeto entre eles)
+SHEETS_READ_QUOTA = int(os.environ.get('SHEETS_READ_QUOTA', '60'))
+SHEETS_WRITE_QUOTA = int(os.environ.get('SHEETS_WRITE_QUOTA', '60'))
+sheets_gateway = SheetsGateway(SHEETS_READ_QUOTA, SHEETS_WRITE_QUOTA)
+
+# Índice do estoque em memória, compartilhado pelas compras deste processo
+STOCK_LOCK_PATH = os.environ.get('STOCK_LOCK_PATH', 'estoque.lock')
+STOCK_INDEX_MAX_AGE = float(os.environ.get('STOCK_INDEX_MAX_AGE', '60'))
+stock_index = StockIndex(STOCK_LOCK_PATH, max_age=STOCK_INDEX_MAX_AGE)
+stock_indexes = {}
+
+# Fila de jobs em segundo plano (gravação na planilha e respostas via Twilio)
+JOB_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH', 'jobs.db')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+# Mensagens guardadas no modo degradado já foram confirmadas ao usuário: não expiram
+job_queue = JobQueue(JOB_QUEUE_PATH, retry_forever=('message',))
+
+# MessageSids já processados, compartilhados entre os workers do gunicorn
+DEDUP_DB_PATH = os.environ.get('DEDUP_DB_PATH', 'dedup.db')
+dedup = MessageDedup(DEDUP_DB_PATH)
+
+# Token exigido em /export (cabeçalho 'Authorization: Bearer <token>'); vazio desativa a exportação
+EXPORT_TOKEN = os.environ.get('EXPORT_TOKEN', '')
+
+# Envio de mensagens pelo Twilio: sessão HTTP persistente e fila limitada por destinatário.
+# Mensagens que falham mesmo após as novas tentativas voltam para a fila de jobs.
+TWILIO_API_BASE = os.environ.get('TWILIO_API_BASE', 'https://api.twilio.com')
+TWILIO_SENDER_WORKERS = int(os.environ.get('TWILIO_SENDER_WORKERS', '4'))
+twilio = TwilioSender(
+    TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER,
+    base_url=TWILIO_API_BASE, workers=TWILIO_SENDER_WORKERS,
+    on_failure=lambda to, message, account: enqueue_reply(to, message, account))
+
+# Dicionário de produtos e preços (usado até a primeira leitura da planilha)
 produtos = {
     "trufa de morango": 4.00,
     "trufa de maracujá": 4.00,
@@ -37,7 +112,7 @@ produtos = {
     "pudim de leite": 8.00
 }
 
-# Dicionário de ingredientes (será preenchido a partir da planilha)
+# Dicionário de ingredientes (usado até a primeira leitura da planilha)
 ingredientes = {
     "leite condensado": {"unidade": "g", "preco": 6.45},
     "uva verde": {"unidade": "g", "preco": 16.00},
@@ -49,7 +124,8 @@ ingredientes = {
     "morango": {"unidade": "g", "preco": 10.00}
 }
 
-# Categorias para gastos pessoais
+# Categorias padrão para gastos pessoais (a aba Categorias da planilha, se existir,
+# substitui esta tabela; acentos são ignorados na comparação)
 categorias_pessoais = {
     "uber": "Transporte",
     "táxi": "Transporte",
@@ -74,271 +150,190 @@ categorias_pessoais = {
 }
 
 def setup_google_sheets():
-    """Configura a conexão com o Google Sheets."""
-    creds = None
+    """
+    Retorna a conexão com o Google Sheets, reutilizando o cliente já construído.
+    Todas as chamadas feitas por ela passam pelo gateway de cotas.
+    """
     # O arquivo credentials.json deve estar no mesmo diretório
-    if os.path.exists('credentials.json'):
-        creds = service_account.Credentials.from_service_account_file(
-            'credentials.json', scopes=SCOPES)
-    
-    service = build('sheets', 'v4', credentials=creds)
-    sheet = service.spreadsheets()
-    return sheet
+    return sheets_gateway.wrap(sheets_clients.get())
+
+def sheets_clients_for(spreadsheet_id=None):
+    """Clientes do Sheets da planilha: os do inquilino dono dela, se ele tiver credenciais próprias."""
+    tenant = tenants.for_spreadsheet(spreadsheet_id) if spreadsheet_id else None
+    if tenant is None or not tenant.credentials_file:
+        return sheets_clients
+    if tenant.credentials_file not in tenant_sheets_clients:
+        tenant_sheets_clients[tenant.credentials_file] = SheetsClientRegistry(tenant.credentials_file, SCOPES)
+    return tenant_sheets_clients[tenant.credentials_file]
 
-def parse_venda_message(message):
+def sheets_for(spreadsheet_id):
+    """Conexão com o Google Sheets para gravar ou ler a planilha `spreadsheet_id`."""
+    clients = sheets_clients_for(spreadsheet_id)
+    if clients is sheets_clients:
+        return setup_google_sheets()
+    return sheets_gateway.wrap(clients.get())
+
+def parse_venda_message(message, data=None):
     """
     Analisa a mensagem de venda e extrai as informações.
-    Formato esperado: "Venda: [Produto] x[Quantidade] - [Forma de Pagamento] - [Observações]"
-    Exemplo: "Venda: Trufa de Morango x2 - PIX - Cliente Maria"
+    Formato esperado: "Venda: [Produto] x[Quantidade], ... - [Forma de Pagamento] - [Observações]"
+    Exemplo: "Venda: Trufa de Morango x2, Mousse de Limão x1 - PIX - Cliente Maria"
+    `data` (dd/mm/aaaa) substitui a data de hoje, ex.: ao importar conversas antigas.
     """
-    try:
-        # Verificar se é uma mensagem de venda
-        if not message.lower().startswith('venda:'):
-            return None
-        
-        # Remover o prefixo "Venda:"
-        content = message[6:].strip()
-        
-        # Dividir por "-" para separar produto, pagamento e observações
-        parts = content.split('-')
-        
-        if len(parts) < 2:
-            return None  # Formato inválido
-        
-        # Extrair produto e quantidade
-        produto_info = parts[0].strip()
-        
-        # Verificar se há indicação de quantidade (x2, x3, etc.)
-        if 'x' in produto_info:
-            produto_parts = produto_info.split('x')
-            produto = produto_parts[0].strip().lower()
-            quantidade = int(produto_parts[1].strip())
-        else:
-            produto = produto_info.lower()
-            quantidade = 1
-        
-        # Extrair forma de pagamento
-        pagamento = parts[1].strip()
-        
-        # Extrair observações (se houver)
-        observacoes = parts[2].strip() if len(parts) > 2 else ""
-        
-        # Verificar se o produto existe no catálogo
-        if produto not in produtos:
-            return None  # Produto não encontrado
-        
-        # Obter o valor unitário do produto
-        valor_unitario = produtos[produto]
-        
-        # Calcular o valor total
-        valor_total = valor_unitario * quantidade
-        
-        # Formatar o nome do produto com a primeira letra maiúscula
-        produto_formatado = ' '.join(word.capitalize() for word in produto.split())
-        
-        return {
-            'tipo': 'venda',
-            'data': datetime.now().strftime("%d/%m/%Y"),
-            'produto': produto_formatado,
-            'quantidade': quantidade,
-            'valor_unitario': valor_unitario,
-            'valor_total': valor_total,
-            'pagamento': pagamento,
-            'observacoes': observacoes
-        }
-    
-    except Exception as e:
-        print(f"Erro ao analisar mensagem de venda: {e}")
-        return None
+    record = router.parse(message, data)
+    return record if isinstance(record, Venda) else None
 
-def parse_compra_message(message):
+def parse_compra_message(message, data=None):
     """
     Analisa a mensagem de compra de ingredientes e extrai as informações.
     Formato esperado: "Compra: [Itens] - [Valor Total] - [Local] - [Forma de Pagamento] - [Observações]"
     Exemplo: "Compra: 3 leites condensados, 2 cremes de leite, 1 granulado - 50,00 - Atacadão - Cartão - Promoção"
+    `data` (dd/mm/aaaa) substitui a data de hoje, ex.: ao importar conversas antigas.
     """
-    try:
-        # Verificar se é uma mensagem de compra
-        if not message.lower().startswith('compra:'):
-            return None
-        
-        # Remover o prefixo "Compra:"
-        content = message[7:].strip()
-        
-        # Dividir por "-" para separar itens, valor, local, pagamento e observações
-        parts = content.split('-')
-        
-        if len(parts) < 1:
-            return None  # Formato inválido
-        
-        # Extrair itens
-        itens_info = parts[0].strip()
-        
-        # Processar os itens (formato: "3 leites condensados, 2 cremes de leite")
-        itens_list = itens_info.split(',')
-        itens_processados = []
-        
-        for item in itens_list:
-            item = item.strip()
-            # Tentar extrair quantidade e nome do item
-            match = re.match(r'(\d+)\s+(.+)', item)
-            if match:
-                quantidade = int(match.group(1))
-                nome_item = match.group(2).strip().lower()
-                itens_processados.append({
-                    'nome': nome_item,
-                    'quantidade': quantidade
-                })
-            else:
-                # Se não conseguir extrair quantidade, assume 1
-                itens_processados.append({
-                    'nome': item.lower(),
-                    'quantidade': 1
-                })
-        
-        # Extrair valor total (se fornecido)
-        valor_total = 0
-        if len(parts) > 1 and parts[1].strip():
-            valor_str = parts[1].strip().replace('R$', '').replace(',', '.').strip()
-            try:
-                valor_total = float(valor_str)
-            except ValueError:
-                valor_total = 0
-        
-        # Extrair local (se fornecido)
-        local = ""
-        if len(parts) > 2:
-            local = parts[2].strip()
-        
-        # Extrair forma de pagamento (se fornecida)
-        pagamento = ""
-        if len(parts) > 3:
-            pagamento = parts[3].strip()
-        
-        # Extrair observações (se fornecidas)
-        observacoes = ""
-        if len(parts) > 4:
-            observacoes = parts[4].strip()
-        
-        return {
-            'tipo': 'compra',
-            'data': datetime.now().strftime("%d/%m/%Y"),
-            'itens': itens_processados,
-            'valor_total': valor_total,
-            'local': local,
-            'pagamento': pagamento,
-            'observacoes': observacoes,
-            'descricao': itens_info  # Descrição completa dos itens para registro
-        }
-    
-    except Exception as e:
-        print(f"Erro ao analisar mensagem de compra: {e}")
-        return None
+    record = router.parse(message, data)
+    return record if isinstance(record, Compra) else None
 
-def parse_pessoal_message(message):
+def parse_pessoal_message(message, data=None):
     """
     Analisa a mensagem de gasto pessoal e extrai as informações.
     Formato esperado: "Pessoal: [Descrição] - [Valor] - [Categoria] - [Forma de Pagamento] - [Observações]"
     Exemplo: "Pessoal: Uber volta do mercado - 20,00 - Transporte - Cartão - Urgente"
+    `data` (dd/mm/aaaa) substitui a data de hoje, ex.: ao importar conversas antigas.
     """
-    try:
-        # Verificar se é uma mensagem de gasto pessoal
-        if not message.lower().startswith('pessoal:'):
-            return None
-        
-        # Remover o prefixo "Pessoal:"
-        content = message[8:].strip()
-        
-        # Dividir por "-" para separar descrição, valor, categoria, pagamento e observações
-        parts = content.split('-')
-        
-        if len(parts) < 1:
-            return None  # Formato inválido
-        
-        # Extrair descrição
-        descricao = parts[0].strip()
-        
-        # Extrair valor (se fornecido)
-        valor = 0
-        if len(parts) > 1 and parts[1].strip():
-            valor_str = parts[1].strip().replace('R$', '').replace(',', '.').strip()
-            try:
-                valor = float(valor_str)
-            except ValueError:
-                valor = 0
-        
-        # Extrair ou inferir categoria
-        categoria = ""
-        if len(parts) > 2 and parts[2].strip():
-            categoria = parts[2].strip()
-        else:
-            # Tentar inferir categoria com base na descrição
-            descricao_lower = descricao.lower()
-            for palavra_chave, cat in categorias_pessoais.items():
-                if palavra_chave in descricao_lower:
-                    categoria = cat
-                    break
-        
-        # Extrair forma de pagamento (se fornecida)
-        pagamento = ""
-        if len(parts) > 3:
-            pagamento = parts[3].strip()
-        
-        # Extrair observações (se fornecidas)
-        observacoes = ""
-        if len(parts) > 4:
-            observacoes = parts[4].strip()
-        
-        return {
-            'tipo': 'pessoal',
-            'data': datetime.now().strftime("%d/%m/%Y"),
-            'descricao': descricao,
-            'valor': valor,
-            'categoria': categoria,
-            'pagamento': pagamento,
-            'observacoes': observacoes
-        }
-    
-    except Exception as e:
-        print(f"Erro ao analisar mensagem de gasto pessoal: {e}")
-        return None
+    record = router.parse(message, data)
+    return record if isinstance(record, Pessoal) else None
+
+def append_rows(sheet, tab, rows, last_col, spreadsheet_id=None):
+    """
+    Acrescenta linhas após a última linha preenchida da aba usando values.append.
+    O custo não depende do tamanho da aba e o próprio Sheets escolhe a linha,
+    então workers concorrentes nunca gravam na mesma linha. A busca começa
+    após as HEADER_ROWS linhas de cabeçalho.
+    """
+    return sheet.values().append(
+        spreadsheetId=spreadsheet_id or SAMPLE_SPREADSHEET_ID,
+        range=f'{tab}!A{HEADER_ROWS + 1}:{last_col}',
+        valueInputOption='USER_ENTERED',
+        insertDataOption='OVERWRITE',
+        body={'values': rows}).execute()
+
+def get_stock_index(spreadsheet_id):
+    """Índice de estoque da planilha (um por planilha, ex.: ao reenviar o ledger para outra)."""
+    if spreadsheet_id == SAMPLE_SPREADSHEET_ID:
+        return stock_index
+    if spreadsheet_id not in stock_indexes:
+        stock_indexes[spreadsheet_id] = StockIndex(
+            f'{STOCK_LOCK_PATH}.{spreadsheet_id}', max_age=STOCK_INDEX_MAX_AGE)
+    return stock_indexes[spreadsheet_id]
+
+def venda_rows(vendas):
+    """Linhas da aba Registro de Vendas: uma por item vendido."""
+    return [
+        [
+            venda_data.data,
+            item.produto,
+            item.quantidade,
+            item.valor_unitario,
+            item.valor_total,
+            venda_data.pagamento,
+            venda_data.observacoes
+        ]
+        for venda_data in vendas
+        for item in venda_data.itens
+    ]
+
+def compra_rows(compras):
+    """Linhas da aba Via 1 - Negócios: uma por compra."""
+    return [
+        [
+            compra_data.data,
+            compra_data.descricao,
+            "Ingredientes",  # Categoria
+            compra_data.valor_total,
+            compra_data.pagamento,
+            compra_data.observacoes
+        ]
+        for compra_data in compras
+    ]
+
+def pessoal_rows(gastos):
+    """Linhas da aba Via 2 - Pessoal: uma por gasto."""
+    return [
+        [
+            pessoal_data.data,
+            pessoal_data.descricao,
+            pessoal_data.categoria,
+            pessoal_data.valor,
+            pessoal_data.pagamento,
+            pessoal_data.observacoes
+        ]
+        for pessoal_data in gastos
+    ]
+
+# Coluna, logo depois das colunas de dados, com a sequência no ledger do
+# registro de cada linha gravada pela sincronização (usada para não gravar
+# de novo um lote que o Sheets aceitou antes de uma queda)
+LEDGER_SEQ_COLUMNS = {'Registro de Vendas': 'H', 'Via 1 - Negócios': 'G', 'Via 2 - Pessoal': 'G'}
+
+def tag_rows(build_rows, records, seqs):
+    """Linhas dos registros, cada uma com a sequência do seu registro no fim."""
+    return [row + [seq] for record, seq in zip(records, seqs) for row in build_rows([record])]
+
+def write_rows(spreadsheet_id, tab, build_rows, last_col, records, seqs=None):
+    """Acrescenta à aba as linhas dos registros; com `seqs`, também a coluna de sequência."""
+    if seqs is None:
+        rows = build_rows(records)
+    else:
+        rows, last_col = tag_rows(build_rows, records, seqs), LEDGER_SEQ_COLUMNS[tab]
+    append_rows(sheets_for(spreadsheet_id), tab, rows, last_col, spreadsheet_id)
+
+def ledger_seqs_in_tab(tab, spreadsheet_id):
+    """Sequências do ledger já gravadas na aba viva (uma leitura da coluna de sequência)."""
+    col = LEDGER_SEQ_COLUMNS[tab]
+    sheet = sheets_for(spreadsheet_id)
+    with sheets_gateway.priority(PRIORITY_BACKGROUND):
+        result = sheet.values().get(spreadsheetId=spreadsheet_id,
+                                    range=f'{tab}!{col}{HEADER_ROWS + 1}:{col}').execute()
+    seqs = set()
+    for row in result.get('values', []):
+        try:
+            seqs.add(int(float(row[0])))
+        except (IndexError, ValueError):
+            pass
+    return seqs
+
+def write_vendas(spreadsheet_id, vendas, seqs=None):
+    """Grava as vendas na aba Registro de Vendas (uma linha por item) em uma única chamada."""
+    write_rows(spreadsheet_id, 'Registro de Vendas', venda_rows, 'G', vendas, seqs)
+
+def write_compras_estoque(spreadsheet_id, compras):
+    """Soma ao estoque os itens das compras (uma leitura no máximo e uma única escrita)."""
+    sheet = sheets_for(spreadsheet_id)
+    get_stock_index(spreadsheet_id).apply_purchases(
+        sheet, spreadsheet_id, [(compra_data.itens, compra_data.local) for compra_data in compras])
+
+def write_vendas_estoque(spreadsheet_id, vendas):
+    """Dá baixa no estoque dos ingredientes das receitas dos produtos vendidos (uma única escrita)."""
+    custos = tenants.context(tenants.for_spreadsheet(spreadsheet_id)).catalog.current().custos
+    consumos = [custos.consumo((item.produto, item.quantidade) for item in venda_data.itens)
+                for venda_data in vendas]
+    if not any(consumos):
+        return
+    sheet = sheets_for(spreadsheet_id)
+    get_stock_index(spreadsheet_id).apply_consumption(sheet, spreadsheet_id, consumos)
+
+def write_compras(spreadsheet_id, compras, seqs=None):
+    """Grava as compras na aba Via 1 - Negócios em uma única chamada."""
+    write_rows(spreadsheet_id, 'Via 1 - Negócios', compra_rows, 'F', compras, seqs)
+
+def write_pessoais(spreadsheet_id, gastos, seqs=None):
+    """Grava os gastos pessoais na aba Via 2 - Pessoal em uma única chamada."""
+    write_rows(spreadsheet_id, 'Via 2 - Pessoal', pessoal_rows, 'F', gastos, seqs)
 
 def add_venda_to_sheets(venda_data):
     """Adiciona os dados da venda ao Google Sheets."""
     try:
-        sheet = setup_google_sheets()
-        
-        # Encontrar a próxima linha vazia na aba de Registro de Vendas
-        result = sheet.values().get(spreadsheetId=SAMPLE_SPREADSHEET_ID,
-                                   range='Registro de Vendas!A:G').execute()
-        values = result.get('values', [])
-        next_row = len(values) + 1
-        
-        # Se a próxima linha for menor que 5, ajustar para 5 (para pular os cabeçalhos)
-        if next_row < 5:
-            next_row = 5
-        
-        # Preparar os dados para inserção
-        row_data = [
-            venda_data['data'],
-            venda_data['produto'],
-            venda_data['quantidade'],
-            venda_data['valor_unitario'],
-            venda_data['valor_total'],
-            venda_data['pagamento'],
-            venda_data['observacoes']
-        ]
-        
-        # Inserir os dados na planilha
-        body = {
-            'values': [row_data]
-        }
-        result = sheet.values().update(
-            spreadsheetId=SAMPLE_SPREADSHEET_ID,
-            range=f'Registro de Vendas!A{next_row}:G{next_row}',
-            valueInputOption='USER_ENTERED',
-            body=body).execute()
-        
+        write_vendas(SAMPLE_SPREADSHEET_ID, [venda_data])
         return True
     
     except Exception as e:
@@ -348,98 +343,11 @@ def add_venda_to_sheets(venda_data):
 def add_compra_to_sheets(compra_data):
     """Adiciona os dados da compra de ingredientes ao Google Sheets."""
     try:
-        sheet = setup_google_sheets()
-        
         # 1. Atualizar o estoque
-        for item in compra_data['itens']:
-            # Buscar o item no estoque
-            result = sheet.values().get(spreadsheetId=SAMPLE_SPREADSHEET_ID,
-                                      range='Controle de Estoque!A:G').execute()
-            values = result.get('values', [])
-            
-            item_encontrado = False
-            for i, row in enumerate(values):
-                if i < 4:  # Pular cabeçalhos
-                    continue
-                
-                if len(row) > 1 and row[1].lower() == item['nome']:
-                    # Item encontrado, atualizar quantidade
-                    item_encontrado = True
-                    row_num = i + 1
-                    
-                    # Obter quantidade atual
-                    quantidade_atual = 0
-                    if len(row) > 2:
-                        try:
-                            quantidade_atual = float(row[2])
-                        except (ValueError, TypeError):
-                            quantidade_atual = 0
-                    
-                    # Calcular nova quantidade
-                    nova_quantidade = quantidade_atual + item['quantidade']
-                    
-                    # Atualizar quantidade
-                    sheet.values().update(
-                        spreadsheetId=SAMPLE_SPREADSHEET_ID,
-                        range=f'Controle de Estoque!C{row_num}',
-                        valueInputOption='USER_ENTERED',
-                        body={'values': [[nova_quantidade]]}).execute()
-                    
-                    break
-            
-            # Se o item não foi encontrado, adicionar como novo
-            if not item_encontrado:
-                # Encontrar a próxima linha vazia
-                next_row = len(values) + 1
-                
-                # Gerar código para o novo item
-                codigo = f"ING{next_row-4:03d}"
-                
-                # Preparar dados do novo item
-                new_item_data = [
-                    codigo,
-                    ' '.join(word.capitalize() for word in item['nome'].split()),
-                    item['quantidade'],
-                    "g",  # Unidade padrão
-                    0,    # Preço unitário (a ser preenchido manualmente)
-                    "=C{row}*E{row}".format(row=next_row),  # Fórmula para valor total
-                    "",   # Marca
-                    compra_data['local']  # Local de compra
-                ]
-                
-                # Adicionar novo item
-                sheet.values().update(
-                    spreadsheetId=SAMPLE_SPREADSHEET_ID,
-                    range=f'Controle de Estoque!A{next_row}:H{next_row}',
-                    valueInputOption='USER_ENTERED',
-                    body={'values': [new_item_data]}).execute()
+        write_compras_estoque(SAMPLE_SPREADSHEET_ID, [compra_data])
         
         # 2. Registrar a compra na aba Via 1 - Negócios
-        # Encontrar a próxima linha vazia
-        result = sheet.values().get(spreadsheetId=SAMPLE_SPREADSHEET_ID,
-                                   range='Via 1 - Negócios!A:G').execute()
-        values = result.get('values', [])
-        next_row = len(values) + 1
-        
-        # Preparar os dados para inserção
-        row_data = [
-            compra_data['data'],
-            compra_data['descricao'],
-            "Ingredientes",  # Categoria
-            compra_data['valor_total'],
-            compra_data['pagamento'],
-            compra_data['observacoes']
-        ]
-        
-        # Inserir os dados na planilha
-        body = {
-            'values': [row_data]
-        }
-        result = sheet.values().update(
-            spreadsheetId=SAMPLE_SPREADSHEET_ID,
-            range=f'Via 1 - Negócios!A{next_row}:F{next_row}',
-            valueInputOption='USER_ENTERED',
-            body=body).execute()
+        write_compras(SAMPLE_SPREADSHEET_ID, [compra_data])
         
         return True
     
@@ -450,238 +358,705 @@ def add_compra_to_sheets(compra_data):
 def add_pessoal_to_sheets(pessoal_data):
     """Adiciona os dados do gasto pessoal ao Google Sheets."""
     try:
-        sheet = setup_google_sheets()
-        
-        # Encontrar a próxima linha vazia na aba Via 2 - Pessoal
-        result = sheet.values().get(spreadsheetId=SAMPLE_SPREADSHEET_ID,
-                                   range='Via 2 - Pessoal!A:G').execute()
-        values = result.get('values', [])
-        next_row = len(values) + 1
-        
-        # Preparar os dados para inserção
-        row_data = [
-            pessoal_data['data'],
-            pessoal_data['descricao'],
-            pessoal_data['categoria'],
-            pessoal_data['valor'],
-            pessoal_data['pagamento'],
-            pessoal_data['observacoes']
-        ]
-        
-        # Inserir os dados na planilha
-        body = {
-            'values': [row_data]
-        }
-        result = sheet.values().update(
-            spreadsheetId=SAMPLE_SPREADSHEET_ID,
-            range=f'Via 2 - Pessoal!A{next_row}:F{next_row}',
-            valueInputOption='USER_ENTERED',
-            body=body).execute()
-        
+        write_pessoais(SAMPLE_SPREADSHEET_ID, [pessoal_data])
         return True
     
     except Exception as e:
         print(f"Erro ao adicionar gasto pessoal à planilha: {e}")
         return False
 
-def send_whatsapp_message(to, message):
-    """Envia uma mensagem de WhatsApp usando a API do Twilio."""
+# Destinos do ledger: cada aba recebe os registros de um tipo, em lotes.
+# As compras têm dois destinos independentes (estoque e Via 1), cada um com
+# sua high-water mark, para que uma falha em um não repita o outro. Cada
+# inquilino recebe os próprios registros na sua planilha, em rodízio.
+LEDGER_SINKS = {
+    'Registro de Vendas': ('venda', write_vendas),
+    'Baixa de Estoque': ('venda', write_vendas_estoque),
+    'Controle de Estoque': ('compra', write_compras_estoque),
+    'Via 1 - Negócios': ('compra', write_compras),
+    'Via 2 - Pessoal': ('pessoal', write_pessoais),
+}
+
+ledger_syncer = LedgerSyncer(ledger, LEDGER_SINKS, lambda: SAMPLE_SPREADSHEET_ID,
+                             decode=record_from_dict, get_targets=lambda: tenants.targets(),
+                             written={tab: partial(ledger_seqs_in_tab, tab) for tab in LEDGER_SEQ_COLUMNS})
+
+@contextmanager
+def rollover_window():
+    """Arquivamento sem gravações concorrentes nas abas e cedendo a vez às gravações dos usuários."""
+    with ledger_syncer.paused(), sheets_gateway.priority(PRIORITY_BACKGROUND):
+        # Um lote interrompido é conferido na aba viva: as linhas dele não podem sair dela antes
+        if ledger.has_inflight():
+            raise RuntimeError("lote da sincronização ainda não confirmado; arquivamento adiado")
+        yield
+
+# Arquivamento mensal das abas de registro: os meses fechados vão para abas de
+# arquivo ("Registro de Vendas 2026-09") e as abas vivas ficam só com o mês corrente
+ROLLOVER_TABS = {'Registro de Vendas': 'G', 'Via 1 - Negócios': 'F', 'Via 2 - Pessoal': 'F'}
+rollover = TabRollover(ROLLOVER_TABS, lambda spreadsheet_id: sheets_for(spreadsheet_id),
+                       lambda: tenants.targets(), rollover_window, header_rows=HEADER_ROWS)
+
+def send_whatsapp_message(to, message, account=None):
+    """Envia uma mensagem de WhatsApp usando a API do Twilio (bloqueante, com novas tentativas)."""
     try:
-        url = f'https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json'
-        data = {
-            'To': f'whatsapp:{to}',
-            'From': TWILIO_PHONE_NUMBER,
-            'Body': message
-        }
-        auth = (TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        
-        response = requests.post(url, data=data, auth=auth)
-        return response.status_code == 201
+        return twilio.send(to, message, account)
     
     except Exception as e:
         print(f"Erro ao enviar mensagem WhatsApp: {e}")
         return False
 
+def enqueue_reply(to, message, account=None):
+    """
+    Guarda a resposta na fila de jobs, na vez do inquilino que vai enviá-la
+    (a chave da conta é o id do inquilino; sem conta, o inquilino padrão).
+    """
+    tenant_id = account.key if account else default_tenant.id
+    job_queue.enqueue('reply', {'to': to, 'message': message, 'tenant': tenant_id}, tenant=tenant_id)
+
+def reply(to, message, account=None):
+    """
+    Responde ao usuário pela fila de envio do Twilio, preservando a ordem por
+    destinatário. Se a fila estiver cheia, a resposta vai para a fila de jobs.
+    """
+    if not twilio.enqueue(to, message, account):
+        enqueue_reply(to, message, account)
+
+def format_margem(data, custos=None):
+    """Custo e margem da venda pela tabela de custos do catálogo; vazio se faltar alguma receita."""
+    custos = custos or catalog.current().custos
+    custo = 0.0
+    for item in data.itens:
+        custo_unitario = custos.cost(item.produto)
+        if custo_unitario is None:
+            return ""
+        custo += custo_unitario * item.quantidade
+    margem = data.valor_total - custo
+    percentual = margem / data.valor_total * 100 if data.valor_total else 0
+    return f"\nCusto: R$ {custo:.2f} | Margem: R$ {margem:.2f} ({percentual:.0f}%)"
+
+def format_venda_confirmation(data, custos=None):
+    """Monta a mensagem de confirmação de uma venda (com um ou mais itens)."""
+    if len(data.itens) == 1:
+        item = data.itens[0]
+        return (
+            f"✅ Venda registrada com sucesso!\n\n"
+            f"Produto: {item.produto}\n"
+            f"Quantidade: {item.quantidade}\n"
+            f"Valor Total: R$ {data.valor_total:.2f}\n"
+            f"Forma de Pagamento: {data.pagamento}"
+            f"{format_margem(data, custos)}"
+        )
+    itens_str = "\n".join(
+        f"• {item.quantidade}x {item.produto} - R$ {item.valor_total:.2f}" for item in data.itens)
+    return (
+        f"✅ Venda registrada com sucesso!\n\n"
+        f"Itens:\n{itens_str}\n\n"
+        f"Valor Total: R$ {data.valor_total:.2f}\n"
+        f"Forma de Pagamento: {data.pagamento}"
+        f"{format_margem(data, custos)}"
+    )
+
+def format_compra_confirmation(data):
+    """Monta a mensagem de confirmação de uma compra."""
+    itens_str = ", ".join([f"{item.quantidade} {item.nome}" for item in data.itens])
+    return (
+        f"✅ Compra registrada com sucesso!\n\n"
+        f"Itens: {itens_str}\n"
+        f"Valor Total: R$ {data.valor_total:.2f}\n"
+        f"Local: {data.local}\n"
+        f"Forma de Pagamento: {data.pagamento}\n\n"
+        f"✓ Estoque atualizado automaticamente"
+    )
+
+def format_pessoal_confirmation(data):
+    """Monta a mensagem de confirmação de um gasto pessoal."""
+    return (
+        f"✅ Gasto pessoal registrado com sucesso!\n\n"
+        f"Descrição: {data.descricao}\n"
+        f"Valor: R$ {data.valor:.2f}\n"
+        f"Categoria: {data.categoria}\n"
+        f"Forma de Pagamento: {data.pagamento}"
+    )
+
+def format_sugestao(data):
+    """Monta a resposta "você quis dizer" quando o produto é ambíguo."""
+    opcoes = ", ".join(format_nome(produto) for produto in data.sugestoes)
+    return (
+        f"🤔 Não encontrei o produto \"{data.termo}\".\n"
+        f"Você quis dizer: {opcoes}?\n"
+        f"Reenvie a mensagem com o nome correto."
+    )
+
+HELP_MESSAGE = (
+    "⚠️ Formato inválido. Use um dos formatos:\n\n"
+    "1) Para vendas:\n"
+    "Venda: [Produto] x[Quantidade], [Produto] x[Quantidade] - [Forma de Pagamento] - [Observações]\n"
+    "Exemplo: Venda: Trufa de Morango x2, Pudim de Leite x1 - PIX - Cliente Maria\n\n"
+    "2) Para compras de ingredientes:\n"
+    "Compra: [Itens] - [Valor Total] - [Local] - [Forma de Pagamento] - [Observações]\n"
+    "Exemplo: Compra: 3 leites condensados, 2 cremes de leite - 50,00 - Atacadão - Cartão - Promoção\n\n"
+    "3) Para gastos pessoais:\n"
+    "Pessoal: [Descrição] - [Valor] - [Categoria] - [Forma de Pagamento] - [Observações]\n"
+    "Exemplo: Pessoal: Uber volta do mercado - 20,00 - Transporte - Cartão - Urgente\n\n"
+    "4) Para resumos:\n"
+    "Resumo: [hoje | semana | mês]\n"
+    "Exemplo: Resumo: semana"
+)
+
+# Confirmação genérica, quando o registro foi gravado mas a mensagem detalhada não pôde ser montada
+RECORDED_MESSAGE = "✅ Registro gravado com sucesso!"
+
+# Resposta do modo degradado: a mensagem foi guardada e será processada em segundo plano
+DEGRADED_MESSAGE = (
+    "⏳ Mensagem registrada, sincronizando...\n"
+    "A confirmação completa chega em seguida."
+)
+
+PERIODO_LABELS = {'hoje': 'Hoje', 'semana': 'Semana', 'mes': 'Mês'}
+
+def format_resumo(resumo, today=None, totals=None):
+    """Monta o relatório do período com os totais já calculados (sem acessar a planilha)."""
+    start, end = period_range(resumo.periodo, today)
+    report = (totals or aggregates).report(start, end)
+    if start == end:
+        periodo = end.strftime('%d/%m/%Y')
+    else:
+        periodo = f"{start.strftime('%d/%m')} a {end.strftime('%d/%m/%Y')}"
+
+    def total(dimension):
+        return sum(valor for _, valor, _ in report[dimension])
+
+    linhas = [f"📊 Resumo - {PERIODO_LABELS[resumo.periodo]} ({periodo})", ""]
+    linhas.append(f"💰 Vendas: R$ {total(VENDA_PAGAMENTO):.2f}")
+    linhas += [f"• {produto}: {quantidade:g} un - R$ {valor:.2f}"
+               for produto, valor, quantidade in report[VENDA_PRODUTO]]
+    if report[VENDA_PAGAMENTO]:
+        linhas.append("Por pagamento: " + ", ".join(
+            f"{pagamento} R$ {valor:.2f}" for pagamento, valor, _ in report[VENDA_PAGAMENTO]))
+    linhas += ["", f"🛒 Compras: R$ {total(COMPRA_LOCAL):.2f}"]
+    linhas += [f"• {local}: R$ {valor:.2f}" for local, valor, _ in report[COMPRA_LOCAL]]
+    linhas += ["", f"👤 Gastos pessoais: R$ {total(PESSOAL_CATEGORIA):.2f}"]
+    linhas += [f"• {categoria}: R$ {valor:.2f}" for categoria, valor, _ in report[PESSOAL_CATEGORIA]]
+    return "\n".join(linhas)
+
+# Mensagem de confirmação de cada tipo de registro
+CONFIRMATIONS = {
+    'venda': format_venda_confirmation,
+    'compra': format_compra_confirmation,
+    'pessoal': format_pessoal_confirmation,
+}
+
+def format_confirmation(data, ctx=None):
+    """Mensagem de confirmação do registro; a margem das vendas usa o catálogo do inquilino."""
+    if data.tipo == 'venda' and ctx is not None:
+        return format_venda_confirmation(data, ctx.catalog.current().custos)
+    return CONFIRMATIONS[data.tipo](data)
+
+def record_message(data, ctx=None):
+    """
+    Grava o registro no ledger local (a fonte de verdade) e acorda o
+    sincronizador, que o levará à planilha do inquilino em segundo plano.
+    """
+    ctx = ctx or tenants.context(tenants.default)
+    with span('ledger'):
+        seq = ledger.append(data, tenant=ctx.tenant.id)
+    ledger_syncer.notify()
+    try:
+        # Atualiza os totais do resumo com o registro recém-gravado
+        ctx.aggregates.catch_up(ledger, record_from_dict, tipos=(data.tipo,), tenant=ctx.tenant.id)
+    except Exception as e:
+        # O registro já está no ledger; a próxima atualização o contabiliza
+        print(f"Erro ao atualizar os totais: {e}")
+    return seq
+
+def read_tab_rows(sheet, tab, last_col, spreadsheet_id=None):
+    """Todas as linhas da aba abaixo do cabeçalho, com números e datas sem formatação de moeda."""
+    result = sheet.values().get(
+        spreadsheetId=spreadsheet_id or SAMPLE_SPREADSHEET_ID,
+        range=f'{tab}!A{HEADER_ROWS + 1}:{last_col}',
+        valueRenderOption='UNFORMATTED_VALUE',
+        dateTimeRenderOption='FORMATTED_STRING').execute()
+    return result.get('values', [])
+
+def read_history_rows(sheet, tab, last_col, spreadsheet_id, archives):
+    """Linhas da aba viva e de todas as suas abas de arquivo (`archives`: o índice do arquivamento)."""
+    rows = read_tab_rows(sheet, tab, last_col, spreadsheet_id)
+    for (source, _), title in sorted(archives.items()):
+        if source == tab:
+            rows += read_tab_rows(sheet, title, last_col, spreadsheet_id)
+    return rows
+
+def rebuild_aggregates(ctx=None):
+    """
+    Recalcula os totais do resumo a partir das abas da planilha (do
+    inquilino, se dado), incluindo os meses arquivados, e aplica em seguida
+    os registros do ledger que ainda não chegaram a ela. A sincronização
+    fica parada durante a leitura, para que cada registro seja contado uma
+    única vez.
+    """
+    ctx = ctx or tenants.context(tenants.default)
+    spreadsheet_id = ctx.tenant.spreadsheet_id
+    sheet = sheets_for(spreadsheet_id)
+    with ledger_syncer.paused(), sheets_gateway.priority(PRIORITY_BACKGROUND):
+        archives = rollover.index(spreadsheet_id)
+        vendas_rows = read_history_rows(sheet, 'Registro de Vendas', 'G', spreadsheet_id, archives)
+        compras_rows = read_history_rows(sheet, 'Via 1 - Negócios', 'F', spreadsheet_id, archives)
+        pessoal_rows = read_history_rows(sheet, 'Via 2 - Pessoal', 'F', spreadsheet_id, archives)
+        applied = {
+            'venda': ledger.high_water(f'{spreadsheet_id}:Registro de Vendas'),
+            'compra': ledger.high_water(f'{spreadsheet_id}:Via 1 - Negócios'),
+            'pessoal': ledger.high_water(f'{spreadsheet_id}:Via 2 - Pessoal'),
+        }
+        ctx.aggregates.rebuild(vendas_rows, compras_rows, pessoal_rows, applied)
+    ctx.aggregates.catch_up(ledger, record_from_dict, tenant=ctx.tenant.id)
+
+def prepare_aggregates(ctx=None):
+    """Na primeira execução monta os totais a partir da planilha; depois só aplica o que faltar do ledger."""
+    ctx = ctx or tenants.context(tenants.default)
+    try:
+        if not ctx.aggregates.is_built():
+            rebuild_aggregates(ctx)
+        else:
+            ctx.aggregates.catch_up(ledger, record_from_dict, tenant=ctx.tenant.id)
+    except Exception as e:
+        print(f"Erro ao preparar os totais do resumo: {e}")
+
+_aggregates_pid = None
+
+def start_aggregates():
+    """Prepara os totais em segundo plano (uma vez por processo)."""
+    global _aggregates_pid
+    if _aggregates_pid == os.getpid():
+        return
+    _aggregates_pid = os.getpid()
+    threading.Thread(target=prepare_aggregates, name='aggregates', daemon=True).start()
+
+def process_job(kind, payload, final_attempt=False):
+    """
+    Executa um job da fila em segundo plano.
+    Jobs 'reply' guardam respostas que não couberam na fila de envio ou que
+    falharam nela. Jobs 'message' guardam mensagens recebidas no modo
+    degradado, ainda sem análise. Jobs de registro (criados por versões anteriores do bot)
+    são passados para o ledger. Uma exceção faz o job ser reprocessado com
+    backoff.
+    """
+    tenant = tenants.get(payload.get('tenant', ''))
+    if kind == 'reply':
+        if not send_whatsapp_message(payload['to'], payload['message'], tenant.account):
+            raise RuntimeError("Falha ao enviar mensagem WhatsApp")
+        return
+    if kind == 'message':
+        # Mensagem guardada no modo degradado: aqui há tempo para ler o catálogo do inquilino
+        ctx = tenant_context(tenant)
+        _, message = answer(ctx.router.parse(payload['body'], payload['data']), ctx)
+        reply(payload['sender'], message, tenant.account)
+        return
+
+    ctx = tenant_context(tenant)
+    data = record_from_dict(payload['data'])
+    record_message(data, ctx)
+    if not payload.get('replied'):
+        reply(payload['sender'], format_confirmation(data, ctx), tenant.account)
+
+def start_background_workers():
+    """Inicia os workers da fila de jobs, do envio de mensagens, a sincronização do ledger, a atualização do catálogo, o arquivamento mensal e os totais do resumo neste processo (idempotente)."""
+    job_queue.start_workers(process_job, count=JOB_WORKERS)
+    twilio.start()
+    # A baixa de estoque vale a partir daqui: vendas já registradas não consomem ingredientes
+    ledger.init_high_water(f'{SAMPLE_SPREADSHEET_ID}:Baixa de Estoque', ledger.last_seq())
+    ledger_syncer.start()
+    catalog.start()
+    rollover.start()
+    start_aggregates()
+
+def preload():
+    """
+    Prepara o processo antes do fork dos workers (gunicorn com PRELOAD_APP=1):
+    importa o cliente do Google, carrega o documento de descoberta e as
+    credenciais e publica o catálogo lido da planilha. Não inicia threads nem
+    deixa conexões abertas para os workers herdarem.
+    """
+    try:
+        sheets_clients.preload()
+    except Exception as e:
+        print(f"Erro ao pré-carregar o cliente do Google Sheets: {e}")
+        return
+    load_catalog_from_sheet()
+    # A conexão usada aqui não deve ser herdada pelos workers
+    sheets_clients.close()
+
+@app.before_request
+def ensure_background_workers():
+    start_background_workers()
+
+def twiml_body(message=None):
+    """Documento TwiML que entrega `message` ao remetente."""
+    content = f'<Message>{escape(message)}</Message>' if message else ''
+    return f'<?xml version="1.0" encoding="UTF-8"?><Response>{content}</Response>'
+
+def twiml_response(message=None):
+    """Resposta TwiML: o Twilio entrega `message` ao remetente sem outra chamada à API."""
+    return Response(twiml_body(message), status=200, mimetype='text/xml')
+
+def respond(sender, message, status, tipo, account=None):
+    """Responde ao remetente de acordo com REPLY_MODE."""
+    with span('reply', op=REPLY_MODE):
+        if REPLY_MODE == 'twiml':
+            return twiml_response(message)
+        reply(sender, message, account)
+        return jsonify({'status': status, 'type': tipo}), 200
+
+def answer(data, ctx):
+    """Grava o registro analisado (se for um) e retorna (tipo, mensagem de resposta)."""
+    if isinstance(data, Sugestao):
+        return 'sugestao', format_sugestao(data)
+    if isinstance(data, Resumo):
+        # Relatório servido dos totais locais, sem ler a planilha
+        return 'resumo', format_resumo(data, totals=ctx.aggregates)
+    if data:
+        # Gravação local com fsync; a planilha é atualizada em segundo plano
+        record_message(data, ctx)
+        try:
+            return data.tipo, format_confirmation(data, ctx)
+        except Exception as e:
+            # O registro já está no ledger: confirmar sem os detalhes em vez de falhar
+            print(f"Erro ao montar a confirmação: {e}")
+            return data.tipo, RECORDED_MESSAGE
+    # Mensagem de formato inválido
+    return 'invalid_format', HELP_MESSAGE
+
+def handle_message(incoming_msg, ctx=None):
+    """Analisa e registra a mensagem do inquilino. Retorna (tipo, resposta)."""
+    ctx = ctx or tenants.context(tenants.default)
+    # Analisar como venda, compra, gasto pessoal ou resumo (uma única passada)
+    with span('parse'):
+        data = ctx.router.parse(incoming_msg)
+    return answer(data, ctx)
+
+def is_durable(tipo):
+    """Se a mensagem desse tipo já deixou algo gravado (no ledger ou na fila de jobs)."""
+    return tipo in CONFIRMATIONS or tipo == 'degraded'
+
+def settle_failed_message(message_sid, tipo, message):
+    """
+    Depois de uma falha no webhook: se nada foi gravado ainda, esquece o
+    MessageSid para que a reentrega do Twilio processe a mensagem de novo;
+    se o registro já foi gravado, guarda a resposta, e a reentrega só a
+    recebe de volta (sem gravar o registro outra vez).
+    """
+    if not is_durable(tipo):
+        dedup.release(message_sid)
+        return
+    try:
+        dedup.store(message_sid, tipo, message)
+    except Exception as e:
+        # O MessageSid continua reservado: a reentrega é tratada como repetida
+        print(f"Erro ao guardar a resposta da mensagem {message_sid}: {e}")
+
+def spill_message(incoming_msg, sender, tenant):
+    """
+    Modo degradado: guarda a mensagem, ainda sem análise, na fila de jobs
+    (SQLite local) com a data de hoje. Um worker a processa e envia a
+    confirmação quando o contexto do inquilino estiver pronto; se a leitura
+    do catálogo continuar falhando, o job é repetido sem limite de
+    tentativas (o usuário já recebeu a resposta do modo degradado).
+    """
+    payload = {'body': incoming_msg, 'sender': sender, 'tenant': tenant.id,
+               'data': date.today().strftime('%d/%m/%Y')}
+    with span('spill'):
+        job_queue.enqueue('message', payload, tenant=tenant.id)
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
-    """Webhook para receber mensagens do WhatsApp via Twilio."""
+    """
+    Webhook para receber mensagens do WhatsApp via Twilio.
+    O registro é gravado no ledger local e confirmado na hora; a planilha é
+    atualizada pelo sincronizador em segundo plano. No modo 'twiml' a
+    confirmação volta na resposta do webhook; no modo 'rest' ela é enviada
+    pela API do Twilio.
+    Reentregas do Twilio (mesmo MessageSid) não geram nenhum trabalho novo:
+    recebem a resposta já dada. O inquilino é escolhido pelos campos To e From.
+    Cada mensagem tem um prazo (REQUEST_BUDGET): se o contexto de um
+    inquilino frio não fica pronto dentro dele, a mensagem é guardada na
+    fila de jobs e respondida com DEGRADED_MESSAGE (modo degradado).
+    """
+    message_sid = request.form.get('MessageSid', '')
+    with trace('webhook', sid=message_sid), deadline():
+        return _webhook(message_sid)
+
+def _webhook(message_sid):
+    tipo = message = None
     try:
         # Extrair a mensagem recebida
         incoming_msg = request.form.get('Body', '')
         sender = request.form.get('From', '').replace('whatsapp:', '')
         
-        # Tentar analisar como venda
-        data = parse_venda_message(incoming_msg)
-        if data:
-            # Adicionar a venda à planilha
-            success = add_venda_to_sheets(data)
-            
-            if success:
-                # Enviar confirmação
-                response_msg = (
-                    f"✅ Venda registrada com sucesso!\n\n"
-                    f"Produto: {data['produto']}\n"
-                    f"Quantidade: {data['quantidade']}\n"
-                    f"Valor Total: R$ {data['valor_total']:.2f}\n"
-                    f"Forma de Pagamento: {data['pagamento']}"
-                )
-            else:
-                response_msg = "❌ Erro ao registrar a venda. Por favor, tente novamente."
-            
-            # Enviar resposta
-            send_whatsapp_message(sender, response_msg)
-            return jsonify({'status': 'success', 'type': 'venda'}), 200
-        
-        # Tentar analisar como compra
-        data = parse_compra_message(incoming_msg)
-        if data:
-            # Adicionar a compra à planilha
-            success = add_compra_to_sheets(data)
-            
-            if success:
-                # Enviar confirmação
-                itens_str = ", ".join([f"{item['quantidade']} {item['nome']}" for item in data['itens']])
-                response_msg = (
-                    f"✅ Compra registrada com sucesso!\n\n"
-                    f"Itens: {itens_str}\n"
-                    f"Valor Total: R$ {data['valor_total']:.2f}\n"
-                    f"Local: {data['local']}\n"
-                    f"Forma de Pagamento: {data['pagamento']}\n\n"
-                    f"✓ Estoque atualizado automaticamente"
-                )
-            else:
-                response_msg = "❌ Erro ao registrar a compra. Por favor, tente novamente."
-            
-            # Enviar resposta
-            send_whatsapp_message(sender, response_msg)
-            return jsonify({'status': 'success', 'type': 'compra'}), 200
-        
-        # Tentar analisar como gasto pessoal
-        data = parse_pessoal_message(incoming_msg)
-        if data:
-            # Adicionar o gasto pessoal à planilha
-            success = add_pessoal_to_sheets(data)
-            
-            if success:
-                # Enviar confirmação
-                response_msg = (
-                    f"✅ Gasto pessoal registrado com sucesso!\n\n"
-                    f"Descrição: {data['descricao']}\n"
-                    f"Valor: R$ {data['valor']:.2f}\n"
-                    f"Categoria: {data['categoria']}\n"
-                    f"Forma de Pagamento: {data['pagamento']}"
-                )
-            else:
-                response_msg = "❌ Erro ao registrar o gasto pessoal. Por favor, tente novamente."
-            
-            # Enviar resposta
-            send_whatsapp_message(sender, response_msg)
-            return jsonify({'status': 'success', 'type': 'pessoal'}), 200
-        
-        # Mensagem de formato inválido
-        response_msg = (
-            "⚠️ Formato inválido. Use um dos formatos:\n\n"
-            "1) Para vendas:\n"
-            "Venda: [Produto] x[Quantidade] - [Forma de Pagamento] - [Observações]\n"
-            "Exemplo: Venda: Trufa de Morango x2 - PIX - Cliente Maria\n\n"
-            "2) Para compras de ingredientes:\n"
-            "Compra: [Itens] - [Valor Total] - [Local] - [Forma de Pagamento] - [Observações]\n"
-            "Exemplo: Compra: 3 leites condensados, 2 cremes de leite - 50,00 - Atacadão - Cartão - Promoção\n\n"
-            "3) Para gastos pessoais:\n"
-            "Pessoal: [Descrição] - [Valor] - [Categoria] - [Forma de Pagamento] - [Observações]\n"
-            "Exemplo: Pessoal: Uber volta do mercado - 20,00 - Transporte - Cartão - Urgente"
-        )
-        
-        # Enviar resposta
-        send_whatsapp_message(sender, response_msg)
+        if message_sid:
+            previous = dedup.claim(message_sid)
+            if previous is not None:
+                tipo, message = previous
+                current_trace().set(tipo=tipo, duplicate=True)
+                if REPLY_MODE == 'twiml':
+                    return twiml_response(message)
+                return jsonify({'status': 'duplicate', 'type': tipo}), 200
         
-        return jsonify({'status': 'success', 'type': 'invalid_format'}), 200
+        tenant = tenants.resolve(request.form.get('To', ''), sender)
+        ctx = tenant_context_within(tenant, remaining() - DEGRADED_MARGIN)
+        if ctx is None:
+            # O catálogo do inquilino não ficou pronto dentro do prazo
+            spill_message(incoming_msg, sender, tenant)
+            tipo, message, status = 'degraded', DEGRADED_MESSAGE, 'degraded'
+        else:
+            tipo, message = handle_message(incoming_msg, ctx)
+            status = 'success'
+        current_trace().set(tipo=tipo, tenant=tenant.id)
+        messages.inc(tipo)
+        if message_sid:
+            dedup.store(message_sid, tipo, message)
+        return respond(sender, message, status, tipo, tenant.account)
     
     except Exception as e:
         print(f"Erro no webhook: {e}")
+        failures.inc('webhook')
+        if message_sid:
+            settle_failed_message(message_sid, tipo, message)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/status', methods=['GET'])
+def status():
+    """Contadores internos do bot."""
+    return jsonify({
+        'sheets_clients': sheets_clients.stats(),
+        'sheets_quota': sheets_gateway.stats(),
+        'jobs': job_queue.stats(),
+        'stock_index': stock_index.stats(),
+        'catalog': catalog.stats(),
+        'twilio': twilio.stats(),
+        'dedup': dedup.stats(),
+        'ledger': ledger_syncer.stats(),
+        'tenants': tenants.stats(),
+        'rollover': rollover.stats(),
+        'breakers': {'sheets': sheets_gateway.breaker.stats(), 'twilio': twilio.breaker.stats()},
+    }), 200
+
+def _sheets_quota_used():
+    stats = sheets_gateway.stats()
+    return {(kind,): stats[kind]['used_last_minute'] for kind in ('read', 'write') if kind in stats}
+
+# Valores lidos na hora da coleta de /metrics
+registry.register(Gauge('job_queue_depth', 'Jobs pendentes ou em execução na fila',
+                        (), lambda: {(): job_queue.stats()['depth']}))
+registry.register(Gauge('ledger_pending_records', 'Registros do ledger ainda não enviados, por destino',
+                        ('sink',), lambda: {(name,): n for name, n in
+                                            ledger_syncer.stats()['pending'].items()}))
+registry.register(Gauge('twilio_queued_messages', 'Respostas na fila de envio do Twilio',
+                        (), lambda: {(): twilio.stats()['queued']}))
+registry.register(Gauge('active_tenants', 'Inquilinos com catálogo e totais em memória',
+                        (), lambda: {(): tenants.stats()['active']}))
+registry.register(Gauge('circuit_breaker_open', 'Disjuntores abertos (1) ou não (0), por serviço',
+                        ('backend',), lambda: {(b.name,): int(b.state == 'open')
+                                               for b in (sheets_gateway.breaker, twilio.breaker)}))
+registry.register(Gauge('sheets_quota_used', 'Chamadas ao Sheets no último minuto, por tipo',
+                        ('kind',), _sheets_quota_used))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas deste worker no formato texto do Prometheus."""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Exportações: colunas e montagem das linhas de cada tipo, iguais às das abas de registro
+EXPORT_TABS = {
+    'venda': (['Data', 'Produto', 'Quantidade', 'Valor Unitário', 'Valor Total', 'Pagamento',
+               'Observações'], venda_rows),
+    'compra': (['Data', 'Descrição', 'Categoria', 'Valor Total', 'Pagamento', 'Observações'],
+               compra_rows),
+    'pessoal': (['Data', 'Descrição', 'Categoria', 'Valor', 'Pagamento', 'Observações'],
+                pessoal_rows),
+}
+
+def export_response(args):
+    """
+    Valida os parâmetros de /export (tipo, formato, inicio, fim e inquilino) e
+    retorna (nome do arquivo, tipo de conteúdo, gerador dos pedaços). Os
+    registros só são lidos do ledger à medida que os pedaços são consumidos.
+    ValueError se algum parâmetro for inválido.
+    """
+    tipo = args.get('tipo', '')
+    if tipo not in EXPORT_TABS:
+        raise ValueError(f"tipo deve ser um de: {', '.join(EXPORT_TABS)}")
+    formato = args.get('formato', 'csv')
+    if formato not in EXPORT_FORMATS:
+        raise ValueError(f"formato deve ser um de: {', '.join(EXPORT_FORMATS)}")
+    inicio = parse_date(args['inicio']) if args.get('inicio') else None
+    fim = parse_date(args['fim']) if args.get('fim') else None
+    tenant_id = args.get('inquilino', '')
+    if tenants.get(tenant_id).id != tenant_id:
+        raise ValueError(f"inquilino desconhecido: '{tenant_id}'")
+
+    columns, rows = EXPORT_TABS[tipo]
+    pages = iter_pages(ledger, tipo, tenant_id, inicio, fim)
+    chunks = export_chunks(pages, columns, lambda records: rows([record_from_dict(r) for r in records]),
+                           formato)
+    return f'{tipo}.{formato}', EXPORT_FORMATS[formato], chunks
+
+@app.route('/export', methods=['GET'])
+def export():
+    """
+    Exporta os registros do ledger em CSV ou JSONL, ex.:
+    GET /export?tipo=venda&inicio=01/09/2026&fim=30/09/2026&formato=csv
+    A resposta é enviada em pedaços (chunked), uma página do ledger por vez;
+    com inicio ou fim, só os registros do intervalo são lidos, em ordem de data.
+    Só sai o que o bot gravou no ledger: linhas importadas por backfill.py e
+    registros anteriores ao ledger ficam apenas na planilha.
+    """
+    if not authorized(request.headers.get('Authorization', ''), EXPORT_TOKEN):
+        return jsonify({'status': 'unauthorized'}), 401
+    try:
+        filename, content_type, chunks = export_response(request.args)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return Response(chunks, content_type=content_type,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
 def create_credentials_file(credentials_json):
     """Cria o arquivo de credenciais do Google Sheets."""
     with open('credentials.json', 'w') as f:
         f.write(credentials_json)
+    sheets_clients.reset()
 
 def update_config(spreadsheet_id, twilio_sid, twilio_token):
     """Atualiza as configurações globais."""
     global SAMPLE_SPREADSHEET_ID, TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN
     SAMPLE_SPREADSHEET_ID = spreadsheet_id
+    default_tenant.spreadsheet_id = spreadsheet_id
     TWILIO_ACCOUNT_SID = twilio_sid
     TWILIO_AUTH_TOKEN = twilio_token
+    twilio.configure(twilio_sid, twilio_token)
 
-def load_products_from_sheet():
-    """Carrega os produtos e preços da planilha."""
+def fetch_catalog_values(spreadsheet_id=None):
+    """
+    Lê as abas Produtos, Controle de Estoque, Categorias e Receitas em uma
+    única chamada. Categorias e Receitas são opcionais: se a planilha não
+    tiver uma delas, as outras são lidas sem ela (valem as categorias padrão
+    e os produtos ficam sem custo).
+    """
+    spreadsheet_id = spreadsheet_id or SAMPLE_SPREADSHEET_ID
+    sheet = sheets_for(spreadsheet_id)
+    missing_tabs = missing_catalog_tabs.setdefault(spreadsheet_id, set())
+    sections = [('produtos', PRODUCTS_RANGE), ('ingredientes', INGREDIENTS_RANGE)]
+    sections += [(name, r) for name, r in OPTIONAL_CATALOG_SECTIONS if name not in missing_tabs]
     try:
-        sheet = setup_google_sheets()
-        
-        # Obter dados da aba Produtos
-        result = sheet.values().get(spreadsheetId=SAMPLE_SPREADSHEET_ID,
-                                   range='Produtos!B:D').execute()
-        values = result.get('values', [])
-        
-        # Atualizar o dicionário de produtos
-        global produtos
-        produtos = {}
-        
-        # Pular o cabeçalho
-        for row in values[4:]:
-            if len(row) >= 3:
-                produto = row[0].lower()
-                try:
-                    preco = float(row[2].replace('R$', '').replace(',', '.').strip())
-                    produtos[produto] = preco
-                except (ValueError, IndexError):
-                    pass
-        
-        return True
-    
-    except Exception as e:
-        print(f"Erro ao carregar produtos da planilha: {e}")
-        return False
+        # A atualização do catálogo cede a vez às gravações dos usuários
+        with sheets_gateway.priority(PRIORITY_BACKGROUND):
+            result = sheet.values().batchGet(spreadsheetId=spreadsheet_id,
+                                             ranges=[r for _, r in sections]).execute()
+    except HttpError as e:
+        optional = [(name, r) for name, r in sections if name in dict(OPTIONAL_CATALOG_SECTIONS)]
+        if e.resp.status != 400 or not optional:
+            raise
+        # Planilha sem alguma aba opcional: a mensagem de erro cita o intervalo inválido
+        missing = [name for name, r in optional if r.split('!')[0] in str(e)] or [n for n, _ in optional]
+        missing_tabs.update(missing)
+        return fetch_catalog_values(spreadsheet_id)
+    ranges = result.get('valueRanges', [])
+    return {
+        name: ranges[i].get('values', []) if len(ranges) > i else []
+        for i, (name, _) in enumerate(sections)
+    }
+
+def load_catalog_from_sheet():
+    """Carrega os produtos e ingredientes da planilha e publica uma nova versão do catálogo."""
+    return catalog.refresh()
+
+# Abas opcionais do catálogo; as que não existem na planilha deixam de ser lidas
+# (sem a aba Categorias, as categorias acima são usadas), por planilha
+OPTIONAL_CATALOG_SECTIONS = [('categorias', CATEGORIES_RANGE), ('receitas', RECIPES_RANGE)]
+missing_catalog_tabs = {}
+
+# Catálogo de produtos e ingredientes; começa com os dicionários acima
+# e é atualizado a partir da planilha em segundo plano
+CATALOG_TTL = float(os.environ.get('CATALOG_TTL', '300'))
+catalog = CatalogService(fetch_catalog_values, produtos, ingredientes,
+                         categorias_pessoais, ttl=CATALOG_TTL)
+
+# Roteador de mensagens: classifica pelo prefixo e aplica a gramática do comando
+router = build_router(catalog.current)
+
+def build_tenant_context(tenant):
+    """
+    Catálogo, roteador e totais de um inquilino. O inquilino padrão usa os
+    globais acima; os outros leem o catálogo da própria planilha na hora
+    (sem thread de atualização: ele é relido quando passa do ttl, na
+    mensagem seguinte) e guardam os totais em um arquivo próprio.
+
+    RuntimeError se a primeira leitura do catálogo falhar: o contexto não é
+    criado (nem guardado em cache), em vez de usar os produtos e preços do
+    inquilino padrão na planilha de outro.
+    """
+    if tenant is default_tenant:
+        return TenantContext(tenant, catalog, router, aggregates)
+    tenant_catalog = CatalogService(lambda: fetch_catalog_values(tenant.spreadsheet_id),
+                                    produtos, ingredientes, categorias_pessoais, ttl=CATALOG_TTL)
+    if not tenant_catalog.refresh():
+        raise RuntimeError(f"catálogo do inquilino {tenant.id} não pôde ser lido da planilha")
+    ctx = TenantContext(tenant, tenant_catalog, build_router(tenant_catalog.current),
+                        Aggregates(f'{AGGREGATES_PATH}.{tenant.id}'))
+    threading.Thread(target=prepare_aggregates, args=(ctx,), name=f'aggregates-{tenant.id}',
+                     daemon=True).start()
+    return ctx
+
+def tenant_context(tenant, build=True):
+    """
+    Contexto do inquilino (com build=False, None se ainda não estiver em
+    memória); o catálogo de um inquilino já ativo é relido em segundo plano
+    se passou do ttl.
+    """
+    ctx = tenants.context(tenant, build)
+    if ctx is not None and tenant is not default_tenant:
+        ctx.catalog.refresh_if_stale()
+    return ctx
 
-def load_ingredients_from_sheet():
-    """Carrega os ingredientes e preços da planilha."""
+# Leituras do contexto de inquilinos frios feitas para o webhook, uma por inquilino
+tenant_builder = ThreadPoolExecutor(max_workers=4, thread_name_prefix='tenant-build')
+_tenant_builds = {}
+_tenant_builds_lock = threading.Lock()
+
+def tenant_build(tenant):
+    """Future do contexto do inquilino; mensagens simultâneas de um inquilino frio esperam a mesma leitura."""
+    with _tenant_builds_lock:
+        future = _tenant_builds.get(tenant.id)
+        if future is None:
+            future = _tenant_builds[tenant.id] = tenant_builder.submit(tenant_context, tenant)
+            future.add_done_callback(lambda _: _tenant_builds.pop(tenant.id, None))
+        return future
+
+def tenant_context_within(tenant, timeout):
+    """
+    Contexto do inquilino, esperando no máximo `timeout` segundos pela
+    leitura do catálogo de um inquilino frio. None se ele não ficou pronto
+    a tempo (a leitura continua em segundo plano) ou se a leitura falhou.
+    """
+    ctx = tenant_context(tenant, build=False)
+    if ctx is not None:
+        return ctx
     try:
-        sheet = setup_google_sheets()
-        
-        # Obter dados da aba Controle de Estoque
-        result = sheet.values().get(spreadsheetId=SAMPLE_SPREADSHEET_ID,
-                                   range='Controle de Estoque!B:E').execute()
-        values = result.get('values', [])
-        
-        # Atualizar o dicionário de ingredientes
-        global ingredientes
-        ingredientes = {}
-        
-        # Pular o cabeçalho
-        for row in values[4:]:
-            if len(row) >= 3:
-                nome = row[0].lower()
-                try:
-                    unidade = row[2] if len(row) > 2 else "g"
-                    preco = float(row[3].replace('R$', '').replace(',', '.').strip()) if len(row) > 3 else 0
-                    ingredientes[nome] = {
-                        "unidade": unidade,
-                        "preco": preco
-                    }
-                except (ValueError, IndexError):
-                    pass
-        
-        return True
-    
+        return tenant_build(tenant).result(timeout=max(0.0, timeout))
+    except FutureTimeout:
+        return None
     except Exception as e:
-        print(f"Erro ao carregar ingredientes da planilha: {e}")
-        return False
+        print(f"Erro ao preparar o inquilino {tenant.id}: {e}")
+        return None
+
+# Inquilinos: o padrão (a planilha e o número configurados acima) e os de TENANTS_PATH,
+# cada um com seu número do Twilio e sua planilha
+default_tenant = Tenant('', TWILIO_PHONE_NUMBER, SAMPLE_SPREADSHEET_ID)
+tenants = TenantRegistry(default_tenant, load_tenants(TENANTS_PATH), build_tenant_context)
 
 if __name__ == '__main__':
     # Este código seria executado quando o aplicativo é iniciado
     # Carregar produtos e ingredientes da planilha
-    load_products_from_sheet()
-    load_ingredients_from_sheet()
+    load_catalog_from_sheet()
+    start_background_workers()
     
     # Iniciar o servidor Flask
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,489 @@
+"""
+Variante asyncio (ASGI) do webhook, para muitos remetentes simultâneos por processo.
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+
+Atende o mesmo contrato de /webhook do app Flask (mesmos campos do
+formulário, respostas JSON ou TwiML conforme REPLY_MODE, reentregas do
+Twilio reconhecidas pelo MessageSid, inquilino escolhido por To e From) e
+reaproveita os inquilinos, o ledger, o dedup e as mensagens de confirmação
+de app.py. Nenhuma mensagem
+segura uma thread esperando a rede:
+
+- as respostas pelo Twilio e a sincronização do ledger com as abas de
+  registro usam HTTP não bloqueante (httpx), com um pool de conexões por
+  serviço compartilhado por todo o processo;
+- a gravação local (SQLite com fsync) vai para o pool de threads do loop.
+
+A baixa e a entrada de estoque, a fila de jobs, o catálogo, o arquivamento
+mensal e os totais do resumo continuam com o código (e as threads) de app.py.
+"""
+import os
+import json
+import fcntl
+import asyncio
+import contextvars
+from urllib.parse import parse_qs, quote
+
+import httpx
+
+import app as bot
+from export import authorized
+from ledger import SYNC_BACKOFF_MAX
+from resilience import DEGRADED_MARGIN, deadline, remaining
+from sheets_gateway import MAX_RETRIES as SHEETS_MAX_RETRIES, PRIORITY_USER
+from tracing import current_trace, external_calls, failures, messages, registry, span, trace
+from twilio_sender import CONNECT_TIMEOUT, MAX_RETRIES, READ_TIMEOUT
+
+SHEETS_API_BASE = os.environ.get('SHEETS_API_BASE', 'https://sheets.googleapis.com')
+
+# Conexões simultâneas de cada pool HTTP (Twilio e Sheets)
+HTTP_POOL_SIZE = int(os.environ.get('ASGI_HTTP_POOL_SIZE', '100'))
+
+# Abas de registro gravadas pelo cliente assíncrono: montagem das linhas (a última
+# coluna é a de sequência do ledger, bot.LEDGER_SEQ_COLUMNS).
+# Os demais destinos do ledger (estoque) usam os writers de app.py em uma thread.
+ASYNC_SINKS = {
+    'Registro de Vendas': bot.venda_rows,
+    'Via 1 - Negócios': bot.compra_rows,
+    'Via 2 - Pessoal': bot.pessoal_rows,
+}
+
+
+def _http_client():
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=HTTP_POOL_SIZE,
+                            max_keepalive_connections=HTTP_POOL_SIZE))
+
+
+class AsyncTwilio:
+    """
+    Envio de mensagens pela API REST do Twilio sem bloquear o loop.
+
+    Usa as credenciais, o número e a URL do TwilioSender de app.py, com as
+    mesmas novas tentativas em 429/5xx e o mesmo disjuntor. As mensagens de um destinatário
+    saem na ordem em que foram geradas (um asyncio.Lock por destinatário,
+    que atende em ordem de chegada); destinatários diferentes são enviados
+    em paralelo. Mensagens que falham de vez vão para a fila de jobs. Uma
+    TwilioAccount troca a conta e o número de envio, como no TwilioSender.
+    """
+
+    def __init__(self, sender):
+        self.sender = sender
+        self.client = None
+        self._locks = {}
+        self._pending = {}
+        self._tasks = set()
+
+    def open(self):
+        self.client = _http_client()
+
+    async def close(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.client.aclose()
+
+    def enqueue(self, to, message, account=None):
+        # A entrega roda num contexto vazio: não herda o prazo (nem o trace) da mensagem
+        task = contextvars.Context().run(asyncio.create_task, self._deliver(to, message, account))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, to, message, account):
+        lock = self._locks.setdefault(to, asyncio.Lock())
+        self._pending[to] = self._pending.get(to, 0) + 1
+        try:
+            async with lock:
+                if not await self.send(to, message, account):
+                    await asyncio.to_thread(bot.enqueue_reply, to, message, account)
+        except Exception as e:
+            print(f"Erro no envio de mensagem WhatsApp: {e}")
+        finally:
+            self._pending[to] -= 1
+            if not self._pending[to]:
+                del self._pending[to]
+                del self._locks[to]
+
+    async def send(self, to, message, account=None):
+        """Envia a mensagem agora. Retorna True se o Twilio aceitou."""
+        with span('twilio', op='messages.create'):
+            return await self._send(to, message, account or self.sender)
+
+    async def _send(self, to, message, account):
+        s = self.sender
+        auth = ((account.account_sid, account.auth_token) if account.account_sid
+                else (s.account_sid, s.auth_token))
+        url = f'{s.base_url}/2010-04-01/Accounts/{auth[0]}/Messages.json'
+        data = {'To': f'whatsapp:{to}', 'From': account.from_number, 'Body': message}
+        for attempt in range(MAX_RETRIES + 1):
+            if not s.breaker.allow():
+                print("Twilio indisponível (disjuntor aberto): envio adiado")
+                break
+            response = None
+            try:
+                response = await self.client.post(url, data=data, auth=auth)
+            except httpx.HTTPError as e:
+                external_calls.inc('twilio', 'messages.create', 'error')
+                s.breaker.record_failure()
+                print(f"Erro ao enviar mensagem WhatsApp (tentativa {attempt + 1}): {e}")
+            else:
+                external_calls.inc('twilio', 'messages.create', str(response.status_code))
+                if response.status_code >= 500:
+                    s.breaker.record_failure()
+                else:
+                    s.breaker.record_success()
+                if response.status_code == 201:
+                    return True
+                if response.status_code != 429 and response.status_code < 500:
+                    # Erro do cliente (ex.: número inválido): não adianta repetir
+                    break
+            if attempt == MAX_RETRIES:
+                break
+            await asyncio.sleep(s._retry_delay(attempt, response))
+        failures.inc('twilio')
+        return False
+
+    def stats(self):
+        return {'in_flight': len(self._tasks), 'recipients': len(self._locks)}
+
+
+class AsyncSheets:
+    """
+    Chamadas à API REST do Sheets sem o googleapiclient e sem bloquear o loop.
+
+    Respeita as cotas e o disjuntor do SheetsGateway de app.py (a espera por
+    uma ficha vai para uma thread) e pausa as chamadas de escrita em respostas 429. O token
+    vem das credenciais do SheetsClientRegistry que `clients_for` devolve para
+    a planilha (as do inquilino dono dela, se ele tiver credenciais próprias).
+    """
+
+    def __init__(self, gateway, clients_for, base_url=SHEETS_API_BASE):
+        self.gateway = gateway
+        self.clients_for = clients_for
+        self.base_url = base_url.rstrip('/')
+        self.client = None
+
+    def open(self):
+        self.client = _http_client()
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def append(self, spreadsheet_id, a1_range, rows, priority=PRIORITY_USER):
+        """values.append com USER_ENTERED/OVERWRITE, como app.append_rows."""
+        url = f'{self.base_url}/v4/spreadsheets/{spreadsheet_id}/values/{quote(a1_range, safe="")}:append'
+        params = {'valueInputOption': 'USER_ENTERED', 'insertDataOption': 'OVERWRITE'}
+        with span('sheets', op='values.append', tab=a1_range.split('!')[0]):
+            breaker = self.gateway.breaker
+            for attempt in range(SHEETS_MAX_RETRIES + 1):
+                breaker.check()
+                try:
+                    await asyncio.to_thread(self.gateway.acquire, 'write', priority)
+                    credentials = await asyncio.to_thread(self.clients_for(spreadsheet_id).credentials)
+                except BaseException:
+                    # A chamada de teste do disjuntor não chegou a ser feita
+                    breaker.release()
+                    raise
+                try:
+                    response = await self.client.post(
+                        url, params=params, json={'values': rows},
+                        headers={'Authorization': f'Bearer {credentials.token}'})
+                except httpx.HTTPError:
+                    external_calls.inc('sheets', 'values.append', 'error')
+                    breaker.record_failure()
+                    raise
+                external_calls.inc('sheets', 'values.append',
+                                   'ok' if response.is_success else str(response.status_code))
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if response.status_code == 429 and attempt < SHEETS_MAX_RETRIES:
+                    self.gateway.throttle('write', attempt, response.headers.get('Retry-After'))
+                    continue
+                response.raise_for_status()
+                return response.json()
+
+
+class AsyncLedgerSyncer:
+    """
+    Versão assíncrona do LedgerSyncer de app.py: mesmos destinos, mesmas
+    high-water marks, mesmo rodízio entre inquilinos e mesma trava de arquivo
+    (só um processo sincroniza por vez, seja ele Flask ou ASGI).
+    """
+
+    def __init__(self, syncer, sheets):
+        self.syncer = syncer
+        self.sheets = sheets
+        self._wakeup = asyncio.Event()
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def _write(self, spreadsheet_id, name, writer, batch):
+        if name in ASYNC_SINKS:
+            records = [self.syncer.decode(d) for _, d in batch]
+            rows = bot.tag_rows(ASYNC_SINKS[name], records, [seq for seq, _ in batch])
+            last_col = bot.LEDGER_SEQ_COLUMNS[name]
+            await self.sheets.append(spreadsheet_id, f'{name}!A{bot.HEADER_ROWS + 1}:{last_col}', rows)
+        else:
+            await asyncio.to_thread(self.syncer.write_batch, name, spreadsheet_id, writer, batch)
+
+    @staticmethod
+    def _lock(lock_path):
+        """Abre e trava o arquivo de trava sem esperar; None se outro processo já o travou."""
+        lock_file = open(lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    @staticmethod
+    def _unlock(lock_file):
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            lock_file.close()
+
+    async def sync_once(self, spreadsheet_id=None):
+        """
+        Envia os registros pendentes. Retorna quantos, ou None se outro processo
+        está sincronizando. A trava e as leituras do ledger (cada lote do
+        rodízio) são feitas em threads: só a espera pelo Sheets fica no loop.
+        """
+        syncer, ledger = self.syncer, self.syncer.ledger
+        lock_file = await asyncio.to_thread(self._lock, syncer.lock_path)
+        if lock_file is None:
+            return None
+        try:
+            with trace('ledger.sync') as current:
+                total = 0
+                batches = syncer.pending_batches(spreadsheet_id)
+                while True:
+                    pending = await asyncio.to_thread(next, batches, None)
+                    if pending is None:
+                        break
+                    target, name, spreadsheet_id, writer, batch = pending
+                    with span('sync', tab=name, records=len(batch)):
+                        unwritten = await asyncio.to_thread(syncer.prepare_batch, target, name,
+                                                            spreadsheet_id, batch)
+                        if unwritten:
+                            await self._write(spreadsheet_id, name, writer, unwritten)
+                    await asyncio.to_thread(ledger.commit_batch, target, batch[-1][0])
+                    total += len(batch)
+                    syncer.batches += 1
+                current.set(records=total)
+            syncer.synced += total
+            return total
+        finally:
+            await asyncio.to_thread(self._unlock, lock_file)
+
+    async def run(self):
+        consecutive = 0
+        while True:
+            try:
+                await self.sync_once()
+                consecutive = 0
+            except Exception as e:
+                consecutive += 1
+                self.syncer.errors += 1
+                self.syncer.last_error = str(e)
+                failures.inc('ledger_sync')
+                print(f"Erro ao sincronizar o ledger com a planilha: {e}")
+            delay = min(self.syncer.interval * (2 ** consecutive), SYNC_BACKOFF_MAX)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+twilio = AsyncTwilio(bot.twilio)
+sheets = AsyncSheets(bot.sheets_gateway, bot.sheets_clients_for)
+ledger_syncer = None  # criado na inicialização, dentro do loop
+_background = []
+
+
+def json_response(payload, status=200):
+    return status, 'application/json', json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+
+def twiml_response(message=None):
+    return 200, 'text/xml', bot.twiml_body(message).encode('utf-8')
+
+
+def respond(sender, message, status, tipo, account=None):
+    """Responde ao remetente de acordo com REPLY_MODE."""
+    with span('reply', op=bot.REPLY_MODE):
+        if bot.REPLY_MODE == 'twiml':
+            return twiml_response(message)
+        twilio.enqueue(sender, message, account)
+        return json_response({'status': status, 'type': tipo})
+
+
+async def handle_message(incoming_msg, ctx):
+    """
+    Analisa e registra a mensagem do inquilino com o mesmo código do app
+    Flask (bot.handle_message), numa thread: a gravação com fsync e o
+    relatório do resumo ficam fora do loop. Retorna (tipo, resposta).
+    """
+    tipo, message = await asyncio.to_thread(bot.handle_message, incoming_msg, ctx)
+    if tipo in bot.CONFIRMATIONS:
+        # A planilha é atualizada em segundo plano pelo sincronizador assíncrono
+        ledger_syncer.notify()
+    return tipo, message
+
+
+async def tenant_context_within(tenant, timeout):
+    """Como bot.tenant_context_within, mas esperando a leitura sem ocupar uma thread."""
+    try:
+        future = asyncio.wrap_future(bot.tenant_build(tenant))
+        return await asyncio.wait_for(asyncio.shield(future), max(0.0, timeout))
+    except asyncio.TimeoutError:
+        return None
+    except Exception as e:
+        print(f"Erro ao preparar o inquilino {tenant.id}: {e}")
+        return None
+
+
+async def webhook(form):
+    """Mesmo contrato do /webhook do app Flask."""
+    message_sid = form.get('MessageSid', '')
+    with trace('webhook', sid=message_sid), deadline():
+        tipo = message = None
+        try:
+            incoming_msg = form.get('Body', '')
+            sender = form.get('From', '').replace('whatsapp:', '')
+
+            if message_sid:
+                previous = await asyncio.to_thread(bot.dedup.claim, message_sid)
+                if previous is not None:
+                    tipo, message = previous
+                    current_trace().set(tipo=tipo, duplicate=True)
+                    if bot.REPLY_MODE == 'twiml':
+                        return twiml_response(message)
+                    return json_response({'status': 'duplicate', 'type': tipo})
+
+            tenant = bot.tenants.resolve(form.get('To', ''), sender)
+            # Um inquilino frio lê o catálogo da planilha: fora do loop e dentro do prazo
+            ctx = bot.tenant_context(tenant, build=False)
+            if ctx is None:
+                ctx = await tenant_context_within(tenant, remaining() - DEGRADED_MARGIN)
+            if ctx is None:
+                await asyncio.to_thread(bot.spill_message, incoming_msg, sender, tenant)
+                tipo, message, status = 'degraded', bot.DEGRADED_MESSAGE, 'degraded'
+            else:
+                tipo, message = await handle_message(incoming_msg, ctx)
+                status = 'success'
+            current_trace().set(tipo=tipo, tenant=tenant.id)
+            messages.inc(tipo)
+            if message_sid:
+                await asyncio.to_thread(bot.dedup.store, message_sid, tipo, message)
+            return respond(sender, message, status, tipo, tenant.account)
+
+        except Exception as e:
+            print(f"Erro no webhook: {e}")
+            failures.inc('webhook')
+            if message_sid:
+                await asyncio.to_thread(bot.settle_failed_message, message_sid, tipo, message)
+            return json_response({'status': 'error', 'message': str(e)}, 500)
+
+
+async def startup():
+    """Inicia os clientes HTTP, a sincronização assíncrona e as threads de app.py que continuam valendo."""
+    global ledger_syncer
+    twilio.open()
+    sheets.open()
+    ledger_syncer = AsyncLedgerSyncer(bot.ledger_syncer, sheets)
+    bot.job_queue.start_workers(bot.process_job, count=bot.JOB_WORKERS)
+    bot.twilio.start()  # só para os jobs 'reply' reprocessados pela fila
+    bot.ledger.init_high_water(f'{bot.SAMPLE_SPREADSHEET_ID}:Baixa de Estoque', bot.ledger.last_seq())
+    bot.catalog.start()
+    bot.rollover.start()
+    bot.start_aggregates()
+    _background.append(asyncio.create_task(ledger_syncer.run()))
+
+
+async def shutdown():
+    for task in _background:
+        task.cancel()
+    await twilio.close()
+    await sheets.close()
+
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        event = await receive()
+        body += event.get('body', b'')
+        if not event.get('more_body'):
+            return body
+
+
+async def _lifespan(receive, send):
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            await startup()
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            await shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def export(scope, send):
+    """Mesmo contrato do /export do app Flask: cada página do ledger é lida numa thread e enviada em seguida."""
+    headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+    if not authorized(headers.get('authorization', ''), bot.EXPORT_TOKEN):
+        status, content_type, payload = json_response({'status': 'unauthorized'}, 401)
+    else:
+        args = {k: v[0] for k, v in parse_qs(scope['query_string'].decode('utf-8')).items()}
+        try:
+            filename, content_type, chunks = bot.export_response(args)
+        except ValueError as e:
+            status, content_type, payload = json_response({'status': 'error', 'message': str(e)}, 400)
+        else:
+            # Sem content-length: o servidor usa chunked transfer encoding
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', content_type.encode('latin-1')),
+                                    (b'content-disposition',
+                                     f'attachment; filename="{filename}"'.encode('latin-1'))]})
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type.encode('latin-1')),
+                            (b'content-length', str(len(payload)).encode('latin-1'))]})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def app(scope, receive, send):
+    """Aplicação ASGI: POST /webhook, GET /export e GET /metrics."""
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    if scope['path'] == '/export' and scope['method'] == 'GET':
+        return await export(scope, send)
+    if scope['path'] == '/webhook' and scope['method'] == 'POST':
+        body = await _read_body(receive)
+        form = {k: v[0] for k, v in parse_qs(body.decode('utf-8'), keep_blank_values=True).items()}
+        status, content_type, payload = await webhook(form)
+    elif scope['path'] == '/metrics' and scope['method'] == 'GET':
+        status, content_type, payload = 200, 'text/plain; version=0.0.4', registry.render().encode('utf-8')
+    else:
+        status, content_type, payload = json_response({'status': 'not_found'}, 404)
+
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type.encode('latin-1')),
+                            (b'content-length', str(len(payload)).encode('latin-1'))]})
+    await send({'type': 'http.response.body', 'body': payload})
@@ -0,0 +1,279 @@
+"""
+Importação de conversas antigas do WhatsApp ("Exportar conversa") para a planilha.
+
+    python backfill.py conversa.txt [--chunk-size 5000] [--spreadsheet-id ID]
+
+O arquivo é lido linha a linha (nunca inteiro na memória). Cada mensagem
+passa pelos mesmos analisadores do bot, com o catálogo da planilha de
+destino relido no início e a data original da conversa, e os registros são
+agrupados por aba e gravados em um único batchUpdate por lote, em linhas
+explícitas logo após o fim de cada aba. Depois de cada lote um checkpoint
+(<arquivo>.checkpoint.json) guarda a posição no arquivo e a próxima linha
+de cada aba: rodar o mesmo comando de novo continua de onde parou, e um
+lote gravado sem checkpoint é regravado nas mesmas células, sem duplicar
+linhas.
+
+Só as abas de registro são preenchidas (Registro de Vendas, Via 1 -
+Negócios e Via 2 - Pessoal): o estoque atual não muda por causa de compras
+e vendas antigas. A sincronização do ledger fica parada durante a
+importação e os totais do "Resumo:" são recalculados no final.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+import app
+from sheets_gateway import PRIORITY_BACKGROUND
+
+# Mensagens por lote (um batchUpdate por lote)
+CHUNK_SIZE = 5000
+
+# Cabeçalho de cada mensagem na exportação, com ou sem segundos e AM/PM:
+#   Android: "18/10/2026 14:32 - Maria: Venda: ..."
+#   iPhone:  "[18/10/2026, 14:32:10] Maria: Venda: ..."
+ANDROID_RE = re.compile(
+    r'^(?P<data>\d{1,2}/\d{1,2}/\d{2,4}),? \d{1,2}:\d{2}(?::\d{2})?(?:\s?[APap]\.?[Mm]\.?)? - (?P<resto>.*)$')
+IOS_RE = re.compile(
+    r'^\[(?P<data>\d{1,2}/\d{1,2}/\d{2,4}),? \d{1,2}:\d{2}(?::\d{2})?(?:\s?[APap]\.?[Mm]\.?)?\] (?P<resto>.*)$')
+
+# Caracteres invisíveis que o WhatsApp coloca no início de algumas linhas
+INVISIBLE = '\ufeff\u200e\u200f\u202a\u202c'
+
+# Aba, última coluna e montagem das linhas de cada tipo de registro
+TARGETS = {
+    'venda': ('Registro de Vendas', 'G', app.venda_rows),
+    'compra': ('Via 1 - Negócios', 'F', app.compra_rows),
+    'pessoal': ('Via 2 - Pessoal', 'F', app.pessoal_rows),
+}
+
+# Registros que a importação grava (os outros comandos, ex.: Resumo:, são ignorados)
+RECORD_TYPES = (app.Venda, app.Compra, app.Pessoal)
+
+
+def parse_header(line):
+    """Retorna (data dd/mm/aaaa, resto da linha) se a linha abre uma mensagem, senão None."""
+    match = ANDROID_RE.match(line) or IOS_RE.match(line)
+    if not match:
+        return None
+    dia, mes, ano = match.group('data').split('/')
+    if len(ano) == 2:
+        ano = '20' + ano
+    return f"{int(dia):02d}/{int(mes):02d}/{ano}", match.group('resto')
+
+
+def iter_messages(f, offset=0):
+    """
+    Gera (data, autor, texto, fim) para cada mensagem do arquivo binário `f`,
+    a partir do byte `offset`. Linhas sem cabeçalho continuam a mensagem
+    anterior. `fim` é a posição (em bytes) logo após a mensagem, usada como
+    checkpoint. Avisos do sistema (sem autor) são ignorados.
+    """
+    f.seek(offset)
+    position = offset
+    current = None  # [data, autor, linhas]
+    for raw in f:
+        line = raw.decode('utf-8', errors='replace').rstrip('\r\n').lstrip(INVISIBLE)
+        header = parse_header(line)
+        if header is not None:
+            if current is not None:
+                yield current[0], current[1], '\n'.join(current[2]), position
+            data, resto = header
+            autor, sep, texto = resto.partition(': ')
+            current = [data, autor, [texto.lstrip(INVISIBLE)]] if sep else None
+        elif current is not None:
+            current[2].append(line)
+        position += len(raw)
+    if current is not None:
+        yield current[0], current[1], '\n'.join(current[2]), position
+
+
+def parse_message(router, texto, data):
+    """Analisa a mensagem com o roteador da planilha de destino; retorna o registro ou None."""
+    record = router.parse(texto, data)
+    return record if isinstance(record, RECORD_TYPES) else None
+
+
+def load_router(spreadsheet_id):
+    """
+    Roteador sobre o catálogo atual da planilha de destino: o do inquilino
+    dono dela, relido agora, ou, para uma planilha que não é de nenhum
+    inquilino, um catálogo lido só para a importação. Sem isso, produtos e
+    categorias que só existem na planilha seriam recusados ou teriam o preço
+    do catálogo embutido no código.
+    """
+    tenant = app.tenants.for_spreadsheet(spreadsheet_id)
+    if tenant.spreadsheet_id == spreadsheet_id:
+        ctx = app.tenant_context(tenant)
+        catalog, router = ctx.catalog, ctx.router
+    else:
+        catalog = app.CatalogService(lambda: app.fetch_catalog_values(spreadsheet_id), app.produtos,
+                                     app.ingredientes, app.categorias_pessoais, ttl=app.CATALOG_TTL)
+        router = app.build_router(catalog.current)
+    if not catalog.refresh():
+        print("Aviso: catálogo não relido da planilha; usando a última versão carregada",
+              file=sys.stderr)
+    return router
+
+
+def next_rows(sheet, spreadsheet_id):
+    """Primeira linha livre de cada aba de registro (uma leitura)."""
+    tabs = [tab for tab, _, _ in TARGETS.values()]
+    with app.sheets_gateway.priority(PRIORITY_BACKGROUND):
+        result = sheet.values().batchGet(spreadsheetId=spreadsheet_id,
+                                         ranges=[f'{tab}!A:A' for tab in tabs]).execute()
+    ranges = result.get('valueRanges', [])
+    return {
+        tab: max(len(ranges[i].get('values', [])) if len(ranges) > i else 0, app.HEADER_ROWS) + 1
+        for i, tab in enumerate(tabs)
+    }
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, checkpoint):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def write_chunk(sheet, spreadsheet_id, buckets, rows):
+    """Grava os registros do lote, agrupados por aba, em um único batchUpdate."""
+    data = []
+    written = {}
+    for tipo, records in buckets.items():
+        tab, last_col, build_rows = TARGETS[tipo]
+        values = build_rows(records)
+        if not values:
+            continue
+        start = rows[tab]
+        data.append({'range': f'{tab}!A{start}:{last_col}{start + len(values) - 1}',
+                     'values': values})
+        written[tab] = len(values)
+    if data:
+        with app.sheets_gateway.priority(PRIORITY_BACKGROUND):
+            sheet.values().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={'valueInputOption': 'USER_ENTERED', 'data': data}).execute()
+    return written
+
+
+def reconcile_rows(checkpoint_rows, actual_rows, pending):
+    """
+    Decide onde o próximo lote começa ao retomar. Se a aba cresceu exatamente
+    o tamanho do lote pendente, esse lote já foi gravado (e será regravado nas
+    mesmas células); se cresceu de outro jeito, alguém gravou nela e o lote
+    vai depois das linhas novas.
+    """
+    rows = {}
+    for tab, expected in checkpoint_rows.items():
+        actual = actual_rows.get(tab, expected)
+        if actual in (expected, expected + pending.get(tab, 0)):
+            rows[tab] = expected
+        else:
+            print(f"Aviso: a aba {tab} mudou desde o último checkpoint; continuando na linha {actual}")
+            rows[tab] = actual
+    return rows
+
+
+def run(path, spreadsheet_id=None, chunk_size=CHUNK_SIZE, checkpoint_path=None, sheet=None,
+        progress=True):
+    """Importa o arquivo `path`. Retorna os contadores finais."""
+    spreadsheet_id = spreadsheet_id or app.SAMPLE_SPREADSHEET_ID
+    checkpoint_path = checkpoint_path or f'{path}.checkpoint.json'
+    sheet = sheet or app.sheets_for(spreadsheet_id)
+
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint and checkpoint.get('spreadsheet_id') != spreadsheet_id:
+        raise SystemExit(f"O checkpoint {checkpoint_path} é de outra planilha; apague-o para recomeçar")
+
+    router = load_router(spreadsheet_id)
+
+    # Sem a sincronização do ledger gravando nas mesmas abas durante a importação
+    with app.ledger_syncer.paused(), open(path, 'rb') as f:
+        actual_rows = next_rows(sheet, spreadsheet_id)
+        if checkpoint is None:
+            checkpoint = {'spreadsheet_id': spreadsheet_id, 'offset': 0, 'rows': actual_rows,
+                          'counts': {'mensagens': 0, 'registros': 0, 'ignoradas': 0}}
+        counts = checkpoint['counts']
+        size = os.path.getsize(path)
+        started = time.monotonic()
+        processed = 0
+        first_chunk = True
+
+        def flush(buckets, end):
+            nonlocal first_chunk
+            if first_chunk:
+                pending = {TARGETS[tipo][0]: len(TARGETS[tipo][2](records))
+                           for tipo, records in buckets.items()}
+                checkpoint['rows'] = reconcile_rows(checkpoint['rows'], actual_rows, pending)
+                first_chunk = False
+            written = write_chunk(sheet, spreadsheet_id, buckets, checkpoint['rows'])
+            for tab, n in written.items():
+                checkpoint['rows'][tab] += n
+            checkpoint['offset'] = end
+            save_checkpoint(checkpoint_path, checkpoint)
+            if progress:
+                elapsed = time.monotonic() - started
+                rate = processed / elapsed * 60 if elapsed else 0
+                print(f"{end * 100 / size if size else 100:5.1f}% | {counts['mensagens']} mensagens, "
+                      f"{counts['registros']} registros, {counts['ignoradas']} ignoradas | "
+                      f"{rate:,.0f} mensagens/min", file=sys.stderr)
+
+        buckets = {tipo: [] for tipo in TARGETS}
+        in_chunk = 0
+        end = checkpoint['offset']
+        for data, _, texto, end in iter_messages(f, checkpoint['offset']):
+            processed += 1
+            counts['mensagens'] += 1
+            record = parse_message(router, texto, data)
+            if record is None:
+                counts['ignoradas'] += 1
+            else:
+                buckets[record.tipo].append(record)
+                counts['registros'] += 1
+            in_chunk += 1
+            if in_chunk >= chunk_size:
+                flush(buckets, end)
+                buckets = {tipo: [] for tipo in TARGETS}
+                in_chunk = 0
+        if in_chunk:
+            flush(buckets, end)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='arquivo .txt exportado pelo WhatsApp')
+    parser.add_argument('--spreadsheet-id', help='planilha de destino (padrão: a configurada no bot)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='mensagens por lote / batchUpdate')
+    parser.add_argument('--checkpoint', help='arquivo de checkpoint (padrão: <arquivo>.checkpoint.json)')
+    parser.add_argument('--no-resumo', action='store_true',
+                        help='não recalcular os totais do "Resumo:" no final')
+    args = parser.parse_args()
+
+    counts = run(args.path, args.spreadsheet_id, args.chunk_size, args.checkpoint)
+    print(json.dumps(counts, ensure_ascii=False))
+    spreadsheet_id = args.spreadsheet_id or app.SAMPLE_SPREADSHEET_ID
+    tenant = app.tenants.for_spreadsheet(spreadsheet_id)
+    # Uma planilha que não é de nenhum inquilino não tem totais do resumo
+    if not args.no_resumo and tenant.spreadsheet_id == spreadsheet_id:
+        app.rebuild_aggregates(app.tenant_context(tenant))
+        print("Totais do resumo recalculados")
+
+
+if __name__ == '__main__':
+    main()
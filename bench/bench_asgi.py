@@ -0,0 +1,141 @@
+"""
+Carga no webhook: app Flask (gunicorn, como no Procfile) contra asgi.py (uvicorn).
+
+Dispara `--messages` mensagens (vendas, compras, gastos e mensagens
+inválidas, cada uma de um remetente diferente) com até `--concurrency` em
+andamento, contra um único processo de cada servidor, com as respostas indo
+para um Twilio falso com `--twilio-latency` segundos de latência. Mostra a
+vazão, as latências p50/p99 da resposta HTTP do webhook e o tempo até a
+confirmação chegar ao Twilio.
+
+Uso: python bench/bench_asgi.py [--messages N] [--concurrency N] [--twilio-latency S]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_startup import ROOT, bench_env, free_port  # noqa: E402
+from fake_twilio import FakeTwilio  # noqa: E402
+
+MESSAGES = [
+    "Venda: Trufa de Morango x2 - PIX - Cliente Maria",
+    "Compra: 3 leite condensado, 2 creme de leite - 50,00 - Atacadão - Cartão",
+    "Pessoal: Uber volta do mercado - 20,00",
+    "Oi, tudo bem?",
+]
+
+SERVERS = {
+    'flask': lambda port, workers: [sys.executable, '-m', 'gunicorn', 'app:app',
+                                    '-b', f'127.0.0.1:{port}', '-w', str(workers)],
+    'asgi': lambda port, workers: [sys.executable, '-m', 'uvicorn', 'asgi:app',
+                                   '--host', '127.0.0.1', '--port', str(port),
+                                   '--workers', str(workers), '--log-level', 'warning'],
+}
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else float('nan')
+
+
+async def wait_ready(url, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(f'{url}/metrics')
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.05)
+
+
+async def load(url, fake_twilio, tag, total, concurrency, reply_timeout):
+    sem = asyncio.Semaphore(concurrency)
+    sent = []
+
+    async def one(client, i):
+        to = f'+55{tag}{i:08d}'
+        async with sem:
+            start = time.monotonic()
+            response = await client.post(f'{url}/webhook', data={
+                'Body': MESSAGES[i % len(MESSAGES)], 'From': f'whatsapp:{to}',
+                'MessageSid': f'SM{tag}{i}'})
+            sent.append((to, start, time.monotonic() - start, response.status_code))
+
+    # Uma conexão nova por mensagem, como o Twilio faz ao chamar o webhook
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=0)
+    async with httpx.AsyncClient(limits=limits, timeout=120.0) as client:
+        started = time.monotonic()
+        await asyncio.gather(*(one(client, i) for i in range(total)))
+        elapsed = time.monotonic() - started
+
+    # Confirmações que chegaram ao Twilio falso
+    deadline = time.monotonic() + reply_timeout
+    while time.monotonic() < deadline:
+        if all(f'whatsapp:{to}' in fake_twilio.delivered_at for to, _, _, _ in sent):
+            break
+        await asyncio.sleep(0.05)
+    replies = [fake_twilio.delivered_at[f'whatsapp:{to}'] - start
+               for to, start, _, _ in sent if f'whatsapp:{to}' in fake_twilio.delivered_at]
+    return {
+        'errors': sum(1 for *_, status in sent if status != 200),
+        'throughput': total / elapsed,
+        'request_p50': percentile([s[2] for s in sent], 0.50) * 1000,
+        'request_p99': percentile([s[2] for s in sent], 0.99) * 1000,
+        'replies': len(replies),
+        'reply_p50': percentile(replies, 0.50) * 1000,
+        'reply_p99': percentile(replies, 0.99) * 1000,
+    }
+
+
+def run_server(name, args, fake_twilio, tag):
+    tmp = tempfile.mkdtemp()
+    env = dict(bench_env(tmp), REPLY_MODE='rest', TWILIO_API_BASE=fake_twilio.base_url,
+               SHEETS_WRITE_QUOTA='1000000', SHEETS_READ_QUOTA='1000000')
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    server = subprocess.Popen(SERVERS[name](port, args.workers), cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        asyncio.run(wait_ready(url))
+        return asyncio.run(load(url, fake_twilio, tag, args.messages, args.concurrency,
+                                args.reply_timeout))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=1, help='processos de cada servidor')
+    parser.add_argument('--twilio-latency', type=float, default=0.25)
+    parser.add_argument('--reply-timeout', type=float, default=120.0,
+                        help='quanto esperar pelas confirmações depois da carga (s)')
+    args = parser.parse_args()
+
+    print(f"{args.messages} mensagens, até {args.concurrency} simultâneas, {args.workers} processo(s), "
+          f"Twilio com {args.twilio_latency * 1000:.0f} ms de latência\n")
+    print(f"{'servidor':<8} {'msg/s':>8} {'p50 ms':>8} {'p99 ms':>9} {'erros':>6} "
+          f"{'confirmações':>13} {'conf. p50 ms':>13} {'conf. p99 ms':>13}")
+    with FakeTwilio(latency=args.twilio_latency) as fake_twilio:
+        for i, name in enumerate(SERVERS):
+            r = run_server(name, args, fake_twilio, tag=f'{i + 1}1')
+            print(f"{name:<8} {r['throughput']:>8,.0f} {r['request_p50']:>8.1f} {r['request_p99']:>9.1f} "
+                  f"{r['errors']:>6} {r['replies']:>13} {r['reply_p50']:>13.0f} {r['reply_p99']:>13.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark da importação de conversas exportadas do WhatsApp (backfill.py).
+
+Gera uma exportação sintética (Android e iPhone, mensagens de várias linhas,
+avisos do sistema e respostas do bot), importa-a para o Sheets falso com a
+latência pedida e mostra mensagens por minuto e chamadas à API. Em seguida
+simula uma queda logo depois de um lote ser gravado (antes do checkpoint),
+retoma a importação e confere que nenhuma linha foi duplicada.
+
+Uso: python bench/bench_backfill.py [--messages N] [--chunk-size N] [--latency S]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_sheets import FakeSheets  # noqa: E402
+
+HEADER = [['Cabeçalho'], [], [], []]
+
+MESSAGES = [
+    "Venda: Trufa de Morango x{n} - PIX - Cliente {nome}",
+    "Venda: Pudim de leite x{n}, Mousse de Limão x1 - Dinheiro",
+    "Compra: {n} leites condensados, 2 cremes de leite - {valor},00 - Atacadão - Cartão",
+    "Pessoal: Uber volta do mercado - {valor},00",
+    "Pessoal: Almoço com fornecedor - {valor},50 - Alimentação - Cartão\nfoi caro",
+    "✅ Venda registrada com sucesso!\n\nProduto: Trufa De Morango",
+    "Bom dia!",
+]
+
+
+def write_export(path, count, seed=42):
+    rng = random.Random(seed)
+    expected = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("01/01/2024 08:00 - As mensagens e as chamadas são protegidas com a criptografia de ponta a ponta.\n")
+        for i in range(count):
+            dia, mes = rng.randint(1, 28), rng.randint(1, 12)
+            template = rng.choice(MESSAGES)
+            texto = template.format(n=rng.randint(1, 5), nome=rng.choice(['Maria', 'João']),
+                                    valor=rng.randint(10, 99))
+            if template.split(':')[0] in ('Venda', 'Compra', 'Pessoal'):
+                expected += 1
+            if i % 2:
+                f.write(f"{dia:02d}/{mes:02d}/2024 14:{i % 60:02d} - Ana: {texto}\n")
+            else:
+                f.write(f"[{dia}/{mes}/24, 9:{i % 60:02d}:10] Ana: {texto}\n")
+    return expected
+
+
+def fresh_sheets(latency):
+    return FakeSheets({'Registro de Vendas': HEADER, 'Via 1 - Negócios': HEADER,
+                       'Via 2 - Pessoal': HEADER}, latency=latency)
+
+
+def data_rows(sheets):
+    return {tab: len(rows) - len(HEADER) for tab, rows in sheets.tabs.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.2)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    for name in ('JOB_QUEUE_PATH', 'DEDUP_DB_PATH', 'LEDGER_PATH', 'AGGREGATES_PATH'):
+        os.environ[name] = os.path.join(tmp, f'{name.lower()}.db')
+    import app
+    import backfill
+
+    export = os.path.join(tmp, 'conversa.txt')
+    expected = write_export(export, args.messages)
+    print(f"Exportação: {args.messages} mensagens, {os.path.getsize(export) / 1e6:.1f} MB, "
+          f"{expected} com comando")
+
+    sheets = fresh_sheets(args.latency)
+    start = time.perf_counter()
+    counts = backfill.run(export, chunk_size=args.chunk_size, sheet=app.sheets_gateway.wrap(sheets),
+                          progress=False)
+    elapsed = time.perf_counter() - start
+    print(f"Importação: {counts}")
+    print(f"  {elapsed:.2f} s, {counts['mensagens'] / elapsed * 60:,.0f} mensagens/min")
+    print(f"  chamadas ao Sheets: {dict(sheets.calls)}")
+    print(f"  linhas por aba: {data_rows(sheets)}")
+    full = data_rows(sheets)
+
+    # Queda depois de gravar o segundo lote, antes de salvar o checkpoint
+    sheets = fresh_sheets(0)
+    checkpoint = export + '.resume.json'
+    original_save = backfill.save_checkpoint
+    saves = []
+
+    def crashing_save(path, data):
+        saves.append(path)
+        if len(saves) == 2:
+            raise KeyboardInterrupt('queda simulada')
+        original_save(path, data)
+
+    backfill.save_checkpoint = crashing_save
+    try:
+        backfill.run(export, chunk_size=args.chunk_size, checkpoint_path=checkpoint,
+                     sheet=app.sheets_gateway.wrap(sheets), progress=False)
+    except KeyboardInterrupt:
+        pass
+    backfill.save_checkpoint = original_save
+    backfill.run(export, chunk_size=args.chunk_size, checkpoint_path=checkpoint,
+                 sheet=app.sheets_gateway.wrap(sheets), progress=False)
+    resumed = data_rows(sheets)
+    print(f"Retomada após queda: linhas por aba {resumed}")
+    assert resumed == full, "a retomada duplicou ou perdeu linhas"
+    print("OK: retomada sem linhas duplicadas")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark da inferência de categoria dos gastos pessoais.
+
+Mede o tempo de busca com tabelas de palavras-chave de tamanhos crescentes;
+o tempo por descrição deve ficar praticamente constante.
+
+Uso: python bench/bench_categories.py [--iterations N]
+"""
+import os
+import sys
+import random
+import string
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from categories import CategoryMatcher  # noqa: E402
+
+DESCRICOES = [
+    "Uber volta do mercado",
+    "Onibus para o centro",
+    "Conta de luz de setembro",
+    "Presente para a Luzia",
+    "Almoço com fornecedor no restaurante",
+]
+
+
+def random_merchants(n, seed=42):
+    rng = random.Random(seed)
+    categorias = ['Alimentação', 'Transporte', 'Lazer', 'Contas', 'Moradia', 'Saúde', 'Compras']
+    entries = []
+    for _ in range(n):
+        words = rng.randint(1, 3)
+        nome = ' '.join(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9)))
+                        for _ in range(words))
+        entries.append((nome, rng.choice(categorias), rng.randint(0, 3)))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    base = [("uber", "Transporte", 0), ("ônibus", "Transporte", 0), ("luz", "Contas", 0),
+            ("almoço", "Alimentação", 0)]
+    print(f"{'palavras-chave':>14} {'µs/busca':>9}")
+    for size in (20, 1000, 10000, 100000):
+        matcher = CategoryMatcher(base + random_merchants(size - len(base)))
+        total = timeit.timeit(lambda: [matcher.match(d) for d in DESCRICOES],
+                              number=args.iterations)
+        print(f"{size:>14} {total / (args.iterations * len(DESCRICOES)) * 1e6:9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Benchmark da tabela de custos por receita.
+
+Compara a montagem completa da tabela (matriz produtos x ingredientes vezes
+o vetor de preços) com a atualização incremental depois da mudança de preço
+de um único ingrediente, que recalcula só os produtos que o usam.
+
+Uso: python bench/bench_costs.py [--iterations N]
+"""
+import os
+import sys
+import random
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recipes import CostTable  # noqa: E402
+
+
+def random_catalog(produtos, ingredientes, por_receita=6, seed=42):
+    rng = random.Random(seed)
+    nomes = [f'ingrediente {j}' for j in range(ingredientes)]
+    precos = {nome: {'unidade': rng.choice(['g', 'kg']), 'preco': rng.uniform(0.01, 50)}
+              for nome in nomes}
+    receitas = {
+        f'produto {i}': [(nome, rng.uniform(5, 200), 'g') for nome in rng.sample(nomes, por_receita)]
+        for i in range(produtos)
+    }
+    return receitas, precos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'produtos':>9} {'ingredientes':>13} {'completa (ms)':>14} {'1 preço (ms)':>13}")
+    for produtos, ingredientes in ((15, 10), (200, 80), (2000, 400)):
+        receitas, precos = random_catalog(produtos, ingredientes)
+        table = CostTable(receitas, precos)
+        alterado = dict(precos)
+        alterado['ingrediente 0'] = dict(precos['ingrediente 0'], preco=precos['ingrediente 0']['preco'] * 1.1)
+
+        full = timeit.timeit(lambda: CostTable(receitas, alterado), number=args.iterations)
+        incremental = timeit.timeit(lambda: table.with_prices(alterado), number=args.iterations)
+
+        esperado = CostTable(receitas, alterado)
+        atualizado = table.with_prices(alterado)
+        assert all(abs(esperado.cost(p) - atualizado.cost(p)) < 1e-9 for p in receitas)
+        print(f"{produtos:>9} {ingredientes:>13} {full / args.iterations * 1e3:>14.3f} "
+              f"{incremental / args.iterations * 1e3:>13.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Latência do webhook com o Sheets lento: prazo por mensagem e modo degradado
+(resilience.py), e chamadas com o disjuntor aberto.
+
+1. Prazo: `--messages` mensagens, cada uma de um inquilino frio cuja
+   planilha responde em `--sheets-latency` segundos por chamada (o contexto
+   do inquilino lê o catálogo dela na primeira mensagem). Sem prazo, o
+   webhook espera essa leitura; com REQUEST_BUDGET de `--budget` segundos,
+   a mensagem vai para a fila de jobs e recebe a resposta do modo degradado
+   dentro do prazo. Mostra p50, p99 e máximo das duas formas e confere que
+   todas as mensagens guardadas viram registros no ledger depois.
+2. Disjuntor: o Sheets falha com timeout depois de um décimo de
+   `--sheets-latency` segundos. Mede o tempo de cada chamada: as primeiras esperam o timeout;
+   com o disjuntor aberto, falham na hora.
+
+Uso: python bench/bench_degraded.py [--messages N] [--sheets-latency S] [--budget S]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_suite import HEADER, new_sheets  # noqa: E402
+
+PRODUTOS = HEADER + [['P001', 'Bolo De Cenoura', 'Bolo', '30,00']]
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+
+    def at(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    return f"p50 {at(0.5):7.0f} ms  p99 {at(0.99):7.0f} ms  máx {latencies[-1] * 1000:7.0f} ms"
+
+
+def bench_budget(app, fakes, count, latency, budget):
+    import resilience
+    from tenants import Tenant
+
+    client = app.app.test_client()
+
+    def run(label, request_budget, offset):
+        resilience.REQUEST_BUDGET = request_budget
+        latencies = []
+        degraded = 0
+        for i in range(offset, offset + count):
+            tenant = Tenant(f't{i}', f'+5511{i:09d}', f'PLAN_{i}')
+            sheets = new_sheets(latency)
+            sheets.tabs['Produtos'] = PRODUTOS
+            fakes[tenant.spreadsheet_id] = sheets
+            app.tenants.add(tenant)
+            start = time.perf_counter()
+            response = client.post('/webhook', data={
+                'Body': 'Venda: Bolo de cenoura x1 - PIX', 'From': 'whatsapp:+5521999999999',
+                'To': f'whatsapp:{tenant.numero}', 'MessageSid': f'SM{i}'})
+            latencies.append(time.perf_counter() - start)
+            degraded += response.get_json()['status'] == 'degraded'
+        print(f"{label:<22} {percentiles(latencies)}  ({degraded} no modo degradado)")
+
+    run('sem prazo', 1e9, 0)
+    run(f'prazo de {budget:g} s', budget, count)
+
+    # Os workers processam as mensagens guardadas quando os catálogos ficam prontos
+    start = time.perf_counter()
+    while app.job_queue.run_once(app.process_job):
+        pass
+    recorded = sum(len(app.ledger.read('venda', 0, 10, tenant=f't{i}')) for i in range(count, 2 * count))
+    print(f"mensagens guardadas gravadas no ledger em segundo plano: {recorded}/{count} "
+          f"({time.perf_counter() - start:.1f} s)")
+
+
+def bench_breaker(latency, calls):
+    from resilience import CircuitOpenError
+    from sheets_gateway import SheetsGateway
+
+    class Stalled:
+        def execute(self):
+            time.sleep(latency)
+            raise TimeoutError('timed out')
+
+    gateway = SheetsGateway(1000, 1000)
+    times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        try:
+            gateway.execute(Stalled(), 'read')
+        except (TimeoutError, CircuitOpenError) as e:
+            times.append((time.perf_counter() - start, type(e).__name__))
+    for i, (elapsed, error) in enumerate(times, 1):
+        print(f"chamada {i:2d}: {elapsed * 1000:7.1f} ms  {error}")
+    print(gateway.breaker.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--sheets-latency', type=float, default=2.0)
+    parser.add_argument('--budget', type=float, default=1.0)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    for name in ('JOB_QUEUE_PATH', 'DEDUP_DB_PATH', 'LEDGER_PATH', 'AGGREGATES_PATH'):
+        os.environ[name] = os.path.join(tmp, f'{name.lower()}.db')
+    os.environ['STOCK_LOCK_PATH'] = os.path.join(tmp, 'estoque.lock')
+    os.environ['TENANTS_PATH'] = os.path.join(tmp, 'tenants.json')
+    os.environ['REPLY_MODE'] = 'rest'
+    os.environ.setdefault('SHEETS_READ_QUOTA', '1000000')
+    os.environ.setdefault('SHEETS_WRITE_QUOTA', '1000000')
+    import app
+
+    fakes = {app.SAMPLE_SPREADSHEET_ID: new_sheets(0.0)}
+    app.sheets_for = lambda spreadsheet_id: app.sheets_gateway.wrap(fakes[spreadsheet_id])
+    app.start_background_workers = lambda: None
+    app.reply = lambda to, message, account=None: True
+
+    bench_budget(app, fakes, args.messages, args.sheets_latency, args.budget)
+    print()
+    bench_breaker(args.sheets_latency / 10, 10)
+
+
+if __name__ == '__main__':
+    main()
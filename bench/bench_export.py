@@ -0,0 +1,117 @@
+"""
+Memória do /export (export.py) com exportações de tamanhos diferentes.
+
+Para cada tamanho em `--sizes`, grava essa quantidade de vendas num ledger
+novo e baixa /export?tipo=venda pelo cliente de teste do Flask, consumindo a
+resposta pedaço por pedaço, como um cliente HTTP faria. Mede o pico de memória
+alocada (tracemalloc) durante o download, os bytes recebidos e o número de
+pedaços. Só uma página do ledger (EXPORT_PAGE_SIZE registros) fica em
+memória por vez: o pico para de crescer quando a exportação passa de uma
+página e é o mesmo com 10 mil linhas ou 1 milhão. Confere também
+que a resposta não tem Content-Length (o servidor a envia em chunked) e que o
+CSV tem uma linha por venda mais o cabeçalho.
+
+As vendas ficam espalhadas por DAYS dias; depois da exportação completa, mede
+a de um mês só (inicio/fim), que lê apenas as vendas do mês pelo índice de
+datas do ledger: o tempo acompanha o tamanho do mês, não o do histórico.
+
+Uso: python bench/bench_export.py [--sizes 100,100000,1000000] [--formato csv|jsonl]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TOKEN = 'bench-token'
+
+# Vendas distribuídas igualmente por estes dias, a partir de FIRST_DAY
+DAYS = 1000
+FIRST_DAY = date(2024, 1, 1)
+
+
+def fill_ledger(ledger, venda, count):
+    """Grava `count` vendas de uma vez (uma transação só, sem o fsync de cada append)."""
+    record = venda.to_dict()
+    payloads = []
+    for i in range(DAYS):
+        day = FIRST_DAY + timedelta(days=i)
+        record['data'] = day.strftime('%d/%m/%Y')
+        payloads.append((json.dumps(record, ensure_ascii=False), day.isoformat()))
+    conn = ledger._connect()
+    conn.execute('BEGIN')
+    conn.executemany('INSERT INTO records (tipo, payload, dia, created_at, tenant) VALUES (?, ?, ?, ?, ?)',
+                     (('venda', *payloads[i * DAYS // count], time.time(), '') for i in range(count)))
+    conn.execute('COMMIT')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,100000,1000000')
+    parser.add_argument('--formato', default='csv', choices=('csv', 'jsonl'))
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    for name in ('JOB_QUEUE_PATH', 'DEDUP_DB_PATH', 'LEDGER_PATH', 'AGGREGATES_PATH'):
+        os.environ[name] = os.path.join(tmp, f'{name.lower()}.db')
+    os.environ['STOCK_LOCK_PATH'] = os.path.join(tmp, 'estoque.lock')
+    os.environ['TENANTS_PATH'] = os.path.join(tmp, 'tenants.json')
+    os.environ['EXPORT_TOKEN'] = TOKEN
+    import app
+    from ledger import Ledger
+
+    app.start_background_workers = lambda: None
+
+    venda = app.parse_venda_message('Venda: Trufa de Morango x2, Pudim de leite x1 - PIX - retirada')
+    client = app.app.test_client()
+
+    def download(size, query=''):
+        response = client.get(f'/export?tipo=venda&formato={args.formato}{query}', buffered=False,
+                              headers={'Authorization': f'Bearer {TOKEN}'})
+        assert response.status_code == 200, response.data
+        assert 'Content-Length' not in response.headers
+        received = chunks = lines = 0
+        for chunk in response.response:
+            received += len(chunk)
+            lines += chunk.count(b'\n')
+            chunks += 1
+        response.close()
+        # Cada venda tem dois itens: duas linhas, mais o cabeçalho no CSV
+        expected = 2 * size + (1 if args.formato == 'csv' else 0)
+        assert lines == expected, (lines, expected)
+        return received, chunks
+
+    # Aquecimento: importações e caches do Flask ficam fora da medição
+    app.ledger = Ledger(os.path.join(tmp, 'export_warmup.db'))
+    fill_ledger(app.ledger, venda, 10)
+    download(10)
+
+    month = '&inicio=01/01/2024&fim=31/01/2024'
+    print(f"{'linhas':>10} {'recebido':>12} {'pedaços':>8} {'pico de memória':>16} {'tempo':>9} "
+          f"{'jan/2024':>10}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        app.ledger = Ledger(os.path.join(tmp, f'export_{size}.db'))
+        fill_ledger(app.ledger, venda, size)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        received, chunks = download(size)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        download(sum(1 for i in range(size) if i * DAYS // size < 31), month)
+        month_elapsed = time.perf_counter() - start
+        print(f"{size:>10,} {received / 1024 / 1024:>9,.1f} MiB {chunks:>8,} "
+              f"{peak / 1024:>12,.0f} KiB {elapsed:>8.1f}s {month_elapsed:>9.2f}s")
+
+
+if __name__ == '__main__':
+    main()
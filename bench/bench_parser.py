@@ -0,0 +1,47 @@
+"""
+Microbenchmark do roteador de mensagens.
+
+Uso: python bench/bench_parser.py [--iterations N]
+"""
+import os
+import sys
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import catalog  # noqa: E402
+from parsing import build_router  # noqa: E402
+
+MESSAGES = {
+    'venda': "Venda: Trufa de Morango x2 - PIX - Cliente Maria",
+    'compra': "Compra: 3 leites condensados, 2 cremes de leite, 1 granulado - 50,00 - Atacadão - Cartão - Promoção",
+    'pessoal': "Pessoal: Uber volta do mercado - 20,00 - Transporte - Cartão - Urgente",
+    'invalido': "Oi, tudo bem?",
+}
+
+
+def bench(router, message, iterations):
+    total = timeit.timeit(lambda: router.parse(message, '01/01/2026'), number=iterations)
+    return total / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    router = build_router(catalog.current)
+    print(f"{'mensagem':<10} {'µs/msg':>8}")
+    for name, message in MESSAGES.items():
+        print(f"{name:<10} {bench(router, message, args.iterations):8.2f}")
+
+    # venda*: mesmo teste com 1000 comandos extras registrados (custo deve ser igual)
+    crowded = build_router(catalog.current)
+    for i in range(1000):
+        crowded.register(f'comando{i}', lambda fields, data, catalog: None)
+    print(f"{'venda*':<10} {bench(crowded, MESSAGES['venda'], args.iterations):8.2f}")
+
+
+if __name__ == '__main__':
+    main()
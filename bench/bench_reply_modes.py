@@ -0,0 +1,61 @@
+"""
+Conta as chamadas de saída ao Twilio em cada modo de resposta (REPLY_MODE).
+
+Envia as mesmas mensagens pelo webhook nos modos 'rest' e 'twiml', com a
+sincronização com a planilha substituída por funções falsas, e mostra quantas
+requisições chegaram ao Twilio falso em cada modo. No modo 'twiml' o
+esperado é zero.
+
+Uso: python bench/bench_reply_modes.py
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_twilio import FakeTwilio  # noqa: E402
+
+MESSAGES = [
+    "Venda: Trufa de Morango x2 - PIX - Cliente Maria",
+    "Compra: 3 leite condensado - 50,00 - Atacadão - Cartão",
+    "Pessoal: Uber volta do mercado - 20,00",
+    "Venda: torta - PIX",
+    "Oi, tudo bem?",
+]
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    with FakeTwilio() as fake:
+        for name in ('JOB_QUEUE_PATH', 'DEDUP_DB_PATH', 'LEDGER_PATH'):
+            os.environ[name] = os.path.join(tmp, f'{name.lower()}.db')
+        os.environ['TWILIO_API_BASE'] = fake.base_url
+        import app
+
+        for name, (tipo, _) in list(app.LEDGER_SINKS.items()):
+            app.LEDGER_SINKS[name] = (tipo, lambda spreadsheet_id, records, seqs=None: None)
+        client = app.app.test_client()
+
+        results = {}
+        for mode in ('rest', 'twiml'):
+            app.REPLY_MODE = mode
+            before = fake.requests
+            inline = 0
+            for body in MESSAGES:
+                response = client.post('/webhook', data={'Body': body, 'From': 'whatsapp:+5511999999999'})
+                inline += response.mimetype == 'text/xml'
+            while app.job_queue.run_once(app.process_job):
+                pass
+            app.twilio.join()
+            results[mode] = (fake.requests - before, inline)
+
+    print(f"{'modo':<6} {'mensagens':>9} {'chamadas REST':>13} {'respostas TwiML':>15}")
+    for mode, (calls, inline) in results.items():
+        print(f"{mode:<6} {len(MESSAGES):>9} {calls:>13} {inline:>15}")
+    assert results['rest'] == (len(MESSAGES), 0), results
+    assert results['twiml'] == (0, len(MESSAGES)), results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark da busca aproximada de produtos.
+
+Gera um catálogo sintético com milhares de produtos e mede o tempo de busca
+para nomes exatos, com erros de digitação e no plural.
+
+Uso: python bench/bench_resolver.py [--products N] [--iterations N]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import produtos  # noqa: E402
+from resolver import ProductResolver  # noqa: E402
+
+TIPOS = ['trufa', 'torta', 'mousse', 'pudim', 'bolo', 'brigadeiro', 'cookie', 'brownie',
+         'cheesecake', 'pavê', 'copo da felicidade', 'bombom', 'cupcake', 'palha italiana']
+SABORES = ['morango', 'maracujá', 'limão', 'castanha', 'coco', 'paçoca', 'oreo', 'uva',
+           'leite ninho', 'nutella', 'doce de leite', 'chocolate branco', 'café', 'amendoim',
+           'pistache', 'framboesa', 'abacaxi', 'banana', 'cereja', 'menta', 'caramelo salgado',
+           'avelã', 'goiabada', 'queijo', 'maçã', 'pêssego', 'kiwi', 'manga', 'ameixa', 'laranja']
+
+QUERIES = [
+    'trufa morango',         # sem preposição
+    'torta de maracuja',     # sem acento
+    'tortas de limao',       # plural
+    'mousse de limão',       # exato
+    'brigadero de nutela',   # erros de digitação
+]
+
+
+def synthetic_catalog(n, seed=7):
+    rng = random.Random(seed)
+    catalog = dict(produtos)
+    while len(catalog) < n:
+        nome = f"{rng.choice(TIPOS)} de {rng.choice(SABORES)}"
+        if rng.random() < 0.7:
+            nome += f" {rng.choice(['pequeno', 'grande', 'zero', 'fit', 'gourmet', 'vegano'])}"
+            nome += f" {rng.randint(1, 999)}"
+        catalog[nome] = 8.0
+    return catalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    catalog = synthetic_catalog(args.products)
+    start = time.perf_counter()
+    resolver = ProductResolver(catalog)
+    print(f"índice de {len(catalog)} produtos construído em "
+          f"{(time.perf_counter() - start) * 1000:.1f} ms")
+
+    print(f"{'consulta':<22} {'µs/busca':>9}  resultado")
+    for query in QUERIES:
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            resolution = resolver.resolve(query)
+        elapsed = (time.perf_counter() - start) / args.iterations * 1e6
+        result = resolution.produto or ' | '.join(resolution.sugestoes) or '-'
+        print(f"{query:<22} {elapsed:9.1f}  {result}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark do comando "Resumo:".
+
+Grava históricos de tamanhos crescentes no ledger, aplica-os aos totais e
+mede o tempo do relatório de hoje, da semana e do mês. O relatório só lê os
+dias do período, então o tempo deve ficar em milissegundos qualquer que seja
+o tamanho do histórico.
+
+Uso: python bench/bench_resumo.py [--iterations N]
+"""
+import os
+import sys
+import random
+import timeit
+import argparse
+import tempfile
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregates import Aggregates, period_range  # noqa: E402
+from ledger import Ledger  # noqa: E402
+from parsing import ItemVenda, Pessoal, Venda, record_from_dict  # noqa: E402
+
+PRODUTOS = ['Trufa De Morango', 'Pudim De Leite', 'Mousse De Limão', 'Torta De Oreo']
+PAGAMENTOS = ['PIX', 'Dinheiro', 'Cartão']
+
+
+def random_records(n, days, seed=42):
+    rng = random.Random(seed)
+    today = date.today()
+    for _ in range(n):
+        data = (today - timedelta(days=rng.randrange(days))).strftime('%d/%m/%Y')
+        if rng.random() < 0.8:
+            quantidade = rng.randint(1, 4)
+            item = ItemVenda(rng.choice(PRODUTOS), quantidade, 8.0, 8.0 * quantidade)
+            yield Venda(data, [item], item.valor_total, rng.choice(PAGAMENTOS), '')
+        else:
+            yield Pessoal(data, 'uber', 20.0, 'Transporte', 'Cartão', '')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'registros':>10} {'aplicar (µs/reg)':>17} {'hoje (ms)':>10} {'semana (ms)':>12} {'mês (ms)':>9}")
+    for size in (1000, 10000, 100000):
+        with tempfile.TemporaryDirectory() as tmp:
+            ledger = Ledger(os.path.join(tmp, 'ledger.db'))
+            aggregates = Aggregates(os.path.join(tmp, 'aggregates.db'))
+            conn = ledger._connect()
+            conn.execute('BEGIN')
+            for record in random_records(size, days=3 * 365):
+                ledger.append(record)
+            conn.execute('COMMIT')
+
+            elapsed = timeit.timeit(lambda: aggregates.catch_up(ledger, record_from_dict), number=1)
+            apply_us = elapsed / size * 1e6
+
+            timings = []
+            for periodo in ('hoje', 'semana', 'mes'):
+                start, end = period_range(periodo)
+                seconds = timeit.timeit(lambda: aggregates.report(start, end), number=args.iterations)
+                timings.append(seconds / args.iterations * 1e3)
+            print(f"{size:>10} {apply_us:>17.1f} {timings[0]:>10.3f} {timings[1]:>12.3f} {timings[2]:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
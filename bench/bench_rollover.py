@@ -0,0 +1,96 @@
+"""
+Tamanho das abas vivas antes e depois do arquivamento mensal (rollover.py).
+
+Preenche "Registro de Vendas" com `--months` meses de `--per-month` vendas
+num Sheets falso e mede a leitura da aba inteira (linhas e bytes trafegados),
+que é o que as funções add_*_to_sheets e os recálculos da planilha pagam.
+Depois arquiva os meses fechados, numa única batchUpdate, e mede de novo: a
+aba viva fica só com o mês corrente. Por fim lê um mês arquivado pelo índice
+"Arquivo", que só é consultado quando se pede aquele período.
+
+Uso: python bench/bench_rollover.py [--months N] [--per-month N]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_suite import new_sheets  # noqa: E402
+
+
+def month_dates(today, months):
+    """Primeiros dias dos `months` meses até o de `today`, do mais antigo ao atual."""
+    year, month = today.year, today.month
+    firsts = []
+    for _ in range(months):
+        firsts.append(date(year, month, 1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return firsts[::-1]
+
+
+def read_live(app, spreadsheet_id, tab):
+    sheet = app.sheets_for(spreadsheet_id)
+    start = time.perf_counter()
+    rows = sheet.values().get(spreadsheetId=spreadsheet_id,
+                              range=f"'{tab}'!A{app.HEADER_ROWS + 1}:G").execute().get('values', [])
+    elapsed = time.perf_counter() - start
+    return len(rows), len(json.dumps(rows)), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--per-month', type=int, default=3000)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    for name in ('JOB_QUEUE_PATH', 'DEDUP_DB_PATH', 'LEDGER_PATH', 'AGGREGATES_PATH'):
+        os.environ[name] = os.path.join(tmp, f'{name.lower()}.db')
+    os.environ['STOCK_LOCK_PATH'] = os.path.join(tmp, 'estoque.lock')
+    os.environ['TENANTS_PATH'] = os.path.join(tmp, 'tenants.json')
+    os.environ.setdefault('SHEETS_READ_QUOTA', '1000000')
+    os.environ.setdefault('SHEETS_WRITE_QUOTA', '1000000')
+    import app
+
+    sheets = new_sheets(0.0)
+    app.sheets_for = lambda spreadsheet_id: app.sheets_gateway.wrap(sheets)
+    spreadsheet_id = app.SAMPLE_SPREADSHEET_ID
+    tab = 'Registro de Vendas'
+
+    today = date.today()
+    for first in month_dates(today, args.months):
+        day = first.strftime('%d/%m/%Y')
+        sheets.tabs[tab] += [[day, 'Trufa De Morango', 1, 4.0, 4.0, 'PIX', '']
+                             for _ in range(args.per_month)]
+
+    rows, size, elapsed = read_live(app, spreadsheet_id, tab)
+    print(f"antes:  {rows:>8,} linhas na aba viva, {size / 1024:>8,.0f} KiB lidos em {elapsed * 1000:6.1f} ms")
+
+    sheets.calls.clear()
+    start = time.perf_counter()
+    archived = app.rollover.roll(spreadsheet_id, today)
+    roll_time = time.perf_counter() - start
+    print(f"arquivamento: {len(archived)} períodos em {roll_time * 1000:.0f} ms, "
+          f"chamadas ao Sheets: {dict(sheets.calls)}")
+
+    rows, size, elapsed = read_live(app, spreadsheet_id, tab)
+    print(f"depois: {rows:>8,} linhas na aba viva, {size / 1024:>8,.0f} KiB lidos em {elapsed * 1000:6.1f} ms")
+
+    if archived:
+        period = archived[0][0]
+        sheets.calls.clear()
+        start = time.perf_counter()
+        period_rows = app.rollover.read_period(spreadsheet_id, tab, period)
+        elapsed = time.perf_counter() - start
+        print(f"leitura de {period}: {len(period_rows):,} linhas em {elapsed * 1000:.1f} ms, "
+              f"chamadas ao Sheets: {dict(sheets.calls)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Tempo de partida do bot: importação do app e primeira resposta do webhook.
+
+1. Importa o app em processos novos e mede o tempo da importação, sem e com
+   o cliente do Google e o documento de descoberta, que agora só são
+   carregados na primeira chamada ao Sheets.
+2. Sobe o gunicorn (gunicorn.conf.py) com e sem PRELOAD_APP=1 e mede o tempo
+   até a primeira resposta do webhook e, depois de matar os workers, o tempo
+   até o master pôr um worker novo para responder.
+
+Uso: python bench/bench_startup.py [--runs N] [--workers N]
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+if {preload}:
+    from sheets_client import import_google_client, load_discovery_document
+    import_google_client()
+    load_discovery_document()
+print(imported - start, time.perf_counter() - start)
+"""
+
+
+def bench_env(tmp):
+    env = dict(os.environ)
+    for name in ('JOB_QUEUE_PATH', 'DEDUP_DB_PATH', 'LEDGER_PATH', 'AGGREGATES_PATH'):
+        env[name] = os.path.join(tmp, f'{name.lower()}.db')
+    env['STOCK_LOCK_PATH'] = os.path.join(tmp, 'estoque.lock')
+    # A resposta volta no próprio webhook: nenhuma chamada ao Twilio
+    env['REPLY_MODE'] = 'twiml'
+    env['GOOGLE_APPLICATION_CREDENTIALS'] = fake_credentials(tmp)
+    return env
+
+
+def fake_credentials(tmp):
+    """
+    Conta de serviço descartável cujo token_uri é uma porta local fechada:
+    as credenciais carregam sem rede e a leitura da planilha falha na hora.
+    Sem credenciais, o google.auth procuraria o servidor de metadados do GCE
+    (segundos de timeout que não existem em produção).
+    """
+    import rsa
+    _, key = rsa.newkeys(1024)
+    path = os.path.join(tmp, 'credentials.json')
+    with open(path, 'w') as f:
+        json.dump({'type': 'service_account', 'project_id': 'bench', 'private_key_id': 'bench',
+                   'private_key': key.save_pkcs1().decode(), 'client_id': '1',
+                   'client_email': 'bench@bench.iam.gserviceaccount.com',
+                   'token_uri': f'http://127.0.0.1:{free_port()}/token'}, f)
+    return path
+
+
+def bench_import(env, runs, preload):
+    totals = []
+    for _ in range(runs):
+        out = subprocess.check_output(
+            [sys.executable, '-c', IMPORT_SNIPPET.format(preload=preload)],
+            cwd=ROOT, env=env, text=True, stderr=subprocess.DEVNULL)
+        totals.append(float(out.split()[-1]))
+    return statistics.median(totals) * 1000
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def post_webhook(port, sid, timeout=30.0):
+    """Envia uma mensagem ao webhook, tentando de novo até o servidor aceitar."""
+    data = urllib.parse.urlencode({'Body': 'Oi', 'From': 'whatsapp:+5511999999999',
+                                   'MessageSid': sid}).encode()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/webhook', data, timeout=timeout) as r:
+                assert r.status == 200
+                return
+        except (ConnectionError, urllib.error.URLError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.005)
+
+
+def worker_pids(master_pid):
+    out = subprocess.check_output(['ps', '-o', 'pid=', '--ppid', str(master_pid)], text=True)
+    return [int(pid) for pid in out.split()]
+
+
+def bench_gunicorn(env, workers, preload, run):
+    env = dict(env, PRELOAD_APP='1' if preload else '0')
+    port = free_port()
+    start = time.perf_counter()
+    master = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '-b', f'127.0.0.1:{port}', '-w', str(workers)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        post_webhook(port, f'SMstart{run}')
+        first = time.perf_counter() - start
+
+        # Mata todos os workers; o master sobe outros e a próxima mensagem espera por eles
+        for pid in worker_pids(master.pid):
+            os.kill(pid, signal.SIGKILL)
+        start = time.perf_counter()
+        post_webhook(port, f'SMrestart{run}')
+        respawn = time.perf_counter() - start
+    finally:
+        master.terminate()
+        master.wait(timeout=30)
+    return first * 1000, respawn * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    env = bench_env(tmp)
+
+    print("Importação do app (mediana):")
+    print(f"  sem o cliente do Google: {bench_import(env, args.runs, False):7.1f} ms")
+    print(f"  com o cliente do Google e o documento de descoberta: "
+          f"{bench_import(env, args.runs, True):7.1f} ms")
+
+    print(f"\ngunicorn com {args.workers} workers (mediana de {args.runs}):")
+    print(f"{'':<14} {'1ª resposta':>12} {'após reinício':>14}")
+    for preload in (False, True):
+        results = [bench_gunicorn(env, args.workers, preload, f'{preload}{run}')
+                   for run in range(args.runs)]
+        first = statistics.median(r[0] for r in results)
+        respawn = statistics.median(r[1] for r in results)
+        label = 'PRELOAD_APP=1' if preload else 'sem preload'
+        print(f"{label:<14} {first:>9.1f} ms {respawn:>11.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
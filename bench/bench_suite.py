@@ -0,0 +1,251 @@
+"""
+Suíte de benchmarks dos analisadores e do webhook.
+
+Mede parse_venda_message, parse_compra_message e parse_pessoal_message e o
+caminho completo do webhook pelo test client do Flask, com o Sheets e o
+Twilio substituídos por serviços falsos com latência configurável. Para cada
+tipo de mensagem mostra operações por segundo, latências p50/p99, o tempo
+do trabalho em segundo plano (sincronização com a planilha e envio da
+resposta) e quantas chamadas externas cada mensagem gerou.
+
+O resultado pode ser salvo em JSON e comparado com uma execução anterior:
+qualquer aumento no número de chamadas externas, ou uma piora de latência
+acima da tolerância, é apontado e faz o comando sair com código 1.
+
+Uso:
+    python bench/bench_suite.py [--iterations N] [--sheets-latency S] [--twilio-latency S]
+                                [--output resultado.json] [--compare anterior.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_sheets import FakeSheets  # noqa: E402
+from fake_twilio import FakeTwilio  # noqa: E402
+
+HEADER = [['Cabeçalho'], [], [], []]
+
+MESSAGES = {
+    'venda': "Venda: Trufa de Morango x2 - PIX - Cliente Maria",
+    'venda_multi': "Venda: Trufa de Morango x2, Pudim de leite x1, Mousse de Limão x3 - PIX",
+    'compra': "Compra: 3 leite condensado, 2 creme de leite - 50,00 - Atacadão - Cartão",
+    'pessoal': "Pessoal: Uber volta do mercado - 20,00",
+    'resumo': "Resumo: semana",
+    'invalido': "Oi, tudo bem?",
+}
+
+SHEETS_READS = ('get', 'values.get', 'values.batchGet')
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def summarize(samples, scale):
+    """ops/s e p50/p99 de uma lista de durações em segundos (`scale` converte a unidade)."""
+    total = sum(samples)
+    return {
+        'ops_per_sec': round(len(samples) / total, 1) if total else None,
+        'p50': round(percentile(samples, 0.50) * scale, 3),
+        'p99': round(percentile(samples, 0.99) * scale, 3),
+    }
+
+
+def bench_parsers(app, iterations):
+    parsers = {
+        'parse_venda_message': (app.parse_venda_message, MESSAGES['venda']),
+        'parse_compra_message': (app.parse_compra_message, MESSAGES['compra']),
+        'parse_pessoal_message': (app.parse_pessoal_message, MESSAGES['pessoal']),
+    }
+    results = {}
+    for name, (parse, message) in parsers.items():
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            parse(message, '01/01/2026')
+            samples.append(time.perf_counter() - start)
+        results[name] = dict(summarize(samples, 1e6), unit='us')
+    return results
+
+
+def new_sheets(latency):
+    estoque = HEADER + [['ING001', 'Leite Condensado', '1000', 'g', '6,45', '', '', ''],
+                        ['ING002', 'Creme De Leite', '500', 'g', '3,39', '', '', '']]
+    return FakeSheets({'Registro de Vendas': HEADER, 'Controle de Estoque': estoque,
+                       'Via 1 - Negócios': HEADER, 'Via 2 - Pessoal': HEADER}, latency=latency)
+
+
+def count_calls(sheets, fake_twilio):
+    reads = sum(n for method, n in sheets.calls.items() if method in SHEETS_READS)
+    writes = sum(n for method, n in sheets.calls.items() if method not in SHEETS_READS)
+    return {'sheets_read': reads, 'sheets_write': writes, 'twilio': fake_twilio.requests}
+
+
+def bench_webhook(app, fake_twilio, sheets, iterations):
+    """
+    Chamadas externas são contadas na primeira mensagem de cada tipo (caches
+    frios, ex.: leitura do estoque) e em média nas seguintes, para que o
+    resultado não dependa do número de iterações.
+    """
+    client = app.app.test_client()
+    results = {}
+    sid = 0
+    for tipo, body in MESSAGES.items():
+        request_samples = []
+        background_samples = []
+        app.stock_index.loaded_at = 0.0  # estoque frio na primeira mensagem de cada tipo
+        before = count_calls(sheets, fake_twilio)
+        first = None
+        for i in range(iterations):
+            sid += 1
+            start = time.perf_counter()
+            response = client.post('/webhook', data={
+                'Body': body, 'From': 'whatsapp:+5511999999999', 'MessageSid': f'SMbench{sid}'})
+            request_samples.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.data
+
+            # Trabalho em segundo plano gerado pela mensagem
+            start = time.perf_counter()
+            app.ledger_syncer.sync_once()
+            while app.job_queue.run_once(app.process_job):
+                pass
+            app.twilio.join()
+            background_samples.append(time.perf_counter() - start)
+            if i == 0:
+                first = count_calls(sheets, fake_twilio)
+
+        after = count_calls(sheets, fake_twilio)
+        steady = max(iterations - 1, 1)
+        results[tipo] = {
+            'request': dict(summarize(request_samples, 1e3), unit='ms'),
+            'background': dict(summarize(background_samples, 1e3), unit='ms'),
+            'calls_first_message': {kind: first[kind] - before[kind] for kind in before},
+            'calls_per_message': {kind: round((after[kind] - first[kind]) / steady, 3)
+                                  for kind in before},
+        }
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current, tolerance):
+    """Lista as regressões de `current` em relação a `previous`."""
+    problems = []
+    for tipo, result in current['webhook'].items():
+        before = previous.get('webhook', {}).get(tipo)
+        if before is None:
+            continue
+        for key, label in (('calls_first_message', 'na primeira mensagem'),
+                           ('calls_per_message', 'por mensagem')):
+            for kind, calls in result[key].items():
+                old = before.get(key, {}).get(kind, 0)
+                if calls > old:
+                    problems.append(f"{tipo}: {kind} passou de {old} para {calls} chamadas {label}")
+        for stage in ('request', 'background'):
+            old, new = before[stage]['p50'], result[stage]['p50']
+            if old and new > old * (1 + tolerance):
+                problems.append(f"{tipo}: p50 de {stage} passou de {old} para {new} ms")
+    for name, result in current['parsers'].items():
+        before = previous.get('parsers', {}).get(name)
+        if before and before['p50'] and result['p50'] > before['p50'] * (1 + tolerance):
+            problems.append(f"{name}: p50 passou de {before['p50']} para {result['p50']} µs")
+    return problems
+
+
+def print_report(results):
+    print(f"{'analisador':<24} {'ops/s':>10} {'p50 µs':>8} {'p99 µs':>8}")
+    for name, r in results['parsers'].items():
+        print(f"{name:<24} {r['ops_per_sec']:>10,.0f} {r['p50']:>8.2f} {r['p99']:>8.2f}")
+    print()
+    print("Chamadas externas: primeira mensagem / média das seguintes")
+    print(f"{'webhook':<12} {'ops/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'2º plano p50':>13} "
+          f"{'leituras':>11} {'escritas':>11} {'twilio':>11}")
+    for tipo, r in results['webhook'].items():
+        first, calls = r['calls_first_message'], r['calls_per_message']
+        columns = ' '.join(f"{f'{first[kind]} / {calls[kind]:g}':>11}"
+                           for kind in ('sheets_read', 'sheets_write', 'twilio'))
+        print(f"{tipo:<12} {r['request']['ops_per_sec']:>8,.0f} {r['request']['p50']:>8.2f} "
+              f"{r['request']['p99']:>8.2f} {r['background']['p50']:>13.2f} {columns}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--parser-iterations', type=int, default=20000)
+    parser.add_argument('--sheets-latency', type=float, default=0.0)
+    parser.add_argument('--twilio-latency', type=float, default=0.0)
+    parser.add_argument('--reply-mode', choices=('rest', 'twiml'), default='rest')
+    parser.add_argument('--output', help='salvar o resultado em JSON')
+    parser.add_argument('--compare', help='JSON de uma execução anterior')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='piora de latência aceita na comparação (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    with FakeTwilio(latency=args.twilio_latency) as fake_twilio:
+        for name in ('JOB_QUEUE_PATH', 'DEDUP_DB_PATH', 'LEDGER_PATH', 'AGGREGATES_PATH'):
+            os.environ[name] = os.path.join(tmp, f'{name.lower()}.db')
+        os.environ['STOCK_LOCK_PATH'] = os.path.join(tmp, 'estoque.lock')
+        os.environ['TWILIO_API_BASE'] = fake_twilio.base_url
+        os.environ['REPLY_MODE'] = args.reply_mode
+        # Cotas altas: a suíte mede o código, não a espera pelo balde de fichas
+        os.environ.setdefault('SHEETS_READ_QUOTA', '1000000')
+        os.environ.setdefault('SHEETS_WRITE_QUOTA', '1000000')
+        import app
+
+        sheets = new_sheets(args.sheets_latency)
+        app.setup_google_sheets = lambda: app.sheets_gateway.wrap(sheets)
+        # Sem threads em segundo plano: a suíte executa a sincronização e os jobs
+        # por conta própria, para atribuir as chamadas externas a cada mensagem
+        app.start_background_workers = lambda: None
+        app.twilio.start()
+
+        results = {
+            'meta': {
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'iterations': args.iterations,
+                'sheets_latency': args.sheets_latency,
+                'twilio_latency': args.twilio_latency,
+                'reply_mode': args.reply_mode,
+            },
+            'parsers': bench_parsers(app, args.parser_iterations),
+            'webhook': bench_webhook(app, fake_twilio, sheets, args.iterations),
+        }
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nResultado salvo em {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        problems = compare(previous, results, args.tolerance)
+        print(f"\nComparação com {args.compare} ({previous['meta'].get('revision')}):")
+        for problem in problems:
+            print(f"  REGRESSÃO: {problem}")
+        if problems:
+            sys.exit(1)
+        print("  sem regressões")
+
+
+if __name__ == '__main__':
+    main()
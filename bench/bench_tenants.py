@@ -0,0 +1,159 @@
+"""
+Custo dos inquilinos (tenants.py) em memória e justiça da sincronização.
+
+1. Memória: cadastra `--tenants` inquilinos e mede (tracemalloc e RSS) o
+   custo de cada um parado, sem contexto, e com contexto ativo (catálogo
+   lido de um Sheets falso, roteador e totais). Ativa todos com o
+   cache limitado a `--cache-size`: os primeiros ficam em memória e os
+   seguintes tomam o lugar dos usados há mais tempo, sem a memória crescer.
+   O tracemalloc não vê as alocações do próprio SQLite (conexão dos totais),
+   que aparecem só no RSS; o RSS também inclui memória que o alocador
+   liberou mas não devolveu ao sistema.
+2. Justiça: o inquilino A tem `--backlog` vendas acumuladas e o B, uma só.
+   Mede em quanto tempo a venda de B chega à planilha dele, com o rodízio
+   do LedgerSyncer e sincronizando um inquilino de cada vez (A inteiro
+   primeiro), com `--sheets-latency` segundos por chamada ao Sheets.
+
+Uso: python bench/bench_tenants.py [--tenants N] [--cache-size N] [--backlog N] [--sheets-latency S]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_suite import HEADER, new_sheets  # noqa: E402
+
+PRODUTOS = HEADER + [[f'P{i:03d}', f'Produto {i}', 'Doce', '5,00'] for i in range(30)]
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(fn):
+    """Bytes alocados (tracemalloc) e variação do RSS ao chamar `fn`."""
+    before_rss = rss()
+    before = tracemalloc.take_snapshot()
+    fn()
+    after = tracemalloc.take_snapshot()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return allocated, rss() - before_rss
+
+
+def bench_memory(app, fakes, count, cache_size):
+    from tenants import Tenant
+
+    tenants = [Tenant(f't{i}', f'+5511{i:09d}', f'PLAN_{i}', twilio_sid=f'AC{i}', twilio_token='x',
+                      remetentes=[f'+5521{i:09d}']) for i in range(count)]
+    for tenant in tenants:
+        sheets = new_sheets(0.0)
+        sheets.tabs['Produtos'] = PRODUTOS
+        fakes[tenant.spreadsheet_id] = sheets
+
+    registry = app.tenants
+    registry.max_active = cache_size
+
+    def activate(group):
+        for tenant in group:
+            registry.context(tenant)
+        time.sleep(0.5)  # threads de preparação dos totais
+
+    tracemalloc.start()
+    config, config_rss = measure(lambda: [registry.add(t) for t in tenants])
+    active, active_rss = measure(lambda: activate(tenants[:cache_size]))
+    # Uma passada pelos demais aquece o alocador; a seguinte mostra o regime
+    activate(tenants[cache_size:])
+    rest, rest_rss = measure(lambda: activate(tenants))
+    tracemalloc.stop()
+    stats = registry.stats()
+    print(f"{count} inquilinos cadastrados: {config / count:,.0f} B por inquilino parado "
+          f"(RSS {config_rss / count:,.0f} B)")
+    print(f"{cache_size} contextos ativos: {active / cache_size:,.0f} B por inquilino ativo "
+          f"(RSS {active_rss / cache_size:,.0f} B)")
+    print(f"reativando todos com o cache cheio: {stats['active']} ativos, "
+          f"{stats['evictions']} descartados, variação de {rest / 1024:,.0f} KiB "
+          f"(RSS {rest_rss / 1024:,.0f} KiB)")
+
+
+def bench_fairness(app, fakes, backlog, latency):
+    from ledger import LedgerSyncer
+    from tenants import Tenant
+
+    a = Tenant('a', '+5511900000001', 'PLAN_A')
+    b = Tenant('b', '+5511900000002', 'PLAN_B')
+    for tenant in (a, b):
+        app.tenants.add(tenant)
+        fakes[tenant.spreadsheet_id] = new_sheets(0.0)
+        fakes[tenant.spreadsheet_id].tabs['Produtos'] = PRODUTOS
+        app.tenants.context(tenant)  # catálogo e totais já em memória, fora da medição
+    venda = app.tenants.context(app.tenants.default).router.parse('Venda: Trufa de Morango x1 - PIX')
+    ledger = app.ledger
+
+    def run(label, sync):
+        for tenant in (a, b):
+            fakes[tenant.spreadsheet_id] = new_sheets(latency)
+        start_seq = ledger.last_seq()
+        for target in [f'{t.spreadsheet_id}:{name}' for t in (a, b) for name in app.LEDGER_SINKS]:
+            ledger.set_high_water(target, start_seq)
+        for _ in range(backlog):
+            ledger.append(venda, tenant='a')
+        ledger.append(venda, tenant='b')
+
+        b_rows = fakes['PLAN_B'].tabs['Registro de Vendas']
+        start = time.perf_counter()
+        thread = threading.Thread(target=sync)
+        thread.start()
+        while len(b_rows) <= len(HEADER) and thread.is_alive():
+            time.sleep(0.001)
+        b_latency = time.perf_counter() - start
+        thread.join()
+        total = time.perf_counter() - start
+        print(f"{label:<28} venda de B em {b_latency * 1000:8.0f} ms; "
+              f"fila toda em {total * 1000:8.0f} ms")
+
+    targets = [(a.id, a.spreadsheet_id), (b.id, b.spreadsheet_id)]
+    syncer = LedgerSyncer(ledger, app.LEDGER_SINKS, lambda: a.spreadsheet_id,
+                          decode=app.record_from_dict, get_targets=lambda: targets)
+    run('rodízio entre inquilinos', syncer.sync_once)
+
+    def one_at_a_time():
+        for target in targets:
+            LedgerSyncer(ledger, app.LEDGER_SINKS, lambda: target[1], decode=app.record_from_dict,
+                         get_targets=lambda: [target]).sync_once()
+    run('um inquilino de cada vez', one_at_a_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tenants', type=int, default=200)
+    parser.add_argument('--cache-size', type=int, default=32)
+    parser.add_argument('--backlog', type=int, default=5000)
+    parser.add_argument('--sheets-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    for name in ('JOB_QUEUE_PATH', 'DEDUP_DB_PATH', 'LEDGER_PATH', 'AGGREGATES_PATH'):
+        os.environ[name] = os.path.join(tmp, f'{name.lower()}.db')
+    os.environ['STOCK_LOCK_PATH'] = os.path.join(tmp, 'estoque.lock')
+    os.environ['TENANTS_PATH'] = os.path.join(tmp, 'tenants.json')
+    os.environ.setdefault('SHEETS_READ_QUOTA', '1000000')
+    os.environ.setdefault('SHEETS_WRITE_QUOTA', '1000000')
+    import app
+
+    fakes = {app.SAMPLE_SPREADSHEET_ID: new_sheets(0.0)}
+    app.sheets_for = lambda spreadsheet_id: app.sheets_gateway.wrap(fakes[spreadsheet_id])
+
+    bench_memory(app, fakes, args.tenants, args.cache_size)
+    print()
+    bench_fairness(app, fakes, args.backlog, args.sheets_latency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Custo do tracing (tracing.py) no caminho das mensagens.
+
+Mede o custo de um span vazio e os p50 dos analisadores e do webhook (test
+client do Flask, Sheets e Twilio falsos) com o tracing ligado e desligado,
+alternando as rodadas para que aquecimento e ruído afetem os dois lados.
+No final mostra um trecho da saída de /metrics.
+
+Uso: python bench/bench_tracing.py [--iterations N] [--rounds N]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_twilio import FakeTwilio  # noqa: E402
+from bench_suite import MESSAGES, new_sheets, percentile  # noqa: E402
+
+
+def span_cost(tracing, iterations):
+    """Custo médio (µs) de abrir e fechar um span, fora e dentro de um trace."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with tracing.span('bench'):
+            pass
+    alone = (time.perf_counter() - start) / iterations * 1e6
+    with tracing.trace('bench'):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            with tracing.span('bench'):
+                pass
+        traced = (time.perf_counter() - start) / iterations * 1e6
+    return alone, traced
+
+
+def run_parse(app, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        with app.span('parse'):
+            app.router.parse(MESSAGES['venda'], '01/01/2026')
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run_webhook(app, client, iterations, offset):
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        response = client.post('/webhook', data={
+            'Body': MESSAGES['venda'], 'From': 'whatsapp:+5511999999999',
+            'MessageSid': f'SMtrace{offset + i}'})
+        samples.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.data
+    app.ledger_syncer.sync_once()
+    app.twilio.join()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--rounds', type=int, default=4)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    with FakeTwilio() as fake_twilio:
+        for name in ('JOB_QUEUE_PATH', 'DEDUP_DB_PATH', 'LEDGER_PATH', 'AGGREGATES_PATH'):
+            os.environ[name] = os.path.join(tmp, f'{name.lower()}.db')
+        os.environ['STOCK_LOCK_PATH'] = os.path.join(tmp, 'estoque.lock')
+        os.environ['TWILIO_API_BASE'] = fake_twilio.base_url
+        os.environ.setdefault('SHEETS_READ_QUOTA', '1000000')
+        os.environ.setdefault('SHEETS_WRITE_QUOTA', '1000000')
+        import app
+        import tracing
+
+        sheets = new_sheets(0.0)
+        app.setup_google_sheets = lambda: app.sheets_gateway.wrap(sheets)
+        app.start_background_workers = lambda: None
+        app.twilio.start()
+        client = app.app.test_client()
+
+        alone, traced = span_cost(tracing, 100000)
+        print(f"span vazio: {alone:.2f} µs fora de um trace, {traced:.2f} µs dentro de um trace")
+
+        samples = {(kind, on): [] for kind in ('parse', 'webhook') for on in (True, False)}
+        offset = 0
+        for _ in range(args.rounds):
+            for on in (False, True):
+                tracing.TRACING = on
+                samples['parse', on] += run_parse(app, args.iterations * 10)
+                samples['webhook', on] += run_webhook(app, client, args.iterations, offset)
+                offset += args.iterations
+        tracing.TRACING = True
+
+        print(f"{'':<10} {'sem tracing':>12} {'com tracing':>12} {'diferença':>10}")
+        for kind, scale, unit in (('parse', 1e6, 'µs'), ('webhook', 1e3, 'ms')):
+            off = percentile(samples[kind, False], 0.5) * scale
+            on = percentile(samples[kind, True], 0.5) * scale
+            print(f"{kind + ' p50':<10} {off:>9.3f} {unit} {on:>9.3f} {unit} "
+                  f"{(on - off) / off * 100:>+9.1f}%")
+
+        body = client.get('/metrics').get_data(as_text=True)
+        print(f"\n/metrics: {len(body.splitlines())} linhas, por exemplo:")
+        for line in body.splitlines():
+            if line.startswith(('doce_encanto_external_calls_total', 'doce_encanto_messages_total',
+                                'doce_encanto_ledger_pending', 'doce_encanto_job_queue_depth')):
+                print(f"  {line}")
+
+
+if __name__ == '__main__':
+    main()
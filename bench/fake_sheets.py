@@ -0,0 +1,209 @@
+"""
+Serviço falso do Google Sheets, em memória, para benchmarks e testes manuais.
+
+Imita o recurso `spreadsheets()` do googleapiclient: values().get, batchGet,
+append, update, batchUpdate e clear, além de get e batchUpdate da planilha
+(addSheet, duplicateSheet, deleteSheet, deleteDimension, appendDimension,
+copyPaste e appendCells, aplicados todos ou nenhum, como na API). Cada chamada leva `latency`
+segundos e é contada em `calls`. Intervalos de abas que não existem geram
+HttpError 400, como na API real.
+
+Uso:
+    sheets = FakeSheets({'Produtos': [...]}, latency=0.05)
+    app.setup_google_sheets = lambda: app.sheets_gateway.wrap(sheets)
+"""
+import re
+import time
+import threading
+from collections import Counter
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+A1_RE = re.compile(r'^(?P<col>[A-Z]*)(?P<row>\d*)$')
+
+
+def column_index(letters):
+    """'A' -> 0, 'H' -> 7, 'AA' -> 26."""
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n - 1
+
+
+def parse_range(a1):
+    """'Aba!B5:D' -> ('Aba', linha inicial, coluna inicial, coluna final ou None), base 0."""
+    tab, _, cells = a1.partition('!')
+    tab = tab.strip("'")
+    start, _, end = (cells or 'A:ZZ').partition(':')
+    m_start, m_end = A1_RE.match(start), A1_RE.match(end or start)
+    row = int(m_start.group('row')) - 1 if m_start.group('row') else 0
+    col = column_index(m_start.group('col')) if m_start.group('col') else 0
+    end_col = column_index(m_end.group('col')) if m_end.group('col') else None
+    return tab, row, col, end_col
+
+
+class _Request:
+    def __init__(self, service, method, fn):
+        self._service = service
+        self._method = method
+        self._fn = fn
+
+    def execute(self):
+        self._service.calls[self._method] += 1
+        if self._service.latency:
+            time.sleep(self._service.latency)
+        with self._service.lock:
+            return self._fn()
+
+
+class _Values:
+    def __init__(self, service):
+        self._s = service
+
+    def get(self, spreadsheetId, range, **kwargs):
+        return _Request(self._s, 'values.get', lambda: {'range': range, 'values': self._s.read(range)})
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        return _Request(self._s, 'values.batchGet', lambda: {
+            'valueRanges': [{'range': r, 'values': self._s.read(r)} for r in ranges]})
+
+    def append(self, spreadsheetId, range, body, **kwargs):
+        def run():
+            tab, row, col, _ = parse_range(range)
+            rows = self._s.tab(range)
+            start = max(len(rows), row)
+            self._s.write(tab, start, col, body['values'])
+            return {'updates': {'updatedRows': len(body['values'])}}
+        return _Request(self._s, 'values.append', run)
+
+    def update(self, spreadsheetId, range, body, **kwargs):
+        def run():
+            tab, row, col, _ = parse_range(range)
+            self._s.tab(range)
+            self._s.write(tab, row, col, body['values'])
+            return {}
+        return _Request(self._s, 'values.update', run)
+
+    def batchUpdate(self, spreadsheetId, body):
+        def run():
+            for data in body['data']:
+                tab, row, col, _ = parse_range(data['range'])
+                self._s.tab(data['range'])
+                self._s.write(tab, row, col, data['values'])
+            return {'totalUpdatedRows': sum(len(d['values']) for d in body['data'])}
+        return _Request(self._s, 'values.batchUpdate', run)
+
+    def clear(self, spreadsheetId, range, body=None):
+        def run():
+            tab, row, _, _ = parse_range(range)
+            del self._s.tab(range)[row:]
+            return {}
+        return _Request(self._s, 'values.clear', run)
+
+
+class FakeSheets:
+    """Planilha em memória: {nome da aba: [linhas]}."""
+
+    def __init__(self, tabs=None, latency=0.0):
+        self.tabs = {name: [list(row) for row in rows] for name, rows in (tabs or {}).items()}
+        self.ids = {}
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def tab(self, a1):
+        name = parse_range(a1)[0]
+        if name not in self.tabs:
+            raise HttpError(httplib2.Response({'status': 400}),
+                            f'Unable to parse range: {a1}'.encode('utf-8'))
+        return self.tabs[name]
+
+    def read(self, a1):
+        _, row, col, end_col = parse_range(a1)
+        rows = self.tab(a1)[row:]
+        values = [list(r[col:None if end_col is None else end_col + 1]) for r in rows]
+        # A API omite linhas vazias no fim e células vazias no fim de cada linha
+        for r in values:
+            while r and r[-1] in ('', None):
+                r.pop()
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def write(self, tab, row, col, values):
+        rows = self.tabs[tab]
+        while len(rows) < row + len(values):
+            rows.append([])
+        for i, value_row in enumerate(values):
+            target = rows[row + i]
+            while len(target) < col + len(value_row):
+                target.append('')
+            target[col:col + len(value_row)] = value_row
+
+    def values(self):
+        return _Values(self)
+
+    def sheet_id(self, name):
+        if name not in self.ids:
+            self.ids[name] = max(self.ids.values(), default=-1) + 1
+        return self.ids[name]
+
+    def get(self, spreadsheetId, **kwargs):
+        return _Request(self, 'get', lambda: {'sheets': [
+            {'properties': {'sheetId': self.sheet_id(name), 'title': name,
+                            'gridProperties': {'rowCount': len(rows)}}}
+            for name, rows in self.tabs.items()]})
+
+    def batchUpdate(self, spreadsheetId, body):
+        def run():
+            # Como na API, ou todos os pedidos são aplicados ou nenhum
+            for name in self.tabs:
+                self.sheet_id(name)
+            tabs = {name: [list(r) for r in rows] for name, rows in self.tabs.items()}
+            ids = dict(self.ids)
+            by_id = {sheet_id: name for name, sheet_id in ids.items() if name in tabs}
+            replies = []
+            for request in body['requests']:
+                kind, spec = next(iter(request.items()))
+                if kind == 'addSheet':
+                    title = spec['properties']['title']
+                    sheet_id = spec['properties'].get('sheetId', max(ids.values(), default=-1) + 1)
+                    tabs[title], ids[title], by_id[sheet_id] = [], sheet_id, title
+                    replies.append({'addSheet': {'properties': {'sheetId': sheet_id, 'title': title}}})
+                elif kind == 'duplicateSheet':
+                    title = spec['newSheetName']
+                    sheet_id = spec.get('newSheetId', max(ids.values(), default=-1) + 1)
+                    tabs[title] = [list(r) for r in tabs[by_id[spec['sourceSheetId']]]]
+                    ids[title], by_id[sheet_id] = sheet_id, title
+                    replies.append({'duplicateSheet': {'properties': {'sheetId': sheet_id, 'title': title}}})
+                elif kind == 'deleteSheet':
+                    del tabs[by_id.pop(spec['sheetId'])]
+                    replies.append({})
+                elif kind == 'deleteDimension':
+                    r = spec['range']
+                    del tabs[by_id[r['sheetId']]][r['startIndex']:r['endIndex']]
+                    replies.append({})
+                elif kind == 'appendDimension':
+                    tabs[by_id[spec['sheetId']]].extend([] for _ in range(spec['length']))
+                    replies.append({})
+                elif kind == 'copyPaste':
+                    source, dest = spec['source'], spec['destination']
+                    rows = [list(r) for r in tabs[by_id[source['sheetId']]]
+                            [source['startRowIndex']:source['endRowIndex']]]
+                    target = tabs[by_id[dest['sheetId']]]
+                    target[dest['startRowIndex']:dest['startRowIndex'] + len(rows)] = rows
+                    replies.append({})
+                elif kind == 'appendCells':
+                    target = tabs[by_id[spec['sheetId']]]
+                    while target and not target[-1]:
+                        target.pop()
+                    target.extend([next(iter(cell.get('userEnteredValue', {'stringValue': ''}).values()))
+                                   for cell in row.get('values', [])] for row in spec['rows'])
+                    replies.append({})
+                else:
+                    replies.append({})
+            self.tabs = tabs
+            self.ids = {name: sheet_id for name, sheet_id in ids.items() if name in tabs}
+            return {'replies': replies}
+        return _Request(self, 'batchUpdate', run)
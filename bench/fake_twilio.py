@@ -0,0 +1,77 @@
+"""
+Servidor local que imita o endpoint de mensagens da API do Twilio.
+
+Responde 201 para cada POST em /2010-04-01/Accounts/<sid>/Messages.json,
+podendo simular latência e uma fração de respostas 429/503. As mensagens
+recebidas ficam em `server.messages`.
+"""
+import time
+import random
+import threading
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+        if server.latency:
+            time.sleep(server.latency)
+
+        with server.lock:
+            server.requests += 1
+            fail = server.rng.random() < server.error_rate
+
+        if fail:
+            status = server.rng.choice([429, 503])
+            body = b'{"message": "erro simulado"}'
+            self.send_response(status)
+            if status == 429:
+                self.send_header('Retry-After', '0')
+        else:
+            with server.lock:
+                server.messages.append(form)
+                server.delivered_at[form.get('To')] = time.monotonic()
+            status = 201
+            body = b'{"sid": "SMfake"}'
+            self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeTwilio(ThreadingHTTPServer):
+    daemon_threads = True
+    # Muitos envios simultâneos (asgi.py): a fila padrão de 5 conexões recusaria a maioria
+    request_queue_size = 1024
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=1):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.messages = []
+        self.delivered_at = {}  # destinatário -> instante (monotonic) da última mensagem
+        self.requests = 0
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from types import MappingProxyType
+
+from categories import CategoryMatcher, parse_categories
+from recipes import CostTable, parse_recipes
+from resolver import ProductResolver
+
+# Linhas de cabeçalho no topo das abas Produtos e Controle de Estoque
+HEADER_ROWS = 4
+
+PRODUCTS_RANGE = 'Produtos!B:D'
+INGREDIENTS_RANGE = 'Controle de Estoque!B:E'
+
+
+def _parse_preco(valor):
+    return float(valor.replace('R$', '').replace(',', '.').strip())
+
+
+def parse_products(values):
+    """Converte as linhas da aba Produtos em {produto: preço}."""
+    produtos = {}
+    # Pular o cabeçalho
+    for row in values[HEADER_ROWS:]:
+        if len(row) >= 3:
+            produto = row[0].lower()
+            try:
+                produtos[produto] = _parse_preco(row[2])
+            except (ValueError, IndexError):
+                pass
+    return produtos
+
+
+def parse_ingredients(values):
+    """Converte as linhas da aba Controle de Estoque em {ingrediente: {unidade, preco}}."""
+    ingredientes = {}
+    # Pular o cabeçalho
+    for row in values[HEADER_ROWS:]:
+        if len(row) >= 3:
+            nome = row[0].lower()
+            try:
+                unidade = row[2] if len(row) > 2 else "g"
+                preco = _parse_preco(row[3]) if len(row) > 3 else 0
+                ingredientes[nome] = MappingProxyType({
+                    "unidade": unidade,
+                    "preco": preco
+                })
+            except (ValueError, IndexError):
+                pass
+    return ingredientes
+
+
+def content_hash(values):
+    """Hash estável do conteúdo lido da planilha."""
+    payload = json.dumps(values, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CatalogSnapshot:
+    """Versão imutável do catálogo de produtos, ingredientes, categorias e custos."""
+
+    __slots__ = ('version', 'produtos', 'ingredientes', 'categorias', 'resolver', 'custos',
+                 'section_hashes', 'loaded_at')
+
+    def __init__(self, version, produtos, ingredientes, categorias, section_hashes=None,
+                 resolver=None, custos=None):
+        self.version = version
+        self.produtos = MappingProxyType(dict(produtos))
+        # Índice de busca aproximada, reconstruído só quando os produtos mudam
+        self.resolver = resolver or ProductResolver(self.produtos)
+        self.ingredientes = MappingProxyType({
+            nome: dados if isinstance(dados, MappingProxyType) else MappingProxyType(dict(dados))
+            for nome, dados in ingredientes.items()
+        })
+        self.categorias = categorias  # CategoryMatcher
+        # Custo de ingredientes por produto (tabela vazia enquanto não houver receitas)
+        self.custos = custos or CostTable({}, self.ingredientes)
+        self.section_hashes = MappingProxyType(dict(section_hashes or {}))
+        self.loaded_at = time.time()
+
+
+class CatalogService:
+    """
+    Mantém o catálogo atualizado a partir da planilha.
+
+    `fetch` deve retornar as linhas das abas no formato
+    {'produtos': [...], 'ingredientes': [...], 'categorias': [...], 'receitas': [...]}
+    ('categorias' e 'receitas' são opcionais). Uma thread em segundo plano chama `refresh` a
+    cada `ttl` segundos. Cada aba tem seu próprio hash: só as abas cujo
+    conteúdo mudou são reprocessadas (o índice de categorias, por exemplo, só
+    é reconstruído quando a tabela de palavras-chave muda, e uma mudança só
+    de preços recalcula apenas os custos dos produtos afetados). Cada nova versão é
+    publicada trocando a referência do snapshot, então quem está lendo nunca
+    vê um catálogo pela metade.
+    """
+
+    def __init__(self, fetch, initial_produtos, initial_ingredientes,
+                 initial_categorias=None, ttl=300.0):
+        self.fetch = fetch
+        self.ttl = ttl
+        self._snapshot = CatalogSnapshot(0, initial_produtos, initial_ingredientes,
+                                         CategoryMatcher.from_dict(initial_categorias or {}))
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.checked_at = 0.0
+        self.refreshes = 0
+        self.unchanged = 0
+        self.errors = 0
+
+    def current(self):
+        """Snapshot em uso no momento."""
+        return self._snapshot
+
+    def refresh(self):
+        """Lê a planilha e publica uma nova versão se o conteúdo mudou."""
+        with self._refresh_lock:
+            self.checked_at = time.time()
+            try:
+                values = self.fetch()
+            except Exception as e:
+                self.errors += 1
+                print(f"Erro ao carregar catálogo da planilha: {e}")
+                return False
+
+            self.refreshes += 1
+            current = self._snapshot
+            hashes = {name: content_hash(rows) for name, rows in values.items()}
+            changed = {name for name, digest in hashes.items()
+                       if current.section_hashes.get(name) != digest}
+            if not changed:
+                self.unchanged += 1
+                return True
+
+            produtos = current.produtos
+            resolver = current.resolver
+            if 'produtos' in changed:
+                produtos = parse_products(values['produtos'])
+                resolver = None
+            ingredientes = current.ingredientes
+            if 'ingredientes' in changed:
+                ingredientes = parse_ingredients(values['ingredientes'])
+            categorias = current.categorias
+            if 'categorias' in changed:
+                categorias = CategoryMatcher(parse_categories(values['categorias']))
+            custos = current.custos
+            if 'receitas' in changed:
+                custos = CostTable(parse_recipes(values['receitas']), ingredientes)
+            elif 'ingredientes' in changed:
+                custos = custos.with_prices(ingredientes)
+
+            self._snapshot = CatalogSnapshot(
+                current.version + 1, produtos, ingredientes, categorias,
+                section_hashes=dict(current.section_hashes, **hashes),
+                resolver=resolver, custos=custos)
+            return True
+
+    def refresh_if_stale(self):
+        """
+        Alternativa à thread de `start` para catálogos pouco usados (ex.: os
+        dos inquilinos): se a última leitura passou do ttl, relê a planilha
+        em uma thread avulsa e segue com o snapshot atual.
+        """
+        if time.time() - self.checked_at < self.ttl or self._refresh_lock.locked():
+            return False
+        self.checked_at = time.time()
+        threading.Thread(target=self.refresh, name='catalog-refresh', daemon=True).start()
+        return True
+
+    def _run(self):
+        # Um catálogo recém-carregado (ex.: herdado do master do gunicorn) só é relido no próximo ciclo
+        age = time.time() - self._snapshot.loaded_at
+        if self._snapshot.version > 0 and age < self.ttl:
+            self._stop.wait(self.ttl - age)
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.ttl)
+
+    def start(self):
+        """Inicia a atualização periódica em segundo plano (uma vez por processo)."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='catalog-refresher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._pid = None
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'version': snapshot.version,
+            'produtos': len(snapshot.produtos),
+            'ingredientes': len(snapshot.ingredientes),
+            'categorias': snapshot.categorias.size,
+            'receitas': snapshot.custos.size,
+            'age': round(time.time() - snapshot.loaded_at, 3),
+            'refreshes': self.refreshes,
+            'unchanged': self.unchanged,
+            'errors': self.errors,
+        }
@@ -0,0 +1,84 @@
+import re
+import unicodedata
+
+# Linhas de cabeçalho no topo da aba Categorias
+HEADER_ROWS = 4
+
+CATEGORIES_RANGE = 'Categorias!A:C'
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def fold(texto):
+    """Remove acentos e converte para minúsculas ('Ônibus' -> 'onibus')."""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+def tokenize(texto):
+    """Quebra o texto (sem acentos) em palavras inteiras."""
+    return TOKEN_RE.findall(fold(texto))
+
+
+def parse_categories(values):
+    """
+    Converte as linhas da aba Categorias em [(palavra-chave, categoria, prioridade)].
+    Colunas: A = palavra-chave, B = categoria, C = prioridade (opcional, maior vence).
+    """
+    entries = []
+    for row in values[HEADER_ROWS:]:
+        if len(row) >= 2 and row[0].strip() and row[1].strip():
+            try:
+                prioridade = int(row[2]) if len(row) > 2 and row[2].strip() else 0
+            except ValueError:
+                prioridade = 0
+            entries.append((row[0].strip(), row[1].strip(), prioridade))
+    return entries
+
+
+class CategoryMatcher:
+    """
+    Índice de palavras-chave para inferir a categoria de um gasto pessoal.
+
+    As palavras-chave (de uma ou mais palavras) são indexadas pela primeira
+    palavra já sem acentos, então a busca percorre apenas as palavras da
+    descrição e o tempo não cresce com o tamanho da tabela. Só casam palavras
+    inteiras: "luz" não casa com "luzia". Havendo mais de uma palavra-chave na
+    descrição, vence a de maior prioridade, depois a que aparece primeiro e,
+    por fim, a mais longa.
+    """
+
+    __slots__ = ('_index', 'size')
+
+    def __init__(self, entries):
+        index = {}
+        for palavra_chave, categoria, prioridade in entries:
+            tokens = tuple(tokenize(palavra_chave))
+            if not tokens:
+                continue
+            index.setdefault(tokens[0], []).append((tokens, categoria, prioridade))
+        self._index = index
+        self.size = len(entries)
+
+    @classmethod
+    def from_dict(cls, categorias):
+        """Cria o índice a partir de {palavra-chave: categoria}."""
+        return cls([(k, v, 0) for k, v in categorias.items()])
+
+    def match(self, descricao):
+        """Retorna a categoria inferida para a descrição, ou "" se nenhuma casar."""
+        tokens = tokenize(descricao)
+        best = None
+        best_key = None
+        for i, token in enumerate(tokens):
+            candidates = self._index.get(token)
+            if candidates is None:
+                continue
+            for words, categoria, prioridade in candidates:
+                n = len(words)
+                if n > 1 and tuple(tokens[i:i + n]) != words:
+                    continue
+                key = (prioridade, -i, n)
+                if best_key is None or key > best_key:
+                    best, best_key = categoria, key
+        return best or ""
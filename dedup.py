@@ -0,0 +1,139 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Quanto tempo (em segundos) um MessageSid é lembrado
+DEDUP_TTL = 24 * 3600
+
+# Número máximo de MessageSids mantidos em memória
+DEDUP_MAX_ENTRIES = 10000
+
+# A cada quantos registros novos as entradas vencidas são apagadas do SQLite
+PRUNE_EVERY = 500
+
+
+class MessageDedup:
+    """
+    Deduplicação das mensagens do Twilio pelo MessageSid.
+
+    O primeiro worker que registra um MessageSid no SQLite (INSERT OR IGNORE
+    na chave primária) processa a mensagem; as reentregas encontram o
+    registro e recebem a resposta já guardada. Um LRU em memória, limitado
+    a `max_entries` itens e com TTL, evita ir ao SQLite nas repetições
+    recentes deste processo.
+    """
+
+    def __init__(self, path='dedup.db', ttl=DEDUP_TTL, max_entries=DEDUP_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._inserts = 0
+        self.hits = 0
+        self.misses = 0
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS processed_messages (
+                sid TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                tipo TEXT,
+                response TEXT
+            )
+        """)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _cache_get(self, sid, now):
+        with self._lock:
+            entry = self._cache.get(sid)
+            if entry is None:
+                return None
+            if entry[0] < now:
+                del self._cache[sid]
+                return None
+            self._cache.move_to_end(sid)
+            return entry
+
+    def _cache_put(self, sid, created_at, tipo, response):
+        with self._lock:
+            self._cache[sid] = (created_at + self.ttl, tipo, response)
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def claim(self, sid):
+        """
+        Registra o MessageSid. Retorna None se a mensagem é nova (e deve ser
+        processada) ou (tipo, resposta) se ela já foi recebida antes.
+        """
+        now = time.time()
+        entry = self._cache_get(sid, now)
+        if entry is not None:
+            self.hits += 1
+            return entry[1], entry[2]
+
+        conn = self._connect()
+        cur = conn.execute(
+            'INSERT OR IGNORE INTO processed_messages (sid, created_at) VALUES (?, ?)',
+            (sid, now))
+        if cur.rowcount == 1:
+            self.misses += 1
+            self._cache_put(sid, now, None, None)
+            self._inserts += 1
+            if self._inserts % PRUNE_EVERY == 0:
+                self.prune()
+            return None
+
+        row = conn.execute(
+            'SELECT created_at, tipo, response FROM processed_messages WHERE sid = ?',
+            (sid,)).fetchone()
+        if row is None or row[0] < now - self.ttl:
+            # Registro vencido: tratar como mensagem nova
+            conn.execute(
+                'INSERT OR REPLACE INTO processed_messages (sid, created_at) VALUES (?, ?)',
+                (sid, now))
+            self.misses += 1
+            self._cache_put(sid, now, None, None)
+            return None
+        self.hits += 1
+        # Só guardar em memória quando a resposta já é conhecida
+        if row[2] is not None:
+            self._cache_put(sid, row[0], row[1], row[2])
+        return row[1], row[2]
+
+    def store(self, sid, tipo, response):
+        """Guarda a resposta dada à mensagem, para devolvê-la nas reentregas."""
+        self._connect().execute(
+            'UPDATE processed_messages SET tipo = ?, response = ? WHERE sid = ?',
+            (tipo, response, sid))
+        with self._lock:
+            entry = self._cache.get(sid)
+            created_at = entry[0] - self.ttl if entry else time.time()
+        self._cache_put(sid, created_at, tipo, response)
+
+    def release(self, sid):
+        """Esquece o MessageSid (ex.: o processamento falhou e o Twilio deve reenviar)."""
+        self._connect().execute('DELETE FROM processed_messages WHERE sid = ?', (sid,))
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    def prune(self):
+        """Apaga do SQLite os MessageSids mais antigos que o TTL."""
+        self._connect().execute('DELETE FROM processed_messages WHERE created_at < ?',
+                                (time.time() - self.ttl,))
+
+    def stats(self):
+        with self._lock:
+            cached = len(self._cache)
+        return {'cached': cached, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,91 @@
+"""
+Exportação do ledger em CSV ou JSONL, por tipo de registro e intervalo de datas.
+
+Os registros são lidos do ledger em páginas de EXPORT_PAGE_SIZE e cada página
+vira um pedaço da resposta, enviado assim que fica pronto: a memória usada
+não depende do tamanho da exportação. Com inicio ou fim, as páginas vêm do
+índice por data do ledger, em ordem de data: só os registros do intervalo
+são lidos.
+
+Só sai o que o bot gravou no ledger: linhas importadas por backfill.py e
+registros anteriores ao ledger existem apenas na planilha.
+"""
+import io
+import os
+import csv
+import hmac
+import json
+from datetime import datetime
+
+# Registros lidos do ledger por vez (e linhas, no máximo, de cada pedaço da resposta)
+EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', '1000'))
+
+# Formatos aceitos e o tipo de conteúdo de cada um
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def parse_date(texto):
+    """'dd/mm/aaaa' ou 'aaaa-mm-dd' -> date; ValueError se não for uma data."""
+    for fmt in ('%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(texto.strip(), fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"data inválida: '{texto}' (use dd/mm/aaaa ou aaaa-mm-dd)")
+
+
+def authorized(authorization, token):
+    """Confere o cabeçalho 'Authorization: Bearer <token>'. Sem token configurado, ninguém passa."""
+    scheme, _, given = authorization.partition(' ')
+    if not token or scheme.lower() != 'bearer':
+        return False
+    return hmac.compare_digest(given.strip().encode('utf-8'), token.encode('utf-8'))
+
+
+def iter_pages(ledger, tipo, tenant='', inicio=None, fim=None, page_size=EXPORT_PAGE_SIZE):
+    """Registros (dicts) do tipo e do inquilino com data entre `inicio` e `fim`, uma página por vez."""
+    if inicio is None and fim is None:
+        after_seq = 0
+        while True:
+            page = ledger.read(tipo, after_seq, page_size, tenant=tenant)
+            if not page:
+                return
+            after_seq = page[-1][0]
+            yield [record for _, record in page]
+
+    # Datas em aaaa-mm-dd, como na coluna dia do ledger ('' fica antes de qualquer data)
+    after = (inicio.isoformat() if inicio else '', 0)
+    last_day = fim.isoformat() if fim else '9999-12-31'
+    while True:
+        page = ledger.read_days(tipo, tenant, after, last_day, page_size)
+        if not page:
+            return
+        after = page[-1][:2]
+        yield [record for _, _, record in page]
+
+
+def export_chunks(pages, columns, to_rows, formato):
+    """
+    Pedaços (str) da exportação: o cabeçalho (no CSV) e uma página de linhas
+    por vez. `to_rows` monta as linhas das abas a partir dos registros da página.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if formato == 'csv':
+        writer.writerow(columns)
+    for records in pages:
+        for row in to_rows(records):
+            if formato == 'csv':
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n')
+        chunk = buffer.getvalue()
+        if chunk:
+            yield chunk
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
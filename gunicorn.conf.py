@@ -0,0 +1,29 @@
+# Configuração do gunicorn (lida automaticamente pelo comando do Procfile)
+import os
+import gc
+
+# PRELOAD_APP=1 importa o app uma única vez no master, antes do fork: o
+# cliente do Google, o documento de descoberta e o catálogo já carregados são
+# herdados pelos workers (páginas compartilhadas por cópia-na-escrita), e um
+# worker reiniciado responde sem pagar essas importações de novo. Sem ele,
+# cada worker importa o app e o cliente do Google só é importado na primeira
+# chamada ao Sheets.
+preload_app = os.environ.get('PRELOAD_APP', '0') == '1'
+
+
+def when_ready(server):
+    """No master, depois de importar o app (só com preload_app)."""
+    if not server.cfg.preload_app:
+        return
+    from app import preload
+    preload()
+    # Objetos carregados até aqui não são mais visitados pelo coletor de lixo,
+    # que de outra forma tocaria nessas páginas e forçaria sua cópia em cada worker
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    """Inicia os workers em segundo plano assim que o worker do gunicorn sobe."""
+    # Threads não sobrevivem ao fork: com preload_app, cada worker inicia as suas aqui
+    from app import start_background_workers
+    start_background_workers()
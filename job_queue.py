@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Número máximo de tentativas antes de marcar o job como falho
+MAX_ATTEMPTS = 6
+
+# Espera (em segundos) antes da primeira nova tentativa; dobra a cada falha
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+
+# Tempo (em segundos) que um worker pode ficar com um job antes de outro assumi-lo
+LEASE_SECONDS = 120.0
+
+
+class JobQueue:
+    """
+    Fila de jobs persistida em SQLite.
+
+    Os jobs sobrevivem a reinícios do processo e podem ser consumidos por
+    vários workers do gunicorn ao mesmo tempo. Um job cujo worker morreu é
+    retomado depois de LEASE_SECONDS. Cada job pertence a um inquilino
+    ('' para o padrão) e `claim` alterna entre os inquilinos com jobs
+    prontos, então uma rajada de um deles não atrasa os outros.
+
+    Os jobs dos tipos em `retry_forever` não têm limite de tentativas: são
+    reprocessados com backoff (até BACKOFF_MAX) até dar certo, em vez de
+    serem marcados como falhos.
+    """
+
+    def __init__(self, path='jobs.db', retry_forever=()):
+        self.path = path
+        self.retry_forever = frozenset(retry_forever)
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._last_tenant = None
+        self._init_db()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                run_at REAL NOT NULL,
+                locked_until REAL NOT NULL DEFAULT 0,
+                last_error TEXT
+            )
+        """)
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, run_at)')
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]
+        if 'tenant' not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN tenant TEXT NOT NULL DEFAULT ''")
+        # Busca do próximo inquilino com jobs prontos sem percorrer a fila inteira
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS jobs_tenant_ready ON jobs (tenant, status, run_at)')
+
+    def enqueue(self, kind, payload, tenant=''):
+        """Adiciona um job à fila e retorna seu id."""
+        now = time.time()
+        cur = self._connect().execute(
+            'INSERT INTO jobs (kind, payload, created_at, run_at, tenant) VALUES (?, ?, ?, ?, ?)',
+            (kind, json.dumps(payload), now, now, tenant))
+        self._wakeup.set()
+        return cur.lastrowid
+
+    def _next_ready(self, conn, tenant, now):
+        """Job pronto mais antigo do inquilino (pendente ou com a reserva vencida), ou None."""
+        rows = [conn.execute(
+            "SELECT id, kind, payload, attempts, run_at FROM jobs "
+            "WHERE tenant = ? AND status = 'pending' AND run_at <= ? ORDER BY run_at LIMIT 1",
+            (tenant, now)).fetchone(), conn.execute(
+            "SELECT id, kind, payload, attempts, run_at FROM jobs "
+            "WHERE tenant = ? AND status = 'running' AND locked_until <= ? ORDER BY run_at LIMIT 1",
+            (tenant, now)).fetchone()]
+        rows = [row for row in rows if row is not None]
+        return min(rows, key=lambda row: row[4]) if rows else None
+
+    def claim(self):
+        """
+        Reserva o próximo job pronto, do inquilino seguinte ao do último job
+        reservado por este processo. Retorna (id, kind, payload, attempts) ou None.
+        Os inquilinos são percorridos pelo índice jobs_tenant_ready, um de cada
+        vez: o custo depende do número de inquilinos, não do tamanho da fila.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = None
+            last = self._last_tenant
+            # Do inquilino seguinte ao último até o fim, depois do primeiro até o último
+            passes = [(last, None), (None, last)] if last is not None else [(None, None)]
+            for after, until in passes:
+                tenant = after
+                while row is None:
+                    if tenant is None:
+                        found = conn.execute('SELECT MIN(tenant) FROM jobs').fetchone()
+                    else:
+                        found = conn.execute(
+                            'SELECT MIN(tenant) FROM jobs WHERE tenant > ?', (tenant,)).fetchone()
+                    tenant = found[0]
+                    if tenant is None or (until is not None and tenant > until):
+                        break
+                    row = self._next_ready(conn, tenant, now)
+                if row is not None:
+                    break
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            self._last_tenant = tenant
+            conn.execute(
+                "UPDATE jobs SET status = 'running', locked_until = ? WHERE id = ?",
+                (now + LEASE_SECONDS, row[0]))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return row[0], row[1], json.loads(row[2]), row[3]
+
+    def complete(self, job_id):
+        """Remove um job concluído."""
+        self._connect().execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def retry(self, job_id, attempts, error, max_attempts=MAX_ATTEMPTS):
+        """
+        Reagenda o job com backoff exponencial. Retorna False se esgotou as
+        tentativas (max_attempts=None: nunca esgota).
+        """
+        attempts += 1
+        if max_attempts is not None and attempts >= max_attempts:
+            self._connect().execute(
+                "UPDATE jobs SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                (attempts, error, job_id))
+            return False
+        delay = min(BACKOFF_BASE * (2 ** min(attempts - 1, 30)), BACKOFF_MAX)
+        self._connect().execute(
+            """UPDATE jobs SET status = 'pending', attempts = ?, run_at = ?,
+                              locked_until = 0, last_error = ? WHERE id = ?""",
+            (attempts, time.time() + delay, error, job_id))
+        return True
+
+    def run_once(self, handler):
+        """Processa um job, se houver. Retorna True se algum job foi processado."""
+        job = self.claim()
+        if job is None:
+            return False
+        job_id, kind, payload, attempts = job
+        max_attempts = None if kind in self.retry_forever else MAX_ATTEMPTS
+        try:
+            handler(kind, payload,
+                    final_attempt=max_attempts is not None and attempts + 1 >= max_attempts)
+        except Exception as e:
+            print(f"Erro ao processar job {job_id} ({kind}): {e}")
+            self.retry(job_id, attempts, str(e), max_attempts)
+        else:
+            self.complete(job_id)
+        return True
+
+    def _worker_loop(self, handler, poll_interval):
+        while not self._stop.is_set():
+            try:
+                if self.run_once(handler):
+                    continue
+            except Exception as e:
+                print(f"Erro no worker da fila: {e}")
+            self._wakeup.wait(poll_interval)
+            self._wakeup.clear()
+
+    def start_workers(self, handler, count=2, poll_interval=1.0):
+        """Inicia `count` threads consumindo a fila (uma vez por processo)."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._threads = []
+        for i in range(count):
+            t = threading.Thread(target=self._worker_loop, args=(handler, poll_interval),
+                                 name=f'job-worker-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop_workers(self, timeout=5.0):
+        self._stop.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        self._pid = None
+
+    def stats(self):
+        """Profundidade da fila e idade do job mais antigo (em segundos)."""
+        now = time.time()
+        rows = self._connect().execute(
+            'SELECT status, COUNT(*), MIN(created_at) FROM jobs GROUP BY status').fetchall()
+        by_status = {status: (count, oldest) for status, count, oldest in rows}
+        pending = by_status.get('pending', (0, None))
+        running = by_status.get('running', (0, None))
+        oldest = [t for t in (pending[1], running[1]) if t is not None]
+        return {
+            'depth': pending[0] + running[0],
+            'pending': pending[0],
+            'running': running[0],
+            'failed': by_status.get('failed', (0, None))[0],
+            'oldest_age': round(now - min(oldest), 3) if oldest else 0.0,
+        }
@@ -0,0 +1,403 @@
+import os
+import json
+import time
+import fcntl
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from tracing import failures, span, trace
+
+# Quantos registros, no máximo, cada envio à planilha leva
+SYNC_BATCH_SIZE = 500
+
+# Intervalo (em segundos) entre as sincronizações; dobra a cada falha seguida
+SYNC_INTERVAL = 2.0
+SYNC_BACKOFF_MAX = 300.0
+
+
+def record_day(data):
+    """'dd/mm/aaaa' -> 'aaaa-mm-dd' (ordena como texto); None se não for uma data."""
+    try:
+        dia, mes, ano = data.split('/')
+        return f'{int(ano):04d}-{int(mes):02d}-{int(dia):02d}'
+    except (AttributeError, ValueError):
+        return None
+
+
+class Ledger:
+    """
+    Registro local, somente de acréscimo, de todas as vendas, compras e
+    gastos pessoais recebidos.
+
+    É a fonte de verdade do bot: cada registro é gravado aqui (SQLite em modo
+    WAL, com fsync no commit) e recebe um número de sequência antes de ir para
+    a planilha. A tabela sync_state guarda, para cada destino, até qual
+    sequência os registros já foram enviados (high-water mark). Cada registro
+    leva o id do inquilino que o recebeu ('' para o inquilino padrão) e a
+    data do registro em aaaa-mm-dd (coluna dia, indexada para as leituras
+    por intervalo de datas).
+    """
+
+    def __init__(self, path='ledger.db'):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS records (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                tipo TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS records_tipo ON records (tipo, seq)')
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(records)')]
+        if 'tenant' not in columns:
+            # Ledgers anteriores aos inquilinos: tudo pertence ao inquilino padrão
+            conn.execute("ALTER TABLE records ADD COLUMN tenant TEXT NOT NULL DEFAULT ''")
+        conn.execute('CREATE INDEX IF NOT EXISTS records_tenant ON records (tenant, tipo, seq)')
+        if 'dia' not in columns:
+            # Ledgers anteriores à coluna: a data de cada registro sai do payload
+            conn.create_function('record_day', 1, lambda payload: record_day(json.loads(payload).get('data')))
+            conn.execute('BEGIN')
+            conn.execute('ALTER TABLE records ADD COLUMN dia TEXT')
+            conn.execute('UPDATE records SET dia = record_day(payload)')
+            conn.execute('COMMIT')
+        conn.execute('CREATE INDEX IF NOT EXISTS records_dia ON records (tenant, tipo, dia, seq)')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_state (
+                target TEXT PRIMARY KEY,
+                high_water INTEGER NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_inflight (
+                target TEXT PRIMARY KEY,
+                first_seq INTEGER NOT NULL
+            )
+        """)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def append(self, record, tenant=''):
+        """Grava o registro (com fsync) e retorna seu número de sequência."""
+        cur = self._connect().execute(
+            'INSERT INTO records (tipo, payload, created_at, tenant, dia) VALUES (?, ?, ?, ?, ?)',
+            (record.tipo, json.dumps(record.to_dict(), ensure_ascii=False), time.time(), tenant,
+             record_day(getattr(record, 'data', None))))
+        return cur.lastrowid
+
+    def read(self, tipo=None, after_seq=0, limit=SYNC_BATCH_SIZE, tenant=None):
+        """
+        Registros com sequência maior que `after_seq`, em ordem: [(seq, dict)].
+        Com `tenant`, só os desse inquilino.
+        """
+        if tenant is not None:
+            rows = self._connect().execute(
+                'SELECT seq, payload FROM records WHERE tenant = ? AND tipo = ? AND seq > ? '
+                'ORDER BY seq LIMIT ?',
+                (tenant, tipo, after_seq, limit)).fetchall()
+        elif tipo is None:
+            rows = self._connect().execute(
+                'SELECT seq, payload FROM records WHERE seq > ? ORDER BY seq LIMIT ?',
+                (after_seq, limit)).fetchall()
+        else:
+            rows = self._connect().execute(
+                'SELECT seq, payload FROM records WHERE tipo = ? AND seq > ? ORDER BY seq LIMIT ?',
+                (tipo, after_seq, limit)).fetchall()
+        return [(seq, json.loads(payload)) for seq, payload in rows]
+
+    def read_days(self, tipo, tenant, after, fim, limit=SYNC_BATCH_SIZE):
+        """
+        Registros do tipo e do inquilino depois da posição `after` (dia, seq) e
+        com data (aaaa-mm-dd) até `fim`, ordenados por data e sequência:
+        [(dia, seq, dict)]. Começando em (inicio, 0), pagina um intervalo de
+        datas pelo índice records_dia: o custo depende só dos registros lidos.
+        """
+        rows = self._connect().execute(
+            'SELECT dia, seq, payload FROM records WHERE tenant = ? AND tipo = ? '
+            'AND (dia, seq) > (?, ?) AND dia <= ? ORDER BY dia, seq LIMIT ?',
+            (tenant, tipo, after[0], after[1], fim, limit)).fetchall()
+        return [(dia, seq, json.loads(payload)) for dia, seq, payload in rows]
+
+    def last_seq(self):
+        row = self._connect().execute('SELECT MAX(seq) FROM records').fetchone()
+        return row[0] or 0
+
+    def high_water(self, target):
+        row = self._connect().execute(
+            'SELECT high_water FROM sync_state WHERE target = ?', (target,)).fetchone()
+        return row[0] if row else 0
+
+    def set_high_water(self, target, seq):
+        self._connect().execute(
+            'INSERT INTO sync_state (target, high_water) VALUES (?, ?) '
+            'ON CONFLICT(target) DO UPDATE SET high_water = excluded.high_water',
+            (target, seq))
+
+    def commit_batch(self, target, seq):
+        """Avança a high-water mark do destino e encerra o lote em andamento dele, juntos."""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.set_high_water(target, seq)
+            conn.execute('DELETE FROM sync_inflight WHERE target = ?', (target,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def inflight(self, target):
+        """Primeira sequência do lote enviado ao destino e ainda não confirmado (None se não há)."""
+        row = self._connect().execute(
+            'SELECT first_seq FROM sync_inflight WHERE target = ?', (target,)).fetchone()
+        return row[0] if row else None
+
+    def set_inflight(self, target, first_seq):
+        """Marca (com fsync) que um lote vai ser enviado ao destino, antes da chamada ao Sheets."""
+        self._connect().execute(
+            'INSERT INTO sync_inflight (target, first_seq) VALUES (?, ?) '
+            'ON CONFLICT(target) DO UPDATE SET first_seq = excluded.first_seq',
+            (target, first_seq))
+
+    def has_inflight(self):
+        return self._connect().execute('SELECT 1 FROM sync_inflight LIMIT 1').fetchone() is not None
+
+    def init_high_water(self, target, seq):
+        """Define a high-water mark do destino só se ele ainda não tiver uma."""
+        self._connect().execute(
+            'INSERT OR IGNORE INTO sync_state (target, high_water) VALUES (?, ?)', (target, seq))
+
+    def pending(self, tipo, target, tenant=None):
+        """Quantos registros do tipo (e do inquilino, se dado) ainda não foram enviados ao destino."""
+        if tenant is not None:
+            row = self._connect().execute(
+                'SELECT COUNT(*) FROM records WHERE tenant = ? AND tipo = ? AND seq > ?',
+                (tenant, tipo, self.high_water(target))).fetchone()
+            return row[0]
+        row = self._connect().execute(
+            'SELECT COUNT(*) FROM records WHERE tipo = ? AND seq > ?',
+            (tipo, self.high_water(target))).fetchone()
+        return row[0]
+
+
+class LedgerSyncer:
+    """
+    Envia ao Google Sheets os registros do ledger que ainda não foram
+    sincronizados.
+
+    `sinks` mapeia o nome de cada destino (uma aba) para (tipo, writer);
+    `writer(spreadsheet_id, records)` grava uma lista de registros de uma vez.
+    Cada destino tem sua própria high-water mark, identificada pelo ID da
+    planilha e pelo nome do destino: enviar o ledger inteiro para uma planilha
+    nova é só sincronizar com outro ID. Um arquivo de trava garante que só um
+    worker do gunicorn sincroniza por vez.
+
+    `get_targets`, se dado, lista (inquilino, planilha) de cada inquilino,
+    começando pelo padrão; cada um recebe só os próprios registros. Os
+    inquilinos são atendidos em rodízio, um lote por destino de cada vez,
+    então o acúmulo de um deles não atrasa os registros dos outros.
+
+    `written` mapeia os destinos que acrescentam linhas a uma aba para
+    `reader(spreadsheet_id)`, que devolve as sequências já gravadas nela; o
+    writer desses destinos recebe também as sequências do lote
+    (`writer(spreadsheet_id, records, seqs)`) e as grava numa coluna da aba.
+    Antes de cada envio o lote fica marcado no ledger (sync_inflight) e a
+    marca só sai junto com o avanço da high-water mark. Se o processo cair,
+    ou a chamada der timeout, depois de o Sheets aceitar as linhas, a marca
+    continua lá: na tentativa seguinte a aba é lida e os registros que já
+    estão nela não são gravados de novo.
+    """
+
+    def __init__(self, ledger, sinks, get_spreadsheet_id, decode=None,
+                 batch_size=SYNC_BATCH_SIZE, interval=SYNC_INTERVAL, get_targets=None, written=None):
+        self.ledger = ledger
+        self.sinks = sinks
+        self.written = written or {}
+        self.get_spreadsheet_id = get_spreadsheet_id
+        self.get_targets = get_targets or (lambda: [(None, self.get_spreadsheet_id())])
+        self.decode = decode or (lambda d: d)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lock_path = f'{ledger.path}.sync.lock'
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._pid = None
+        self.synced = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_error = None
+
+    def notify(self):
+        """Acorda o sincronizador (há registros novos)."""
+        self._wakeup.set()
+
+    def _targets(self, spreadsheet_id=None):
+        targets = self.get_targets()
+        if spreadsheet_id:
+            # Reenvio para outra planilha: os registros do inquilino padrão
+            return [(targets[0][0], spreadsheet_id)]
+        return targets
+
+    def pending_batches(self, spreadsheet_id=None):
+        """
+        Lotes pendentes, em rodízio entre os inquilinos: a cada rodada, no
+        máximo um lote de cada destino de cada inquilino. Gera
+        (destino, aba, planilha, writer, [(seq, dict)]); quem consome grava o
+        lote e avança a high-water mark do destino antes de pedir o próximo.
+        """
+        active = [(tenant, spreadsheet_id, name, tipo, writer)
+                  for tenant, spreadsheet_id in self._targets(spreadsheet_id)
+                  for name, (tipo, writer) in self.sinks.items()]
+        while active:
+            full = []
+            for entry in active:
+                tenant, spreadsheet_id, name, tipo, writer = entry
+                target = f'{spreadsheet_id}:{name}'
+                batch = self.ledger.read(tipo, self.ledger.high_water(target), self.batch_size,
+                                         tenant=tenant)
+                if not batch:
+                    continue
+                yield target, name, spreadsheet_id, writer, batch
+                if len(batch) == self.batch_size:
+                    full.append(entry)
+            active = full
+
+    def prepare_batch(self, target, name, spreadsheet_id, batch):
+        """
+        Lote a enviar ao destino, sem os registros que uma tentativa anterior
+        interrompida já gravou na aba, e marcado como em andamento. Vazio se
+        todos já estavam lá.
+        """
+        reader = self.written.get(name)
+        if reader is None:
+            return batch
+        if self.ledger.inflight(target) is not None:
+            present = reader(spreadsheet_id)
+            batch = [(seq, d) for seq, d in batch if seq not in present]
+        if batch:
+            self.ledger.set_inflight(target, batch[0][0])
+        return batch
+
+    def write_batch(self, name, spreadsheet_id, writer, batch):
+        records = [self.decode(d) for _, d in batch]
+        if name in self.written:
+            writer(spreadsheet_id, records, [seq for seq, _ in batch])
+        else:
+            writer(spreadsheet_id, records)
+
+    def sync_once(self, spreadsheet_id=None):
+        """
+        Envia todos os registros pendentes, em lotes de até `batch_size`.
+        Retorna o número de registros enviados, ou None se outro worker já
+        está sincronizando.
+        """
+        with open(self.lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            try:
+                with trace('ledger.sync') as current:
+                    total = 0
+                    for target, name, spreadsheet_id, writer, batch in self.pending_batches(spreadsheet_id):
+                        with span('sync', tab=name, records=len(batch)):
+                            unwritten = self.prepare_batch(target, name, spreadsheet_id, batch)
+                            if unwritten:
+                                self.write_batch(name, spreadsheet_id, writer, unwritten)
+                        self.ledger.commit_batch(target, batch[-1][0])
+                        total += len(batch)
+                        self.batches += 1
+                    current.set(records=total)
+                self.synced += total
+                return total
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def paused(self):
+        """Segura a trava de sincronização: nenhum worker envia registros dentro do bloco."""
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _run(self):
+        consecutive = 0
+        while not self._stop.is_set():
+            try:
+                self.sync_once()
+                consecutive = 0
+            except Exception as e:
+                consecutive += 1
+                self.errors += 1
+                self.last_error = str(e)
+                failures.inc('ledger_sync')
+                print(f"Erro ao sincronizar o ledger com a planilha: {e}")
+            delay = min(self.interval * (2 ** consecutive), SYNC_BACKOFF_MAX)
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def start(self):
+        """Inicia a sincronização em segundo plano (uma vez por processo)."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        threading.Thread(target=self._run, name='ledger-syncer', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        self._pid = None
+
+    def stats(self):
+        targets = self.get_targets()
+        return {
+            'last_seq': self.ledger.last_seq(),
+            'pending': {name: sum(self.ledger.pending(tipo, f'{spreadsheet_id}:{name}', tenant)
+                                  for tenant, spreadsheet_id in targets)
+                        for name, (tipo, _) in self.sinks.items()},
+            'targets': len(targets),
+            'synced': self.synced,
+            'batches': self.batches,
+            'errors': self.errors,
+            'last_error': self.last_error,
+        }
+
+
+def main():
+    """
+    Linha de comando do ledger.
+      python ledger.py status                 mostra o que falta sincronizar
+      python ledger.py sync                   sincroniza agora com a planilha configurada
+      python ledger.py replay SPREADSHEET_ID  envia o ledger inteiro para outra planilha
+    """
+    import sys
+    import app
+
+    args = sys.argv[1:]
+    if args[:1] == ['status']:
+        print(json.dumps(app.ledger_syncer.stats(), indent=2, ensure_ascii=False))
+    elif args[:1] == ['sync']:
+        print(f"{app.ledger_syncer.sync_once()} registros enviados")
+    elif args[:1] == ['replay'] and len(args) == 2:
+        print(f"{app.ledger_syncer.sync_once(args[1])} registros enviados para {args[1]}")
+    else:
+        print(main.__doc__)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
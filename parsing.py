@@ -0,0 +1,301 @@
+import re
+from datetime import datetime
+
+from categories import fold
+
+# Gramáticas pré-compiladas de cada comando
+PRODUTO_QUANTIDADE_RE = re.compile(r'^(?P<produto>.+?)\s*x\s*(?P<quantidade>\d+)$', re.IGNORECASE)
+ITEM_COMPRA_RE = re.compile(r'^(?P<quantidade>\d+)\s+(?P<nome>.+)$')
+
+# Períodos aceitos pelo comando "Resumo:"
+PERIODOS_RESUMO = ('hoje', 'semana', 'mes')
+
+
+def parse_valor(texto):
+    """Converte '20,00' ou 'R$ 20,00' em float; retorna 0 se não for um número."""
+    try:
+        return float(texto.replace('R$', '').replace(',', '.').strip())
+    except ValueError:
+        return 0
+
+
+def format_nome(nome):
+    """Formata o nome com a primeira letra de cada palavra maiúscula."""
+    return ' '.join(word.capitalize() for word in nome.split())
+
+
+class Record:
+    """Base dos registros extraídos das mensagens."""
+
+    __slots__ = ('data',)
+    tipo = None
+
+    def to_dict(self):
+        result = {'tipo': self.tipo}
+        for cls in reversed(type(self).__mro__):
+            for name in getattr(cls, '__slots__', ()):
+                value = getattr(self, name)
+                if isinstance(value, list):
+                    value = [v.to_dict() if hasattr(v, 'to_dict') else v for v in value]
+                result[name] = value
+        return result
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+
+class ItemVenda:
+    __slots__ = ('produto', 'quantidade', 'valor_unitario', 'valor_total')
+
+    def __init__(self, produto, quantidade, valor_unitario, valor_total):
+        self.produto = produto
+        self.quantidade = quantidade
+        self.valor_unitario = valor_unitario
+        self.valor_total = valor_total
+
+    def to_dict(self):
+        return {'produto': self.produto, 'quantidade': self.quantidade,
+                'valor_unitario': self.valor_unitario, 'valor_total': self.valor_total}
+
+
+class Venda(Record):
+    """Venda com um ou mais itens; `valor_total` é o total do pedido."""
+
+    __slots__ = ('itens', 'valor_total', 'pagamento', 'observacoes')
+    tipo = 'venda'
+
+    def __init__(self, data, itens, valor_total, pagamento, observacoes=''):
+        self.data = data
+        self.itens = itens
+        self.valor_total = valor_total
+        self.pagamento = pagamento
+        self.observacoes = observacoes
+
+
+class ItemCompra:
+    __slots__ = ('nome', 'quantidade')
+
+    def __init__(self, nome, quantidade):
+        self.nome = nome
+        self.quantidade = quantidade
+
+    def to_dict(self):
+        return {'nome': self.nome, 'quantidade': self.quantidade}
+
+
+class Compra(Record):
+    __slots__ = ('itens', 'valor_total', 'local', 'pagamento', 'observacoes', 'descricao')
+    tipo = 'compra'
+
+    def __init__(self, data, itens, valor_total, local='', pagamento='',
+                 observacoes='', descricao=''):
+        self.data = data
+        self.itens = itens
+        self.valor_total = valor_total
+        self.local = local
+        self.pagamento = pagamento
+        self.observacoes = observacoes
+        self.descricao = descricao  # Descrição completa dos itens para registro
+
+
+class Pessoal(Record):
+    __slots__ = ('descricao', 'valor', 'categoria', 'pagamento', 'observacoes')
+    tipo = 'pessoal'
+
+    def __init__(self, data, descricao, valor, categoria='', pagamento='', observacoes=''):
+        self.data = data
+        self.descricao = descricao
+        self.valor = valor
+        self.categoria = categoria
+        self.pagamento = pagamento
+        self.observacoes = observacoes
+
+
+class Sugestao(Record):
+    """Produto não reconhecido com segurança: há mais de um candidato parecido."""
+
+    __slots__ = ('termo', 'sugestoes')
+    tipo = 'sugestao'
+
+    def __init__(self, data, termo, sugestoes):
+        self.data = data
+        self.termo = termo
+        self.sugestoes = sugestoes
+
+
+class Resumo(Record):
+    """Pedido de relatório: `periodo` é 'hoje', 'semana' ou 'mes'."""
+
+    __slots__ = ('periodo',)
+    tipo = 'resumo'
+
+    def __init__(self, data, periodo):
+        self.data = data
+        self.periodo = periodo
+
+
+def record_from_dict(d):
+    """Reconstrói um registro a partir de `to_dict()` (ex.: payload da fila de jobs)."""
+    d = dict(d)
+    tipo = d.pop('tipo')
+    if tipo == 'venda':
+        d['itens'] = [ItemVenda(**item) for item in d['itens']]
+    elif tipo == 'compra':
+        d['itens'] = [ItemCompra(**item) for item in d['itens']]
+    return RECORD_TYPES[tipo](**d)
+
+
+RECORD_TYPES = {cls.tipo: cls for cls in (Venda, Compra, Pessoal)}
+
+
+def _field(fields, i):
+    return fields[i] if len(fields) > i else ""
+
+
+def parse_venda(fields, data, catalog):
+    """
+    Formato esperado: "Venda: [Produto] x[Quantidade], [Produto] x[Quantidade], ... - [Forma de Pagamento] - [Observações]"
+    Exemplo: "Venda: Trufa de Morango x2, Mousse de Limão x1 - PIX - Cliente Maria"
+    """
+    if len(fields) < 2:
+        return None  # Formato inválido
+
+    itens = []
+    for produto_info in fields[0].split(','):
+        produto_info = produto_info.strip()
+        if not produto_info:
+            continue
+
+        # Quantidade opcional no final do produto (x2, x3, etc.)
+        match = PRODUTO_QUANTIDADE_RE.match(produto_info)
+        if match:
+            produto = match.group('produto').lower()
+            quantidade = int(match.group('quantidade'))
+        else:
+            produto = produto_info.lower()
+            quantidade = 1
+
+        # Verificar se o produto existe no catálogo; se não, buscar o mais parecido
+        valor_unitario = catalog.produtos.get(produto)
+        if valor_unitario is None:
+            resolution = catalog.resolver.resolve(produto)
+            if resolution.sugestoes:
+                return Sugestao(data, produto_info, resolution.sugestoes)
+            if resolution.produto is None:
+                return None  # Produto não encontrado
+            produto = resolution.produto
+            valor_unitario = catalog.produtos[produto]
+
+        itens.append(ItemVenda(format_nome(produto), quantidade, valor_unitario,
+                               valor_unitario * quantidade))
+
+    if not itens:
+        return None
+
+    return Venda(data, itens, sum(item.valor_total for item in itens),
+                 fields[1], _field(fields, 2))
+
+
+def parse_compra(fields, data, catalog):
+    """
+    Formato esperado: "Compra: [Itens] - [Valor Total] - [Local] - [Forma de Pagamento] - [Observações]"
+    Exemplo: "Compra: 3 leites condensados, 2 cremes de leite, 1 granulado - 50,00 - Atacadão - Cartão - Promoção"
+    """
+    itens_info = fields[0]
+
+    # Processar os itens (formato: "3 leites condensados, 2 cremes de leite")
+    itens = []
+    for item in itens_info.split(','):
+        item = item.strip()
+        match = ITEM_COMPRA_RE.match(item)
+        if match:
+            itens.append(ItemCompra(match.group('nome').strip().lower(),
+                                    int(match.group('quantidade'))))
+        else:
+            # Se não conseguir extrair quantidade, assume 1
+            itens.append(ItemCompra(item.lower(), 1))
+
+    valor_total = parse_valor(fields[1]) if len(fields) > 1 and fields[1] else 0
+
+    return Compra(data, itens, valor_total, _field(fields, 2), _field(fields, 3),
+                  _field(fields, 4), itens_info)
+
+
+def parse_pessoal(fields, data, catalog):
+    """
+    Formato esperado: "Pessoal: [Descrição] - [Valor] - [Categoria] - [Forma de Pagamento] - [Observações]"
+    Exemplo: "Pessoal: Uber volta do mercado - 20,00 - Transporte - Cartão - Urgente"
+    """
+    descricao = fields[0]
+    valor = parse_valor(fields[1]) if len(fields) > 1 and fields[1] else 0
+
+    # Extrair ou inferir categoria com base na descrição
+    categoria = _field(fields, 2) or catalog.categorias.match(descricao)
+
+    return Pessoal(data, descricao, valor, categoria, _field(fields, 3), _field(fields, 4))
+
+
+def parse_resumo(fields, data, catalog):
+    """
+    Formato esperado: "Resumo: [hoje | semana | mês]"
+    Exemplo: "Resumo: semana"
+    """
+    periodo = fold(fields[0]) if fields[0] else 'hoje'
+    if periodo not in PERIODOS_RESUMO:
+        return None
+    return Resumo(data, periodo)
+
+
+class MessageRouter:
+    """
+    Classifica a mensagem pelo prefixo ("venda:", "compra:", ...) com uma
+    única consulta na tabela de comandos, separa os campos uma só vez e
+    entrega-os à gramática do comando. O custo por mensagem não depende do
+    número de comandos registrados.
+    """
+
+    def __init__(self, get_catalog):
+        self.get_catalog = get_catalog
+        self._commands = {}
+
+    def register(self, prefix, handler):
+        """Registra `handler(fields, data, catalog)` para mensagens que começam com `prefix:`."""
+        self._commands[prefix.lower()] = handler
+
+    def command_for(self, message):
+        """Retorna o nome do comando da mensagem, ou None se não for reconhecido."""
+        prefix, sep, _ = message.partition(':')
+        if not sep:
+            return None
+        prefix = prefix.strip().lower()
+        return prefix if prefix in self._commands else None
+
+    def parse(self, message, data=None):
+        """Analisa a mensagem e retorna o registro correspondente, ou None."""
+        prefix, sep, content = message.partition(':')
+        if not sep:
+            return None
+        handler = self._commands.get(prefix.strip().lower())
+        if handler is None:
+            return None
+        fields = [part.strip() for part in content.split('-')]
+        if data is None:
+            data = datetime.now().strftime("%d/%m/%Y")
+        try:
+            return handler(fields, data, self.get_catalog())
+        except Exception as e:
+            print(f"Erro ao analisar mensagem de {prefix.strip().lower()}: {e}")
+            return None
+
+
+def build_router(get_catalog):
+    """Cria o roteador com os comandos padrão do bot."""
+    router = MessageRouter(get_catalog)
+    router.register('venda', parse_venda)
+    router.register('compra', parse_compra)
+    router.register('pessoal', parse_pessoal)
+    router.register('resumo', parse_resumo)
+    return router
@@ -0,0 +1,161 @@
+import copy
+
+import numpy as np
+
+RECIPES_RANGE = 'Receitas!A:D'
+
+# Linhas de cabeçalho no topo da aba Receitas
+HEADER_ROWS = 4
+
+# Unidade -> (grandeza, fator para a unidade base da grandeza)
+UNIDADES = {
+    'g': ('massa', 1.0),
+    'kg': ('massa', 1000.0),
+    'ml': ('volume', 1.0),
+    'l': ('volume', 1000.0),
+    'litro': ('volume', 1000.0),
+    'litros': ('volume', 1000.0),
+    'un': ('unidade', 1.0),
+    'unidade': ('unidade', 1.0),
+}
+
+
+def convert(quantidade, de, para):
+    """Converte `quantidade` da unidade `de` para `para` (ex.: 250 g -> 0,25 kg)."""
+    de, para = de.strip().lower(), para.strip().lower()
+    if de == para:
+        return quantidade
+    try:
+        grandeza_de, fator_de = UNIDADES[de]
+        grandeza_para, fator_para = UNIDADES[para]
+    except KeyError:
+        raise ValueError(f"Unidade desconhecida: {de if de not in UNIDADES else para}")
+    if grandeza_de != grandeza_para:
+        raise ValueError(f"Não é possível converter {de} em {para}")
+    return quantidade * fator_de / fator_para
+
+
+def parse_recipes(values):
+    """
+    Converte as linhas da aba Receitas em {produto: [(ingrediente, quantidade, unidade)]}.
+    Colunas: A = produto, B = ingrediente, C = quantidade por unidade vendida, D = unidade.
+    """
+    receitas = {}
+    # Pular o cabeçalho
+    for row in values[HEADER_ROWS:]:
+        if len(row) < 3 or not row[0].strip() or not row[1].strip():
+            continue
+        try:
+            quantidade = float(str(row[2]).replace(',', '.'))
+        except ValueError:
+            continue
+        unidade = row[3].strip().lower() if len(row) > 3 and row[3].strip() else 'g'
+        receitas.setdefault(row[0].strip().lower(), []).append(
+            (row[1].strip().lower(), quantidade, unidade))
+    return receitas
+
+
+class CostTable:
+    """
+    Custo de ingredientes de cada produto.
+
+    As receitas viram uma matriz produtos x ingredientes com as quantidades já
+    convertidas para a unidade de preço de cada ingrediente; o vetor de custos
+    é o produto dessa matriz pelo vetor de preços. Quando só os preços mudam,
+    `with_prices` recalcula apenas os produtos que usam os ingredientes
+    alterados e reaproveita a matriz. A tabela não muda depois de criada.
+    """
+
+    def __init__(self, receitas, ingredientes):
+        self.receitas = {produto: tuple(itens) for produto, itens in receitas.items()}
+        self.produto_index = {produto: i for i, produto in enumerate(self.receitas)}
+        # Onde cada ingrediente aparece: {ingrediente: [(linha do produto, quantidade, unidade)]}
+        self.usos = {}
+        for produto, itens in self.receitas.items():
+            for nome, quantidade, unidade in itens:
+                self.usos.setdefault(nome, []).append((self.produto_index[produto], quantidade, unidade))
+        self.nomes = sorted(self.usos)
+        self.ingrediente_index = {nome: j for j, nome in enumerate(self.nomes)}
+        self.unidades = [None] * len(self.nomes)
+        self.precos = np.full(len(self.nomes), np.nan)
+        self.matriz = np.zeros((len(self.produto_index), len(self.nomes)))
+        for nome, j in self.ingrediente_index.items():
+            self._set_ingrediente(j, nome, ingredientes.get(nome))
+        self.custos = self._compute(self.matriz)
+
+    def _compute(self, matriz):
+        """Custos das linhas de `matriz`; NaN quando falta o preço ou a conversão de algum ingrediente."""
+        custos = np.nan_to_num(matriz) @ np.nan_to_num(self.precos)
+        incompleto = (np.isnan(matriz) | ((matriz != 0) & np.isnan(self.precos))).any(axis=1)
+        custos[incompleto] = np.nan
+        return custos
+
+    def _set_ingrediente(self, j, nome, dados):
+        """Preenche a coluna do ingrediente: preço e quantidades na unidade do preço."""
+        unidade = dados['unidade'] if dados else None
+        self.unidades[j] = unidade
+        self.precos[j] = dados['preco'] if dados else np.nan
+        self.matriz[:, j] = 0.0
+        for i, quantidade, unidade_receita in self.usos[nome]:
+            try:
+                self.matriz[i, j] += convert(quantidade, unidade_receita, unidade or unidade_receita)
+            except ValueError as e:
+                # Sem conversão possível o custo deste produto fica desconhecido
+                print(f"Custo do ingrediente {nome}: {e}")
+                self.matriz[i, j] = np.nan
+
+    def with_prices(self, ingredientes):
+        """Nova tabela com os preços de `ingredientes`; só os produtos afetados são recalculados."""
+        table = copy.copy(self)
+        table.unidades = list(self.unidades)
+        table.precos = self.precos.copy()
+        table.matriz = self.matriz
+        table.custos = self.custos.copy()
+
+        alterados = []
+        for nome, j in self.ingrediente_index.items():
+            dados = ingredientes.get(nome)
+            unidade = dados['unidade'] if dados else None
+            preco = dados['preco'] if dados else np.nan
+            if unidade == self.unidades[j] and (preco == self.precos[j]
+                                                or np.isnan(preco) and np.isnan(self.precos[j])):
+                continue
+            if unidade != self.unidades[j]:
+                # Outra unidade de preço: a coluna da matriz precisa ser convertida de novo
+                if table.matriz is self.matriz:
+                    table.matriz = self.matriz.copy()
+                table._set_ingrediente(j, nome, dados)
+            else:
+                table.precos[j] = preco
+            alterados.append(j)
+
+        if alterados:
+            linhas = np.flatnonzero(table.matriz[:, alterados].any(axis=1))
+            table.custos[linhas] = table._compute(table.matriz[linhas])
+        return table
+
+    def cost(self, produto):
+        """Custo de ingredientes de uma unidade do produto, ou None se não houver receita completa."""
+        i = self.produto_index.get(produto.lower())
+        if i is None or np.isnan(self.custos[i]):
+            return None
+        return float(self.custos[i])
+
+    def consumo(self, itens):
+        """Ingredientes gastos pelos itens vendidos: {ingrediente: (quantidade, unidade)}."""
+        total = {}
+        for produto, quantidade in itens:
+            i = self.produto_index.get(produto.lower())
+            if i is None:
+                continue
+            for j in np.flatnonzero(self.matriz[i]):
+                if np.isnan(self.matriz[i, j]) or self.unidades[j] is None:
+                    continue
+                nome = self.nomes[j]
+                atual = total.get(nome, (0.0, self.unidades[j]))[0]
+                total[nome] = (atual + float(self.matriz[i, j]) * quantidade, self.unidades[j])
+        return total
+
+    @property
+    def size(self):
+        return len(self.produto_index)
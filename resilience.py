@@ -0,0 +1,140 @@
+import os
+import time
+import threading
+from contextvars import ContextVar
+
+# Orçamento (em segundos) de cada mensagem do webhook, dividido entre todas as chamadas externas dela
+REQUEST_BUDGET = float(os.environ.get('REQUEST_BUDGET', '5'))
+
+# Folga (em segundos) reservada para gravar a mensagem e responder; abaixo dela, modo degradado
+DEGRADED_MARGIN = float(os.environ.get('DEGRADED_MARGIN', '0.5'))
+
+# Disjuntor: falhas seguidas que o abrem e por quanto tempo (em segundos) ele fica aberto
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', '5'))
+BREAKER_RESET = float(os.environ.get('BREAKER_RESET', '30'))
+
+_current_deadline = ContextVar('current_deadline', default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """O prazo da requisição acabou antes da chamada externa."""
+
+
+class CircuitOpenError(RuntimeError):
+    """O disjuntor do serviço está aberto: a chamada nem é feita."""
+
+
+class Deadline:
+    """
+    Prazo de uma unidade de trabalho (uma mensagem do webhook). Dentro do
+    bloco `with`, as chamadas externas feitas neste contexto (inclusive por
+    asyncio.to_thread, que copia o contexto) usam o que resta dele como
+    limite de espera e de timeout.
+    """
+
+    __slots__ = ('expires', 'token')
+
+    def __init__(self, budget):
+        self.expires = time.monotonic() + budget
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    def __enter__(self):
+        self.token = _current_deadline.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_deadline.reset(self.token)
+        return False
+
+
+def deadline(budget=None):
+    """Abre um prazo de `budget` segundos (REQUEST_BUDGET se omitido): `with deadline():`."""
+    return Deadline(REQUEST_BUDGET if budget is None else budget)
+
+
+def remaining():
+    """Segundos que restam do prazo em andamento neste contexto (None se não há prazo)."""
+    current = _current_deadline.get()
+    return None if current is None else current.remaining()
+
+
+def check_deadline(what):
+    """DeadlineExceeded se o prazo em andamento já acabou."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"prazo da requisição esgotado antes de {what}")
+
+
+class CircuitBreaker:
+    """
+    Disjuntor de um serviço externo (Sheets ou Twilio).
+
+    Fechado, deixa passar todas as chamadas. Depois de `failures` falhas
+    seguidas (erros de rede, timeouts e respostas 5xx) ele abre e, por
+    `reset` segundos, as chamadas falham na hora com CircuitOpenError em
+    vez de esperar pelo serviço. Passado esse tempo, uma única chamada de
+    teste é liberada: se der certo o disjuntor fecha; se falhar, abre de novo.
+    Respostas 4xx e 429 mostram que o serviço está de pé e contam como sucesso.
+    """
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset=BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failures
+        self.reset = reset
+        self._lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.opens = 0
+        self.rejected = 0
+
+    def allow(self):
+        """True se a chamada pode ser feita agora."""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def check(self):
+        """CircuitOpenError se o disjuntor não deixar a chamada passar."""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} indisponível (disjuntor aberto)")
+
+    def release(self):
+        """Devolve a vez da chamada de teste que acabou não sendo feita (ex.: o prazo acabou antes)."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.opens += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'opens': self.opens,
+                'rejected': self.rejected,
+            }
@@ -0,0 +1,113 @@
+import numpy as np
+
+from categories import tokenize
+
+# Palavras ignoradas na comparação ("trufa morango" == "trufa de morango")
+STOPWORDS = frozenset(['de', 'da', 'do', 'das', 'dos', 'com', 'e'])
+
+# Similaridade mínima (coeficiente de Dice entre trigramas) para aceitar um produto
+MIN_SCORE = 0.5
+
+# Se o segundo colocado ficar a menos desta distância do primeiro, a busca é ambígua
+AMBIGUITY_MARGIN = 0.08
+
+MAX_SUGGESTIONS = 3
+
+
+def singularize(palavra):
+    """Reduz plurais comuns do português ao singular (já sem acentos)."""
+    if len(palavra) <= 3:
+        return palavra
+    if palavra.endswith(('oes', 'aes')):
+        return palavra[:-3] + 'ao'
+    if palavra.endswith('ns'):
+        return palavra[:-2] + 'm'
+    if palavra.endswith(('res', 'zes', 'ses')):
+        return palavra[:-2]
+    if palavra.endswith('is') and len(palavra) > 4:
+        return palavra[:-2] + 'l'
+    if palavra.endswith('s'):
+        return palavra[:-1]
+    return palavra
+
+
+def normalize_product(nome):
+    """Normaliza o nome do produto: sem acentos, no singular e sem preposições."""
+    return ' '.join(singularize(t) for t in tokenize(nome) if t not in STOPWORDS)
+
+
+def trigrams(texto):
+    padded = f'  {texto} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Resolution:
+    """Resultado da busca: o produto encontrado ou as sugestões, se houver dúvida."""
+
+    __slots__ = ('produto', 'score', 'sugestoes')
+
+    def __init__(self, produto=None, score=0.0, sugestoes=()):
+        self.produto = produto
+        self.score = score
+        self.sugestoes = sugestoes
+
+
+class ProductResolver:
+    """
+    Encontra o produto do catálogo mais parecido com o nome digitado.
+
+    O índice de trigramas é construído uma vez por versão do catálogo. Uma
+    busca primeiro tenta o nome normalizado exato; se não houver, junta as
+    listas invertidas (arrays do numpy) dos trigramas da consulta e conta,
+    de uma vez para o catálogo inteiro, quantos trigramas cada produto tem
+    em comum com ela: a similaridade de todos sai dessas contagens, sem
+    comparar conjuntos produto a produto.
+    """
+
+    __slots__ = ('_names', '_sizes', '_exact', '_postings')
+
+    def __init__(self, produtos):
+        self._names = []
+        sizes = []
+        self._exact = {}
+        postings = {}
+        for produto in produtos:
+            normalized = normalize_product(produto)
+            grams = trigrams(normalized)
+            idx = len(self._names)
+            self._names.append(produto)
+            sizes.append(len(grams))
+            self._exact.setdefault(normalized, idx)
+            for gram in grams:
+                postings.setdefault(gram, []).append(idx)
+        self._sizes = np.array(sizes, dtype=np.float64)
+        self._postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def resolve(self, nome):
+        normalized = normalize_product(nome)
+        idx = self._exact.get(normalized)
+        if idx is not None:
+            return Resolution(self._names[idx], 1.0)
+
+        grams = trigrams(normalized)
+        if not grams:
+            return Resolution()
+
+        # Trigramas em comum com cada produto do catálogo e o coeficiente de Dice de todos
+        postings = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not postings:
+            return Resolution()
+        common = np.bincount(np.concatenate(postings), minlength=len(self._names))
+        scores = 2.0 * common / (len(grams) + self._sizes)
+        top = min(MAX_SUGGESTIONS, len(scores))
+        best_ids = np.argpartition(scores, -top)[-top:]
+        scored = sorted(((float(scores[i]), int(i)) for i in best_ids), reverse=True)
+        best_score, best = scored[0]
+        if best_score < MIN_SCORE:
+            return Resolution()
+
+        close = [self._names[i] for score, i in scored
+                 if score >= MIN_SCORE and best_score - score < AMBIGUITY_MARGIN]
+        if len(close) > 1:
+            return Resolution(None, best_score, tuple(close))
+        return Resolution(self._names[best], best_score)
@@ -0,0 +1,298 @@
+import os
+import threading
+from datetime import date, datetime
+
+from tracing import failures, span
+
+# Aba com o índice dos períodos arquivados (mesmo cabeçalho de 4 linhas das outras abas)
+ARCHIVE_INDEX_TAB = 'Arquivo'
+ARCHIVE_INDEX_HEADER = [['Arquivo de períodos'], [], [],
+                        ['Período', 'Aba', 'Aba de arquivo', 'Linhas', 'Arquivado em']]
+
+# Intervalo (em segundos) entre as verificações de virada de mês
+ROLLOVER_INTERVAL = float(os.environ.get('ROLLOVER_INTERVAL', '3600'))
+
+
+def period_key(data):
+    """Período ('aaaa-mm') de uma data 'dd/mm/aaaa'; None se a célula não for uma data."""
+    try:
+        parsed = datetime.strptime(str(data).strip(), '%d/%m/%Y')
+    except ValueError:
+        return None
+    return f'{parsed.year:04d}-{parsed.month:02d}'
+
+
+def archive_tab(tab, period):
+    """Nome da aba de arquivo de um período, ex.: 'Registro de Vendas 2026-09'."""
+    return f'{tab} {period}'
+
+
+def row_runs(rows):
+    """Agrupa índices de linha crescentes em intervalos contíguos [(início, fim)), fim exclusivo."""
+    runs = []
+    for row in rows:
+        if runs and runs[-1][1] == row:
+            runs[-1][1] = row + 1
+        else:
+            runs.append([row, row + 1])
+    return [tuple(run) for run in runs]
+
+
+def _cell(value):
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+
+def _delete_rows(sheet_id, rows):
+    """Pedidos deleteDimension das linhas, de baixo para cima (os índices de cima não mudam)."""
+    return [{'deleteDimension': {'range': {'sheetId': sheet_id, 'dimension': 'ROWS',
+                                           'startIndex': start, 'endIndex': end}}}
+            for start, end in reversed(row_runs(rows))]
+
+
+class TabRollover:
+    """
+    Arquivamento mensal das abas de registro.
+
+    Na virada do mês, as linhas dos meses já fechados saem das abas vivas
+    (`tabs`: {aba: última coluna}) e vão para uma aba de arquivo por aba e
+    período ("Registro de Vendas 2026-09"). Tudo é feito com operações de
+    cópia em bloco em um único batchUpdate da planilha, que o Sheets aplica
+    por inteiro ou não aplica: a aba de arquivo nasce de um duplicateSheet da
+    aba viva (mesmo cabeçalho de `header_rows` linhas, formatos e larguras)
+    do qual se apagam as linhas de outros períodos; linhas de um período já
+    arquivado (ex.: importadas depois) são copiadas com copyPaste para o fim
+    do arquivo; e as linhas arquivadas são apagadas da aba viva, que fica só
+    com o mês corrente. Cada arquivamento acrescenta uma linha na aba
+    Arquivo (período, aba, aba de arquivo, linhas, data), o índice usado por
+    `read_period` para só ler um arquivo quando aquele período é pedido.
+
+    Uma verificação custa duas leituras (as abas da planilha e a coluna A
+    das abas vivas); cada planilha é verificada uma vez por mês por
+    processo. `pause` deve impedir gravações nas abas durante o
+    arquivamento (a trava do sincronizador do ledger).
+    """
+
+    def __init__(self, tabs, get_sheet, get_targets, pause, header_rows=4,
+                 interval=ROLLOVER_INTERVAL):
+        self.tabs = tabs
+        self.get_sheet = get_sheet
+        self.get_targets = get_targets
+        self.pause = pause
+        self.header_rows = header_rows
+        self.interval = interval
+        self._checked = {}
+        self._stop = threading.Event()
+        self._pid = None
+        self.archived_rows = 0
+        self.archived_periods = 0
+        self.errors = 0
+        self.last_error = None
+
+    def _sheets(self, sheet, spreadsheet_id):
+        result = sheet.get(spreadsheetId=spreadsheet_id,
+                           fields='sheets.properties(sheetId,title,gridProperties.rowCount)').execute()
+        return {s['properties']['title']: (s['properties']['sheetId'],
+                                           s['properties'].get('gridProperties', {}).get('rowCount', 0))
+                for s in result.get('sheets', [])}
+
+    def _periods(self, sheet, spreadsheet_id, sheets):
+        """Período de cada linha de dados das abas vivas: {aba: [(índice da linha, período)]}."""
+        tabs = [tab for tab in self.tabs if tab in sheets]
+        if not tabs:
+            return {}
+        first = self.header_rows + 1
+        result = sheet.values().batchGet(spreadsheetId=spreadsheet_id,
+                                         ranges=[f'{tab}!A{first}:A' for tab in tabs]).execute()
+        ranges = result.get('valueRanges', [])
+        periods = {}
+        for i, tab in enumerate(tabs):
+            values = ranges[i].get('values', []) if len(ranges) > i else []
+            periods[tab] = [(self.header_rows + j, period_key(row[0]) if row else None)
+                            for j, row in enumerate(values)]
+        return periods
+
+    def plan(self, sheets, periods, current_period, archived_at=None):
+        """
+        Pedidos do batchUpdate que arquivam os períodos anteriores a
+        `current_period`. Retorna (pedidos, [(período, aba, aba de arquivo, linhas)]).
+        """
+        requests = []
+        index_rows = []
+        next_id = max((sheet_id for sheet_id, _ in sheets.values()), default=0) + 1
+        for tab, rows in periods.items():
+            live_id, live_count = sheets[tab]
+            closed = {}
+            archived = []
+            for row, period in rows:
+                if period is not None and period < current_period:
+                    closed.setdefault(period, []).append(row)
+            for period, period_rows in sorted(closed.items()):
+                title = archive_tab(tab, period)
+                if title not in sheets:
+                    # Cópia da aba viva inteira, da qual ficam só o cabeçalho e as linhas do período
+                    requests.append({'duplicateSheet': {'sourceSheetId': live_id, 'newSheetId': next_id,
+                                                        'newSheetName': title}})
+                    keep = set(period_rows)
+                    requests += _delete_rows(next_id, [r for r in range(self.header_rows, live_count)
+                                                       if r not in keep])
+                    sheets[title] = (next_id, self.header_rows + len(period_rows))
+                    next_id += 1
+                else:
+                    archive_id, archive_count = sheets[title]
+                    requests.append({'appendDimension': {'sheetId': archive_id, 'dimension': 'ROWS',
+                                                         'length': len(period_rows)}})
+                    for start, end in row_runs(period_rows):
+                        requests.append({'copyPaste': {
+                            'source': {'sheetId': live_id, 'startRowIndex': start, 'endRowIndex': end},
+                            'destination': {'sheetId': archive_id, 'startRowIndex': archive_count,
+                                            'endRowIndex': archive_count + end - start},
+                            'pasteType': 'PASTE_NORMAL'}})
+                        archive_count += end - start
+                    sheets[title] = (archive_id, archive_count)
+                archived += period_rows
+                index_rows.append((period, tab, title, len(period_rows)))
+            # As linhas arquivadas saem da aba viva depois de copiadas
+            requests += _delete_rows(live_id, sorted(archived))
+
+        if index_rows:
+            if ARCHIVE_INDEX_TAB not in sheets:
+                requests.append({'addSheet': {'properties': {'sheetId': next_id, 'title': ARCHIVE_INDEX_TAB}}})
+                requests.append({'appendCells': {'sheetId': next_id, 'fields': 'userEnteredValue',
+                                                 'rows': [{'values': [_cell(v) for v in row]}
+                                                          for row in ARCHIVE_INDEX_HEADER]}})
+                sheets[ARCHIVE_INDEX_TAB] = (next_id, len(ARCHIVE_INDEX_HEADER))
+            archived_at = archived_at or date.today().strftime('%d/%m/%Y')
+            requests.append({'appendCells': {'sheetId': sheets[ARCHIVE_INDEX_TAB][0], 'fields': 'userEnteredValue',
+                                             'rows': [{'values': [_cell(v) for v in row + (archived_at,)]}
+                                                      for row in index_rows]}})
+        return requests, index_rows
+
+    def roll(self, spreadsheet_id, today=None):
+        """
+        Arquiva os meses fechados da planilha. Retorna
+        [(período, aba, aba de arquivo, linhas)] do que foi arquivado.
+        """
+        today = today or date.today()
+        current_period = f'{today.year:04d}-{today.month:02d}'
+        sheet = self.get_sheet(spreadsheet_id)
+        with self.pause(), span('rollover'):
+            sheets = self._sheets(sheet, spreadsheet_id)
+            requests, index_rows = self.plan(sheets, self._periods(sheet, spreadsheet_id, sheets),
+                                             current_period, today.strftime('%d/%m/%Y'))
+            if requests:
+                sheet.batchUpdate(spreadsheetId=spreadsheet_id, body={'requests': requests}).execute()
+        self.archived_rows += sum(n for *_, n in index_rows)
+        self.archived_periods += len(index_rows)
+        return index_rows
+
+    def index(self, spreadsheet_id):
+        """Índice dos arquivos da planilha: {(aba, período): aba de arquivo}."""
+        sheet = self.get_sheet(spreadsheet_id)
+        try:
+            result = sheet.values().get(
+                spreadsheetId=spreadsheet_id,
+                range=f'{ARCHIVE_INDEX_TAB}!A{self.header_rows + 1}:C').execute()
+        except Exception as e:
+            # Planilha que nunca foi arquivada: a aba Arquivo não existe
+            if getattr(getattr(e, 'resp', None), 'status', None) == 400:
+                return {}
+            raise
+        return {(row[1], row[0]): row[2] for row in result.get('values', []) if len(row) >= 3}
+
+    def archived_tabs(self, spreadsheet_id, tab):
+        """Abas de arquivo de `tab`, em ordem de período."""
+        return [title for (source, _), title in sorted(self.index(spreadsheet_id).items())
+                if source == tab]
+
+    def read_period(self, spreadsheet_id, tab, period):
+        """
+        Linhas (sem cabeçalho) de `tab` no período 'aaaa-mm': da aba de
+        arquivo, se o período foi arquivado, senão da aba viva. Só aqui um
+        arquivo é lido.
+        """
+        sheet = self.get_sheet(spreadsheet_id)
+        last_col = self.tabs[tab]
+        source = self.index(spreadsheet_id).get((tab, period), tab)
+        result = sheet.values().get(
+            spreadsheetId=spreadsheet_id,
+            range=f'{source}!A{self.header_rows + 1}:{last_col}').execute()
+        return [row for row in result.get('values', []) if row and period_key(row[0]) == period]
+
+    def run_once(self, today=None):
+        """Verifica cada planilha uma vez por mês. Retorna quantas linhas foram arquivadas."""
+        today = today or date.today()
+        current_period = f'{today.year:04d}-{today.month:02d}'
+        total = 0
+        for _, spreadsheet_id in self.get_targets():
+            if self._checked.get(spreadsheet_id) == current_period:
+                continue
+            total += sum(n for *_, n in self.roll(spreadsheet_id, today))
+            self._checked[spreadsheet_id] = current_period
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                failures.inc('rollover')
+                print(f"Erro ao arquivar os meses fechados: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Inicia as verificações em segundo plano (uma vez por processo)."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        threading.Thread(target=self._run, name='tab-rollover', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        self._pid = None
+
+    def stats(self):
+        return {
+            'checked': dict(self._checked),
+            'archived_rows': self.archived_rows,
+            'archived_periods': self.archived_periods,
+            'errors': self.errors,
+            'last_error': self.last_error,
+        }
+
+
+def main():
+    """
+    Linha de comando do arquivamento.
+      python rollover.py run                      arquiva agora os meses fechados de cada planilha
+      python rollover.py index                    mostra o índice de arquivos da planilha configurada
+      python rollover.py read ABA AAAA-MM         mostra as linhas da aba no período
+    """
+    import sys
+    import json
+    import app
+
+    args = sys.argv[1:]
+    spreadsheet_id = app.SAMPLE_SPREADSHEET_ID
+    if args[:1] == ['run']:
+        for _, target in app.tenants.targets():
+            for period, tab, title, n in app.rollover.roll(target):
+                print(f"{target}: {n} linhas de {tab} ({period}) em {title}")
+    elif args[:1] == ['index']:
+        index = app.rollover.index(spreadsheet_id)
+        print(json.dumps({f'{tab} {period}': title for (tab, period), title in sorted(index.items())},
+                         indent=2, ensure_ascii=False))
+    elif args[:1] == ['read'] and len(args) == 3:
+        for row in app.rollover.read_period(spreadsheet_id, args[1], args[2]):
+            print('\t'.join(str(v) for v in row))
+    else:
+        print(main.__doc__)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import os
+import json
+import threading
+from datetime import datetime, timedelta
+
+# O cliente do Google (google.auth, httplib2, googleapiclient.discovery) é
+# importado só na primeira chamada ao Sheets, ou em preload(): é uma das
+# importações mais lentas do bot e não é necessária para responder a maioria
+# das mensagens, que vai só para o ledger local.
+
+# Antecedência com que o token OAuth é renovado antes de expirar
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+# Timeout (em segundos) das conexões HTTP com a API do Sheets
+HTTP_TIMEOUT = 30
+
+
+def load_discovery_document(path=None):
+    """
+    Carrega o documento de descoberta da API do Sheets v4 sem acessar a rede.
+    Usa o arquivo indicado em `path` (ou SHEETS_DISCOVERY_DOC) se existir;
+    caso contrário, usa a cópia empacotada com o google-api-python-client.
+    """
+    path = path or os.environ.get('SHEETS_DISCOVERY_DOC')
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    from googleapiclient import discovery_cache
+    return json.loads(discovery_cache.get_static_doc('sheets', 'v4'))
+
+
+def import_google_client():
+    """Importa agora os módulos do cliente do Google que get() usa."""
+    import httplib2  # noqa: F401
+    import google.auth  # noqa: F401
+    import google_auth_httplib2  # noqa: F401
+    from google.auth.transport import requests  # noqa: F401
+    from google.oauth2 import service_account  # noqa: F401
+    from googleapiclient import discovery  # noqa: F401
+
+
+class SheetsClientRegistry:
+    """
+    Registro de clientes do Google Sheets por processo.
+
+    As credenciais e o documento de descoberta são carregados uma única vez.
+    Cada thread recebe seu próprio cliente (o httplib2 não é thread-safe), que
+    mantém a conexão HTTP aberta entre as requisições. O token OAuth é
+    compartilhado e renovado antes de expirar.
+    """
+
+    def __init__(self, credentials_file='credentials.json', scopes=None):
+        self.credentials_file = credentials_file
+        self.scopes = scopes
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._generation = 0
+        self._credentials = None
+        self._discovery_doc = None
+        self._token_request = None
+        self.built = 0
+        self.reused = 0
+        self.token_refreshes = 0
+
+    def _load_credentials(self):
+        import google.auth
+        from google.oauth2 import service_account
+        if os.path.exists(self.credentials_file):
+            return service_account.Credentials.from_service_account_file(
+                self.credentials_file, scopes=self.scopes)
+        creds, _ = google.auth.default(scopes=self.scopes)
+        return creds
+
+    def _check_fork(self):
+        # Conexões abertas não podem ser compartilhadas entre processos
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._local = threading.local()
+            self._lock = threading.Lock()
+            self._token_request = None
+
+    def _ensure_token(self):
+        """Renova o token se ele expira dentro de TOKEN_REFRESH_MARGIN."""
+        creds = self._credentials
+        if creds is None or not hasattr(creds, 'refresh'):
+            return
+        expiry = getattr(creds, 'expiry', None)
+        if creds.token and expiry and expiry - datetime.utcnow() > TOKEN_REFRESH_MARGIN:
+            return
+        with self._lock:
+            expiry = getattr(creds, 'expiry', None)
+            if creds.token and expiry and expiry - datetime.utcnow() > TOKEN_REFRESH_MARGIN:
+                return
+            if self._token_request is None:
+                from google.auth.transport.requests import Request
+                self._token_request = Request()
+            creds.refresh(self._token_request)
+            self.token_refreshes += 1
+
+    def _load(self):
+        with self._lock:
+            if self._discovery_doc is None:
+                self._discovery_doc = load_discovery_document()
+            if self._credentials is None:
+                self._credentials = self._load_credentials()
+
+    def preload(self):
+        """
+        Importa o cliente do Google e carrega o documento de descoberta e as
+        credenciais agora. Chamado no master do gunicorn (preload_app), antes
+        do fork: os workers herdam tudo isso já pronto, em páginas
+        compartilhadas por cópia-na-escrita. Não abre conexões.
+        """
+        import_google_client()
+        self._load()
+
+    def get(self):
+        """Retorna o recurso `spreadsheets()` da thread atual."""
+        self._check_fork()
+        if self._credentials is None or self._discovery_doc is None:
+            self._load()
+        self._ensure_token()
+
+        sheet = getattr(self._local, 'sheet', None)
+        if sheet is not None and self._local.generation == self._generation:
+            with self._lock:
+                self.reused += 1
+            return sheet
+
+        import httplib2
+        import google_auth_httplib2
+        from googleapiclient.discovery import build_from_document
+        http = google_auth_httplib2.AuthorizedHttp(
+            self._credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        service = build_from_document(self._discovery_doc, http=http)
+        sheet = service.spreadsheets()
+        self._local.http = http
+        self._local.sheet = sheet
+        self._local.generation = self._generation
+        with self._lock:
+            self.built += 1
+        return sheet
+
+    def credentials(self):
+        """Credenciais com o token válido, para chamadas feitas sem o googleapiclient."""
+        self._check_fork()
+        if self._credentials is None:
+            self._load()
+        self._ensure_token()
+        return self._credentials
+
+    def close(self):
+        """Fecha a conexão do cliente desta thread; o próximo get() abre outra."""
+        http = getattr(self._local, 'http', None)
+        self._local.http = self._local.sheet = None
+        if http is not None:
+            http.close()
+
+    def reset(self):
+        """Descarta credenciais e clientes (ex.: após trocar o credentials.json)."""
+        with self._lock:
+            self._credentials = None
+            self._generation += 1
+
+    def stats(self):
+        """Contadores de clientes construídos e reutilizados."""
+        return {
+            'built': self.built,
+            'reused': self.reused,
+            'token_refreshes': self.token_refreshes,
+        }
@@ -0,0 +1,335 @@
+import time
+import heapq
+import random
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from googleapiclient.errors import HttpError
+
+from resilience import CircuitBreaker, DeadlineExceeded, check_deadline, remaining
+from tracing import external_calls, span
+
+# Cotas da API do Sheets (requisições por minuto, por usuário) divididas por este processo
+READ_QUOTA_PER_MINUTE = 60
+WRITE_QUOTA_PER_MINUTE = 60
+
+# Prioridades: menor número é atendido primeiro
+PRIORITY_USER = 0        # gravação de registros dos usuários
+PRIORITY_NORMAL = 1      # leituras necessárias para essas gravações
+PRIORITY_BACKGROUND = 2  # atualização do catálogo e outras tarefas periódicas
+
+# Novas tentativas depois de uma resposta 429
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 64.0
+
+
+class TokenBucket:
+    """Balde de fichas: `capacity` fichas, repostas a `rate` por segundo."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until_token(self):
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class _Lane:
+    """Fila de espera, balde e estatísticas de um tipo de chamada (leitura ou escrita)."""
+
+    def __init__(self, per_minute):
+        self.bucket = TokenBucket(per_minute)
+        self.waiting = []
+        self.blocked_until = 0.0
+        self.granted = deque()
+        self.calls = 0
+        self.throttled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class SheetsGateway:
+    """
+    Porta única para todas as chamadas à API do Google Sheets.
+
+    Cada chamada consome uma ficha do balde de leitura ou de escrita, que
+    acompanha a cota por minuto. Quando faltam fichas, as chamadas esperam em
+    uma fila por prioridade (gravações dos usuários antes da atualização do
+    catálogo). Leituras iguais (mesma planilha e intervalo) que estejam
+    pendentes ao mesmo tempo viram uma única requisição. Respostas 429 pausam
+    o tipo de chamada pelo tempo indicado em Retry-After (ou com backoff
+    exponencial) e a chamada é repetida.
+
+    Dentro de um prazo (resilience.deadline), a espera por uma ficha termina
+    com DeadlineExceeded quando o prazo acaba. O disjuntor `breaker` faz as
+    chamadas falharem na hora enquanto o Sheets estiver falhando seguidamente.
+    """
+
+    def __init__(self, read_per_minute=READ_QUOTA_PER_MINUTE,
+                 write_per_minute=WRITE_QUOTA_PER_MINUTE):
+        self._cond = threading.Condition()
+        self._lanes = {'read': _Lane(read_per_minute), 'write': _Lane(write_per_minute)}
+        self._seq = itertools.count()
+        self._inflight = {}
+        self._local = threading.local()
+        self.coalesced = 0
+        self.breaker = CircuitBreaker('sheets')
+
+    @contextmanager
+    def priority(self, priority):
+        """Define a prioridade das chamadas feitas pela thread atual dentro do bloco."""
+        previous = getattr(self._local, 'priority', None)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def _acquire(self, kind, priority):
+        lane = self._lanes[kind]
+        start = time.monotonic()
+        left = remaining()
+        give_up = None if left is None else start + left
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(lane.waiting, ticket)
+            while True:
+                now = time.monotonic()
+                if give_up is not None and now >= give_up:
+                    lane.waiting.remove(ticket)
+                    heapq.heapify(lane.waiting)
+                    self._cond.notify_all()
+                    raise DeadlineExceeded(f"prazo esgotado esperando a cota de {kind} do Sheets")
+                lane.bucket.refill(now)
+                if lane.waiting[0] == ticket:
+                    if now < lane.blocked_until:
+                        self._wait(lane.blocked_until - now, give_up, now)
+                        continue
+                    if lane.bucket.tokens >= 1:
+                        heapq.heappop(lane.waiting)
+                        lane.bucket.tokens -= 1
+                        lane.granted.append(now)
+                        lane.calls += 1
+                        waited = now - start
+                        lane.wait_total += waited
+                        lane.wait_max = max(lane.wait_max, waited)
+                        self._cond.notify_all()
+                        return
+                    self._wait(lane.bucket.time_until_token(), give_up, now)
+                else:
+                    self._wait(None, give_up, now)
+
+    def _wait(self, timeout, give_up, now):
+        if give_up is not None:
+            timeout = give_up - now if timeout is None else min(timeout, give_up - now)
+        self._cond.wait(timeout)
+
+    def acquire(self, kind, priority=None):
+        """
+        Espera a vez de uma chamada feita fora do googleapiclient (ex.: pelo
+        cliente HTTP assíncrono de asgi.py), consumindo uma ficha da cota.
+        """
+        if priority is None:
+            priority = PRIORITY_USER if kind == 'write' else PRIORITY_NORMAL
+        self._acquire(kind, priority)
+
+    def _throttle(self, kind, attempt, error):
+        self.throttle(kind, attempt, error.resp.get('retry-after') if error.resp is not None else None)
+
+    def throttle(self, kind, attempt, retry_after=None):
+        """Pausa o tipo de chamada depois de uma resposta 429 (Retry-After ou backoff exponencial)."""
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = min(BACKOFF_BASE * (2 ** attempt), BACKOFF_MAX) * random.uniform(0.5, 1.0)
+        with self._cond:
+            lane = self._lanes[kind]
+            lane.throttled += 1
+            lane.blocked_until = max(lane.blocked_until, time.monotonic() + delay)
+            self._cond.notify_all()
+
+    def _execute(self, request, kind, priority, op):
+        for attempt in range(MAX_RETRIES + 1):
+            check_deadline(f'sheets {op}')
+            self.breaker.check()
+            try:
+                self._acquire(kind, priority)
+            except DeadlineExceeded:
+                # A chamada de teste do disjuntor não chegou a ser feita
+                self.breaker.release()
+                raise
+            try:
+                result = request.execute()
+            except HttpError as e:
+                external_calls.inc('sheets', op, str(e.resp.status))
+                if e.resp.status >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if e.resp.status != 429 or attempt == MAX_RETRIES:
+                    raise
+                self._throttle(kind, attempt, e)
+            except Exception:
+                external_calls.inc('sheets', op, 'error')
+                self.breaker.record_failure()
+                raise
+            else:
+                external_calls.inc('sheets', op, 'ok')
+                self.breaker.record_success()
+                return result
+
+    def execute(self, request, kind, key=None, priority=None, op=''):
+        """
+        Executa `request` (um HttpRequest do googleapiclient) respeitando a cota.
+        Leituras com a mesma `key` pendentes ao mesmo tempo compartilham o resultado.
+        `op` identifica a operação nas métricas (ex.: 'values.append').
+        """
+        if priority is None:
+            priority = getattr(self._local, 'priority', None)
+        if priority is None:
+            priority = PRIORITY_USER if kind == 'write' else PRIORITY_NORMAL
+
+        if key is None:
+            return self._execute(request, kind, priority, op)
+
+        with self._cond:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = self._execute(request, kind, priority, op)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._cond:
+                self._inflight.pop(key, None)
+
+    def wrap(self, sheet):
+        """Envolve o recurso `spreadsheets()` para que todas as chamadas passem pelo gateway."""
+        return GatewaySheet(self, sheet)
+
+    def stats(self):
+        now = time.monotonic()
+        result = {'coalesced_reads': self.coalesced}
+        with self._cond:
+            for kind, lane in self._lanes.items():
+                while lane.granted and lane.granted[0] < now - 60:
+                    lane.granted.popleft()
+                result[kind] = {
+                    'used_last_minute': len(lane.granted),
+                    'quota_per_minute': int(lane.bucket.capacity),
+                    'queued': len(lane.waiting),
+                    'calls': lane.calls,
+                    'throttled': lane.throttled,
+                    'wait_total_s': round(lane.wait_total, 3),
+                    'wait_max_s': round(lane.wait_max, 3),
+                }
+        return result
+
+
+def _tabs(ranges):
+    """Abas citadas nos intervalos A1 ('Aba!A1:B2'), para os rótulos das métricas."""
+    return ','.join(sorted({r.split('!')[0].strip("'") for r in ranges if r}))
+
+
+def _hashable(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    return value
+
+
+def _read_key(op, kwargs):
+    """
+    Chave de agrupamento de uma leitura: a operação e todos os parâmetros
+    (valueRenderOption, dateTimeRenderOption, fields...), não só a planilha e
+    os intervalos. Leituras que pedem formatos diferentes não são agrupadas.
+    """
+    return (op,) + _hashable(kwargs)
+
+
+class _GatewayRequest:
+    __slots__ = ('_gateway', '_request', '_kind', '_key', '_op', '_tab')
+
+    def __init__(self, gateway, request, kind, key=None, op='', tab=''):
+        self._gateway = gateway
+        self._request = request
+        self._kind = kind
+        self._key = key
+        self._op = op
+        self._tab = tab
+
+    def execute(self):
+        with span('sheets', op=self._op, tab=self._tab):
+            return self._gateway.execute(self._request, self._kind, self._key, op=self._op)
+
+
+class _GatewayValues:
+    def __init__(self, gateway, values):
+        self._gateway = gateway
+        self._values = values
+
+    def get(self, **kwargs):
+        key = _read_key('get', kwargs)
+        return _GatewayRequest(self._gateway, self._values.get(**kwargs), 'read', key,
+                               'values.get', _tabs([kwargs.get('range')]))
+
+    def batchGet(self, **kwargs):
+        key = _read_key('batchGet', kwargs)
+        return _GatewayRequest(self._gateway, self._values.batchGet(**kwargs), 'read', key,
+                               'values.batchGet', _tabs(kwargs.get('ranges', ())))
+
+    def append(self, **kwargs):
+        return _GatewayRequest(self._gateway, self._values.append(**kwargs), 'write', None,
+                               'values.append', _tabs([kwargs.get('range')]))
+
+    def update(self, **kwargs):
+        return _GatewayRequest(self._gateway, self._values.update(**kwargs), 'write', None,
+                               'values.update', _tabs([kwargs.get('range')]))
+
+    def batchUpdate(self, **kwargs):
+        ranges = [d.get('range') for d in kwargs.get('body', {}).get('data', [])]
+        return _GatewayRequest(self._gateway, self._values.batchUpdate(**kwargs), 'write', None,
+                               'values.batchUpdate', _tabs(ranges))
+
+    def clear(self, **kwargs):
+        return _GatewayRequest(self._gateway, self._values.clear(**kwargs), 'write', None,
+                               'values.clear', _tabs([kwargs.get('range')]))
+
+
+class GatewaySheet:
+    """Mesma interface de `spreadsheets()`, com as chamadas passando pelo gateway."""
+
+    def __init__(self, gateway, sheet):
+        self._gateway = gateway
+        self._sheet = sheet
+
+    def values(self):
+        return _GatewayValues(self._gateway, self._sheet.values())
+
+    def get(self, **kwargs):
+        key = _read_key('spreadsheet', kwargs)
+        return _GatewayRequest(self._gateway, self._sheet.get(**kwargs), 'read', key, 'get')
+
+    def batchUpdate(self, **kwargs):
+        return _GatewayRequest(self._gateway, self._sheet.batchUpdate(**kwargs), 'write', None,
+                               'batchUpdate')
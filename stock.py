@@ -0,0 +1,202 @@
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+
+from recipes import convert
+
+STOCK_TAB = 'Controle de Estoque'
+
+# Linhas de cabeçalho no topo da aba de estoque
+HEADER_ROWS = 4
+
+
+def normalize_name(nome):
+    """Normaliza o nome de um ingrediente para busca no índice."""
+    return ' '.join(nome.lower().split())
+
+
+def _parse_quantidade(valor):
+    try:
+        return float(str(valor).replace(',', '.'))
+    except (ValueError, TypeError):
+        return 0
+
+
+class StockIndex:
+    """
+    Índice em memória da aba Controle de Estoque.
+
+    Mapeia o nome normalizado do ingrediente para a linha, a quantidade e a
+    unidade. O índice é lido uma vez e mantido atualizado a cada compra e a
+    cada baixa de ingredientes pelas vendas; ele só é relido quando outro
+    processo gravou no estoque (detectado por um contador de geração no
+    arquivo de trava) ou quando passa de `max_age` segundos, para capturar
+    edições feitas à mão na planilha.
+    """
+
+    def __init__(self, lock_path='estoque.lock', max_age=60.0):
+        self.lock_path = lock_path
+        self.max_age = max_age
+        self.items = {}
+        self.next_row = HEADER_ROWS + 1
+        self.loaded_at = 0.0
+        self.generation = None
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+
+    @contextmanager
+    def _locked(self):
+        """Trava o estoque entre threads e entre workers do gunicorn."""
+        with self._lock:
+            with open(self.lock_path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    content = f.read().strip()
+                    yield f, int(content) if content else 0
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _bump_generation(self, f, generation):
+        generation += 1
+        f.seek(0)
+        f.truncate()
+        f.write(str(generation))
+        f.flush()
+        self.generation = generation
+
+    def load(self, sheet, spreadsheet_id):
+        """Relê a aba inteira e reconstrói o índice (uma leitura)."""
+        result = sheet.values().get(spreadsheetId=spreadsheet_id,
+                                   range=f'{STOCK_TAB}!A:H').execute()
+        values = result.get('values', [])
+        self.reads += 1
+
+        items = {}
+        for i, row in enumerate(values):
+            if i < HEADER_ROWS:  # Pular cabeçalhos
+                continue
+            if len(row) > 1 and row[1].strip():
+                items[normalize_name(row[1])] = {
+                    'row': i + 1,
+                    'quantidade': _parse_quantidade(row[2]) if len(row) > 2 else 0,
+                    'unidade': row[3] if len(row) > 3 else 'g',
+                }
+        self.items = items
+        self.next_row = max(len(values) + 1, HEADER_ROWS + 1)
+        self.loaded_at = time.monotonic()
+
+    def _is_stale(self, generation):
+        return (self.generation != generation
+                or time.monotonic() - self.loaded_at > self.max_age)
+
+    def get(self, nome):
+        return self.items.get(normalize_name(nome))
+
+    def apply_purchase(self, sheet, spreadsheet_id, itens, local):
+        """
+        Soma as quantidades compradas ao estoque em um único batchUpdate.
+        Itens que ainda não existem viram novas linhas com código ING###.
+        """
+        self.apply_purchases(sheet, spreadsheet_id, [(itens, local)])
+
+    def apply_purchases(self, sheet, spreadsheet_id, compras):
+        """Aplica várias compras [(itens, local)] ao estoque em um único batchUpdate."""
+        with self._locked() as (f, generation):
+            if self._is_stale(generation):
+                self.load(sheet, spreadsheet_id)
+                self.generation = generation
+
+            # Somar itens repetidos (na mesma mensagem ou entre compras)
+            totais = {}
+            locais = {}
+            for itens, local in compras:
+                for item in itens:
+                    nome = normalize_name(item.nome)
+                    totais[nome] = totais.get(nome, 0) + item.quantidade
+                    locais.setdefault(nome, local)
+
+            data = []
+            updates = {}
+            next_row = self.next_row
+            for nome, quantidade in totais.items():
+                atual = self.items.get(nome)
+                if atual is not None:
+                    nova_quantidade = atual['quantidade'] + quantidade
+                    data.append({'range': f"{STOCK_TAB}!C{atual['row']}",
+                                 'values': [[nova_quantidade]]})
+                    updates[nome] = dict(atual, quantidade=nova_quantidade)
+                    continue
+
+                # Gerar código para o novo item
+                codigo = f"ING{next_row - HEADER_ROWS:03d}"
+                new_item_data = [
+                    codigo,
+                    ' '.join(word.capitalize() for word in nome.split()),
+                    quantidade,
+                    "g",  # Unidade padrão
+                    0,    # Preço unitário (a ser preenchido manualmente)
+                    "=C{row}*E{row}".format(row=next_row),  # Fórmula para valor total
+                    "",   # Marca
+                    locais[nome]  # Local de compra
+                ]
+                data.append({'range': f'{STOCK_TAB}!A{next_row}:H{next_row}',
+                             'values': [new_item_data]})
+                updates[nome] = {'row': next_row, 'quantidade': quantidade, 'unidade': 'g'}
+                next_row += 1
+
+            self._write(sheet, spreadsheet_id, data, updates, f, generation)
+            self.next_row = next_row
+
+    def apply_consumption(self, sheet, spreadsheet_id, consumos):
+        """
+        Dá baixa no estoque dos ingredientes gastos nas vendas em um único
+        batchUpdate. `consumos` é uma lista de {ingrediente: (quantidade, unidade)};
+        a quantidade é convertida para a unidade da linha do estoque.
+        Ingredientes que não estão no estoque são ignorados.
+        """
+        with self._locked() as (f, generation):
+            if self._is_stale(generation):
+                self.load(sheet, spreadsheet_id)
+                self.generation = generation
+
+            totais = {}
+            for consumo in consumos:
+                for nome, (quantidade, unidade) in consumo.items():
+                    nome = normalize_name(nome)
+                    atual = self.items.get(nome)
+                    if atual is None:
+                        continue
+                    try:
+                        quantidade = convert(quantidade, unidade, atual['unidade'] or unidade)
+                    except ValueError as e:
+                        print(f"Baixa de estoque de {nome}: {e}")
+                        continue
+                    totais[nome] = totais.get(nome, 0) + quantidade
+
+            data = []
+            updates = {}
+            for nome, quantidade in totais.items():
+                atual = self.items[nome]
+                nova_quantidade = round(atual['quantidade'] - quantidade, 6)
+                data.append({'range': f"{STOCK_TAB}!C{atual['row']}",
+                             'values': [[nova_quantidade]]})
+                updates[nome] = dict(atual, quantidade=nova_quantidade)
+            self._write(sheet, spreadsheet_id, data, updates, f, generation)
+
+    def _write(self, sheet, spreadsheet_id, data, updates, f, generation):
+        if not data:
+            return
+        sheet.values().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={'valueInputOption': 'USER_ENTERED', 'data': data}).execute()
+        self.writes += 1
+
+        # Manter o índice em dia sem reler a planilha
+        self.items.update(updates)
+        self._bump_generation(f, generation)
+
+    def stats(self):
+        return {'items': len(self.items), 'reads': self.reads, 'writes': self.writes}
@@ -0,0 +1,196 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+from twilio_sender import TwilioAccount
+
+# Arquivo com os negócios (inquilinos) atendidos pelo bot, além do configurado em app.py
+TENANTS_PATH = os.environ.get('TENANTS_PATH', 'tenants.json')
+
+# Quantos inquilinos, no máximo, mantêm catálogo, roteador e totais em memória
+TENANT_CACHE_SIZE = int(os.environ.get('TENANT_CACHE_SIZE', '32'))
+
+
+def normalize_number(numero):
+    """Número sem o prefixo 'whatsapp:' (como vem nos campos To e From do Twilio)."""
+    return (numero or '').replace('whatsapp:', '').strip()
+
+
+class Tenant:
+    """
+    Configuração de um negócio atendido pelo bot: o número do Twilio que
+    recebe as mensagens, a planilha e, opcionalmente, a conta do Twilio, o
+    arquivo de credenciais do Google e os remetentes autorizados.
+
+    Um inquilino parado custa só este objeto; catálogo, roteador e totais
+    ficam no TenantContext, criado na primeira mensagem.
+    """
+
+    __slots__ = ('id', 'numero', 'spreadsheet_id', 'remetentes', 'credentials_file', 'account')
+
+    def __init__(self, id, numero, spreadsheet_id, twilio_sid=None, twilio_token=None,
+                 remetentes=(), credentials_file=None):
+        self.id = id
+        self.numero = normalize_number(numero)
+        self.spreadsheet_id = spreadsheet_id
+        self.remetentes = tuple(normalize_number(r) for r in remetentes)
+        self.credentials_file = credentials_file
+        # As respostas saem sempre do número do inquilino; sem conta própria,
+        # com o SID e o token configurados em app.py
+        self.account = TwilioAccount(id, twilio_sid, twilio_token, f'whatsapp:{self.numero}')
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['id'], d['numero'], d['spreadsheet_id'],
+                   twilio_sid=d.get('twilio_sid'), twilio_token=d.get('twilio_token'),
+                   remetentes=d.get('remetentes', ()), credentials_file=d.get('credentials_file'))
+
+
+def load_tenants(path=TENANTS_PATH):
+    """
+    Lê a lista de inquilinos do arquivo JSON (uma lista de objetos com id,
+    numero, spreadsheet_id e, opcionais, twilio_sid, twilio_token,
+    remetentes e credentials_file). Sem o arquivo, a lista é vazia.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [Tenant.from_dict(d) for d in json.load(f)]
+
+
+class TenantContext:
+    """Estado em memória de um inquilino ativo: catálogo, roteador e totais do resumo."""
+
+    __slots__ = ('tenant', 'catalog', 'router', 'aggregates')
+
+    def __init__(self, tenant, catalog, router, aggregates):
+        self.tenant = tenant
+        self.catalog = catalog
+        self.router = router
+        self.aggregates = aggregates
+
+    @property
+    def account(self):
+        return self.tenant.account
+
+
+class TenantRegistry:
+    """
+    Inquilinos do bot e o estado em memória dos que estão ativos.
+
+    `resolve` escolhe o inquilino pelo número que recebeu a mensagem (To) e,
+    se nenhum for desse número, pelo remetente (From); o que não casar com
+    nenhum fica com o inquilino padrão (o configurado em app.py). `context`
+    devolve o TenantContext do inquilino, criado por `build` na primeira vez:
+    até `max_active` contextos ficam em cache e o usado há mais tempo é
+    descartado quando o limite é passado (o do inquilino padrão nunca sai).
+    """
+
+    def __init__(self, default, tenants, build, max_active=TENANT_CACHE_SIZE):
+        self.default = default
+        self.build = build
+        self.max_active = max_active
+        self._tenants = {}
+        self._by_numero = {}
+        self._by_remetente = {}
+        self._by_spreadsheet = {}
+        for tenant in tenants:
+            self.add(tenant)
+        self._active = OrderedDict()
+        self._default_context = None
+        self._building = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def add(self, tenant):
+        self._tenants[tenant.id] = tenant
+        self._by_numero[tenant.numero] = tenant
+        for remetente in tenant.remetentes:
+            self._by_remetente[remetente] = tenant
+        self._by_spreadsheet[tenant.spreadsheet_id] = tenant
+
+    def __len__(self):
+        return len(self._tenants) + 1
+
+    def resolve(self, to, sender=''):
+        """Inquilino da mensagem recebida em `to` enviada por `sender`."""
+        tenant = self._by_numero.get(normalize_number(to))
+        if tenant is None:
+            tenant = self._by_remetente.get(normalize_number(sender))
+        return tenant or self.default
+
+    def get(self, tenant_id):
+        """Inquilino pelo id ('' ou desconhecido: o padrão)."""
+        return self._tenants.get(tenant_id) or self.default
+
+    def for_spreadsheet(self, spreadsheet_id):
+        """Inquilino dono da planilha (uma planilha desconhecida, ex.: de um replay, fica com o padrão)."""
+        if spreadsheet_id == self.default.spreadsheet_id:
+            return self.default
+        return self._by_spreadsheet.get(spreadsheet_id) or self.default
+
+    def targets(self):
+        """(id do inquilino, planilha) de cada inquilino, começando pelo padrão."""
+        return [(self.default.id, self.default.spreadsheet_id)] + [
+            (tenant.id, tenant.spreadsheet_id) for tenant in self._tenants.values()]
+
+    def context(self, tenant, build=True):
+        """
+        Contexto do inquilino. Se ainda não estiver em cache, é criado (ou,
+        com build=False, devolve None). Dois pedidos simultâneos do mesmo
+        inquilino frio esperam uma única criação; uma exceção de `build`
+        chega a quem pediu.
+        """
+        if tenant is self.default:
+            if self._default_context is None:
+                self._default_context = self.build(tenant)
+            return self._default_context
+        with self._lock:
+            ctx = self._active.get(tenant.id)
+            if ctx is not None:
+                self._active.move_to_end(tenant.id)
+                self.hits += 1
+                return ctx
+            if not build:
+                return None
+            self.misses += 1
+            lock = self._building.setdefault(tenant.id, threading.Lock())
+        with lock:
+            try:
+                with self._lock:
+                    ctx = self._active.get(tenant.id)
+                if ctx is None:
+                    # Criação fora da trava geral: pode ler a planilha do inquilino.
+                    # Se `build` falhar, nada fica em cache e a próxima mensagem tenta de novo
+                    ctx = self.build(tenant)
+                    with self._lock:
+                        self._active[tenant.id] = ctx
+                        while len(self._active) > self.max_active:
+                            self._active.popitem(last=False)
+                            self.evictions += 1
+            finally:
+                with self._lock:
+                    self._building.pop(tenant.id, None)
+        return ctx
+
+    def active_contexts(self):
+        """Contextos em memória, incluindo o do inquilino padrão se já criado."""
+        with self._lock:
+            contexts = list(self._active.values())
+        if self._default_context is not None:
+            contexts.insert(0, self._default_context)
+        return contexts
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tenants': len(self),
+                'active': len(self._active),
+                'max_active': self.max_active,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
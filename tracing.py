@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import time
+import uuid
+import bisect
+import threading
+from contextvars import ContextVar
+
+# Limites (em segundos) dos histogramas de latência
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+# Prefixo dos nomes das métricas
+PREFIX = 'doce_encanto_'
+
+# Tracing ligado (TRACING=0 desliga) e logs JSON dos spans (TRACE_LOG=1 liga)
+TRACING = os.environ.get('TRACING', '1') != '0'
+TRACE_LOG = os.environ.get('TRACE_LOG', '0') == '1'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{_escape(v)}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Contador com rótulos, no formato de exposição do Prometheus."""
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    """Histograma com limites fixos; cada série guarda contagens por faixa, soma e total."""
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f'{self.name}_bucket'
+                                 f'{_labels(self.labelnames, labels, [("le", repr(bound))])} {cumulative}')
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", "+Inf")])} {count}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class Gauge:
+    """Valor lido na hora da coleta: `collect()` retorna {rótulos: valor}."""
+
+    def __init__(self, name, help, labelnames, collect):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f"Erro ao coletar a métrica {self.name}: {e}")
+            return lines
+        for labels, value in sorted(values.items()):
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Todas as métricas no formato texto do Prometheus."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+span_duration = registry.register(Histogram(
+    'span_duration_seconds', 'Duração de cada etapa do processamento',
+    ('span', 'op', 'tab')))
+external_calls = registry.register(Counter(
+    'external_calls_total', 'Chamadas às APIs externas', ('backend', 'op', 'status')))
+messages = registry.register(Counter(
+    'messages_total', 'Mensagens recebidas pelo webhook, por tipo', ('tipo',)))
+failures = registry.register(Counter(
+    'failures_total', 'Falhas, por etapa', ('stage',)))
+
+_current_trace = ContextVar('current_trace', default=None)
+
+
+class _Span:
+    __slots__ = ('name', 'op', 'tab', 'attrs', 'start')
+
+    def __init__(self, name, op, tab, attrs):
+        self.name = name
+        self.op = op
+        self.tab = tab
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        span_duration.observe(elapsed, self.name, self.op, self.tab)
+        trace = _current_trace.get()
+        if trace is not None:
+            entry = {'span': self.name, 'ms': round(elapsed * 1000, 3)}
+            if self.op:
+                entry['op'] = self.op
+            if self.tab:
+                entry['tab'] = self.tab
+            if self.attrs:
+                entry.update(self.attrs)
+            if exc_type is not None:
+                entry['error'] = exc_type.__name__
+            trace.spans.append(entry)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, op='', tab='', **attrs):
+    """
+    Mede a duração do bloco: `with span('parse'):`. A duração vai para o
+    histograma span_duration_seconds e, dentro de um trace, para o log JSON.
+    """
+    if not TRACING:
+        return _NO_SPAN
+    return _Span(name, op, tab, attrs)
+
+
+class _Trace:
+    __slots__ = ('name', 'id', 'attrs', 'spans', 'start', 'token')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.id = uuid.uuid4().hex[:16]
+        self.attrs = attrs
+        self.spans = []
+
+    def set(self, **attrs):
+        """Acrescenta atributos ao trace (ex.: o tipo da mensagem, conhecido depois da análise)."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.token = _current_trace.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        _current_trace.reset(self.token)
+        span_duration.observe(elapsed, self.name, '', '')
+        if TRACE_LOG:
+            record = {'trace': self.id, 'name': self.name, 'ms': round(elapsed * 1000, 3),
+                      'ts': round(time.time(), 3), **self.attrs, 'spans': self.spans}
+            if exc_type is not None:
+                record['error'] = exc_type.__name__
+            print(json.dumps(record, ensure_ascii=False), file=sys.stdout, flush=True)
+        return False
+
+
+class _NoTrace(_NoSpan):
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+
+_NO_TRACE = _NoTrace()
+
+
+def trace(name, **attrs):
+    """
+    Agrupa os spans de uma unidade de trabalho (uma requisição do webhook,
+    uma sincronização do ledger). Com TRACE_LOG=1, cada trace vira uma linha
+    JSON com a duração total e a de cada span.
+    """
+    if not TRACING:
+        return _NO_TRACE
+    return _Trace(name, attrs)
+
+
+def current_trace():
+    """Trace em andamento neste contexto (ou um substituto que ignora tudo)."""
+    return _current_trace.get() or _NO_TRACE
@@ -0,0 +1,244 @@
+import os
+import time
+import zlib
+import queue
+import random
+import threading
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from resilience import CircuitBreaker, remaining
+from tracing import external_calls, failures, span
+
+TWILIO_API_BASE = 'https://api.twilio.com'
+
+# Timeouts (em segundos) de conexão e de leitura de cada requisição
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+
+# Novas tentativas em respostas 429/5xx ou erros de rede
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+
+class TwilioAccount:
+    """
+    Conta do Twilio e número de envio usados no lugar dos do TwilioSender
+    (ex.: os de um inquilino). Sem `account_sid`, a mensagem sai do número
+    da conta com o SID e o token do TwilioSender. `key` é o id do inquilino.
+    """
+
+    __slots__ = ('key', 'account_sid', 'auth_token', 'from_number')
+
+    def __init__(self, key, account_sid, auth_token, from_number):
+        self.key = key
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+
+
+class TwilioSender:
+    """
+    Envio de mensagens de WhatsApp pela API REST do Twilio.
+
+    Usa uma sessão HTTP persistente (as conexões TLS são reaproveitadas), com
+    timeouts de conexão e leitura e backoff exponencial em respostas 429 e
+    5xx. `enqueue` coloca a mensagem em uma fila limitada; cada destinatário
+    cai sempre na mesma fila, drenada por uma única thread, então as
+    confirmações chegam na ordem em que foram geradas. Uma TwilioAccount
+    passada em `send`/`enqueue` troca a conta e o número de envio daquela
+    mensagem, com a mesma sessão e as mesmas filas.
+
+    Dentro de um prazo (resilience.deadline), os timeouts e as novas
+    tentativas ficam limitados ao que resta dele. Com o disjuntor `breaker`
+    aberto, o envio falha na hora e a mensagem segue para `on_failure`.
+    """
+
+    def __init__(self, account_sid, auth_token, from_number, base_url=TWILIO_API_BASE,
+                 workers=4, queue_size=1000, on_failure=None):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+        self.base_url = base_url.rstrip('/')
+        self.workers = workers
+        self.on_failure = on_failure
+        self.timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        self._queue_size = max(1, queue_size // workers)
+        self._queues = []
+        self._threads = []
+        self._pid = None
+        self._fork_lock = threading.Lock()
+        # Um fork no meio de _check_fork deixaria a trava presa no processo filho
+        os.register_at_fork(after_in_child=self._reset_fork_lock)
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.dropped = 0
+        self.breaker = CircuitBreaker('twilio')
+        self.session = self._new_session()
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers + 4)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def configure(self, account_sid, auth_token):
+        """Troca as credenciais usadas nos próximos envios."""
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+
+    def _retry_delay(self, attempt, response):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), BACKOFF_MAX)
+            except ValueError:
+                pass
+        delay = min(BACKOFF_BASE * (2 ** attempt), BACKOFF_MAX)
+        return delay * random.uniform(0.5, 1.0)
+
+    def send(self, to, message, account=None):
+        """Envia a mensagem agora (bloqueante). Retorna True se o Twilio aceitou."""
+        with span('twilio', op='messages.create'):
+            return self._send(to, message, account or self)
+
+    def _send(self, to, message, account):
+        auth = ((account.account_sid, account.auth_token) if account.account_sid
+                else (self.account_sid, self.auth_token))
+        url = f'{self.base_url}/2010-04-01/Accounts/{auth[0]}/Messages.json'
+        data = {
+            'To': f'whatsapp:{to}',
+            'From': account.from_number,
+            'Body': message
+        }
+        start = time.perf_counter()
+
+        for attempt in range(MAX_RETRIES + 1):
+            left = remaining()
+            if left is not None and left <= 0:
+                print("Prazo da requisição esgotado: envio pelo Twilio adiado")
+                break
+            if not self.breaker.allow():
+                print("Twilio indisponível (disjuntor aberto): envio adiado")
+                break
+            timeout = self.timeout if left is None else tuple(min(t, left) for t in self.timeout)
+            response = None
+            try:
+                response = self.session.post(url, data=data, auth=auth, timeout=timeout)
+            except requests.RequestException as e:
+                external_calls.inc('twilio', 'messages.create', 'error')
+                self.breaker.record_failure()
+                print(f"Erro ao enviar mensagem WhatsApp (tentativa {attempt + 1}): {e}")
+            else:
+                external_calls.inc('twilio', 'messages.create', str(response.status_code))
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if response.status_code == 201:
+                    with self._stats_lock:
+                        self.sent += 1
+                        self._latencies.append(time.perf_counter() - start)
+                    return True
+                if response.status_code != 429 and response.status_code < 500:
+                    # Erro do cliente (ex.: número inválido): não adianta repetir
+                    break
+
+            if attempt == MAX_RETRIES:
+                break
+            delay = self._retry_delay(attempt, response)
+            left = remaining()
+            if left is not None and delay >= left:
+                break
+            with self._stats_lock:
+                self.retries += 1
+            time.sleep(delay)
+
+        with self._stats_lock:
+            self.failed += 1
+        failures.inc('twilio')
+        return False
+
+    def _reset_fork_lock(self):
+        self._fork_lock = threading.Lock()
+
+    def _check_fork(self):
+        if self._pid == os.getpid():
+            return
+        with self._fork_lock:
+            if self._pid == os.getpid():
+                return
+            # Conexões e threads não sobrevivem ao fork. O pid só é gravado no
+            # fim: até lá, quem chamar enqueue espera aqui em vez de usar as
+            # filas do processo pai.
+            self.session = self._new_session()
+            self._queues = [queue.Queue(maxsize=self._queue_size) for _ in range(self.workers)]
+            self._threads = []
+            for i, q in enumerate(self._queues):
+                t = threading.Thread(target=self._worker_loop, args=(q,),
+                                     name=f'twilio-sender-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._pid = os.getpid()
+
+    def start(self):
+        """Inicia as threads de envio neste processo (idempotente)."""
+        self._check_fork()
+
+    def _worker_loop(self, q):
+        while True:
+            to, message, account = q.get()
+            try:
+                if not self.send(to, message, account) and self.on_failure:
+                    self.on_failure(to, message, account)
+            except Exception as e:
+                print(f"Erro no envio de mensagem WhatsApp: {e}")
+            finally:
+                q.task_done()
+
+    def enqueue(self, to, message, account=None):
+        """
+        Coloca a mensagem na fila de envio do destinatário.
+        Retorna False se a fila estiver cheia.
+        """
+        self._check_fork()
+        shard = zlib.crc32(to.encode('utf-8')) % len(self._queues)
+        try:
+            self._queues[shard].put_nowait((to, message, account))
+            return True
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            return False
+
+    def join(self):
+        """Aguarda o esvaziamento das filas de envio."""
+        for q in self._queues:
+            q.join()
+
+    def stats(self):
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            sent, failed, retries, dropped = self.sent, self.failed, self.retries, self.dropped
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+
+        return {
+            'sent': sent,
+            'failed': failed,
+            'retries': retries,
+            'dropped': dropped,
+            'queued': sum(q.qsize() for q in self._queues),
+            'latency_p50_ms': percentile(0.50),
+            'latency_p99_ms': percentile(0.99),
+        }